@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Measures the memory allocated to decode each key, by encoding.
+
+Ziplists, intsets and zipmaps are read whole from the dump, then decoded from memory.
+`shared` is the parser as it is, where the in-memory reader shares the bytes read from
+the dump. `copied` replaces it with a reader that copies them first, the way zipmaps used
+to be decoded. `peak` is the most memory allocated at once while a key is decoded, in bytes,
+averaged over the keys of the encoding. Needs python 3.9 or later, for tracemalloc.reset_peak.
+
+usage : python benchmarks/bench_allocations.py /path/to/dump.rdb
+"""
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+from rdbtools import parser as rdb_parser
+from rdbtools.parser import RdbParser, RdbCallback, ENCODING_MAPPING
+
+class CountingCallback(RdbCallback):
+    '''Decodes every value and only counts the elements, so nothing is kept'''
+    def __init__(self):
+        self.elements = 0
+
+    def set(self, key, value, expiry, info):
+        self.elements += 1
+
+    def hset(self, key, field, value):
+        self.elements += 1
+
+    def sadd(self, key, member):
+        self.elements += 1
+
+    def rpush(self, key, value):
+        self.elements += 1
+
+    def zadd(self, key, score, member):
+        self.elements += 1
+
+class MeasuringParser(RdbParser):
+    '''Records the raw size and the peak allocation of every value it decodes, by encoding'''
+    def __init__(self, callback):
+        RdbParser.__init__(self, callback)
+        self.stats = {}
+
+    def read_object(self, f, enc_type):
+        offset = f.tell()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        RdbParser.read_object(self, f, enc_type)
+        peak = tracemalloc.get_traced_memory()[1] - before
+        stats = self.stats.setdefault(ENCODING_MAPPING[enc_type], [0, 0, 0])
+        stats[0] += 1
+        stats[1] += f.tell() - offset
+        stats[2] += peak
+
+def copying_reader(data):
+    return io.BytesIO(bytearray(data))
+
+READERS = [
+    ('shared', rdb_parser.BytesReader),
+    ('copied', copying_reader),
+]
+
+def measure(dump_file, reader):
+    rdb_parser.BytesReader = reader
+    try:
+        start = time.time()
+        RdbParser(CountingCallback()).parse(dump_file)
+        elapsed = time.time() - start
+        tracemalloc.start()
+        try:
+            parser = MeasuringParser(CountingCallback())
+            parser.parse(dump_file)
+        finally:
+            tracemalloc.stop()
+    finally:
+        rdb_parser.BytesReader = READERS[0][1]
+    return parser.stats, elapsed
+
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    dump_file = sys.argv[1]
+    results = [(name,) + measure(dump_file, reader) for name, reader in READERS]
+    encodings = sorted(results[0][1])
+    print("%-12s %8s %12s %14s %14s %8s" % ('encoding', 'keys', 'raw bytes', 'shared peak', 'copied peak', 'ratio'))
+    for encoding in encodings:
+        keys, raw, shared = results[0][1][encoding]
+        copied = results[1][1][encoding][2]
+        print("%-12s %8d %12.1f %14.1f %14.1f %8.2f" % (encoding, keys, float(raw) / keys, float(shared) / keys,
+                                                     float(copied) / keys, float(copied) / shared if shared else 0))
+    for name, stats, elapsed in results:
+        print("%s : %.2f seconds" % (name, elapsed))
+
+if __name__ == '__main__':
+    main()
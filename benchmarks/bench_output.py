@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Counts the write calls made by the output callbacks.
+
+`fragments` is the number of writes issued by the callback, which is what used to reach
+the output file directly. `write calls` is the number of writes that now reach the file
+through the shared OutputSink.
+
+usage : python benchmarks/bench_output.py /path/to/dump.rdb
+"""
+import os
+import sys
+import time
+
+from rdbtools import RdbParser, JSONCallback, JSONLinesCallback, DiffCallback, ProtocolCallback, MemoryCallback, PrintAllKeys
+from rdbtools.output import OutputSink
+
+class CountingFile(object):
+    def __init__(self, out):
+        self._out = out
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes += len(data)
+        self._out.write(data)
+
+    def writelines(self, fragments):
+        for f in fragments:
+            self.write(f)
+
+    def flush(self):
+        self._out.flush()
+
+def make_memory_callback(sink):
+    return MemoryCallback(PrintAllKeys(sink), 64)
+
+CALLBACKS = [
+    ('json', JSONCallback),
+    ('jsonl', JSONLinesCallback),
+    ('diff', DiffCallback),
+    ('protocol', ProtocolCallback),
+    ('memory', make_memory_callback),
+]
+
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    dump_file = sys.argv[1]
+    print("%-10s %12s %12s %12s %10s" % ('command', 'fragments', 'write calls', 'bytes', 'seconds'))
+    with open(os.devnull, 'wb') as devnull:
+        for name, factory in CALLBACKS:
+            target = CountingFile(devnull)
+            sink = OutputSink(target)
+            start = time.time()
+            RdbParser(factory(sink)).parse(dump_file)
+            sink.flush()
+            elapsed = time.time() - start
+            print("%-10s %12d %12d %12d %10.2f" % (name, sink.fragments, target.writes, target.bytes, elapsed))
+
+if __name__ == '__main__':
+    main()
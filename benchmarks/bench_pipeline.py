@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Compares the output callbacks run by RdbParser with the same callbacks run by PipelineParser,
+with 1 to 4 formatter processes. The speedup needs as many free cores as processes, the
+decoding process included. Needs python 3.8 or later.
+
+It has only been run on a single core so far, where the pipelined runs take 1.2 to 2.5 times
+as long as the serial ones, which is why rdb --pipeline is marked experimental.
+
+usage : python benchmarks/bench_pipeline.py /path/to/dump.rdb
+"""
+import os
+import sys
+import time
+
+from rdbtools import RdbParser, JSONCallback, JSONLinesCallback, DiffCallback, ProtocolCallback
+from rdbtools.pipeline import PipelineParser
+
+CALLBACKS = [
+    ('json', JSONCallback),
+    ('jsonl', JSONLinesCallback),
+    ('diff', DiffCallback),
+    ('protocol', ProtocolCallback),
+]
+
+FORMATTERS = (1, 2, 3, 4)
+
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    dump_file = sys.argv[1]
+    print("%-10s %13s %s" % ('command', 'serial', " ".join("%13s" % ('%d formatters' % n if n > 1 else '1 formatter') for n in FORMATTERS)))
+    with open(os.devnull, 'wb') as devnull:
+        for name, factory in CALLBACKS:
+            start = time.time()
+            RdbParser(factory(devnull)).parse(dump_file)
+            timings = [time.time() - start]
+            for n in FORMATTERS:
+                start = time.time()
+                PipelineParser(factory, devnull, formatters=n).parse(dump_file)
+                timings.append(time.time() - start)
+            print("%-10s %s" % (name, " ".join("%13.2f" % t for t in timings)))
+
+if __name__ == '__main__':
+    main()
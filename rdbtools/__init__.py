@@ -1,10 +1,10 @@
 from rdbtools.parser import RdbCallback, RdbParser, DebugCallback
-from rdbtools.callbacks import JSONCallback, DiffCallback, ProtocolCallback, JDJSONCallback
-from rdbtools.memprofiler import MemoryCallback, PrintAllKeys, StatsAggregator
+from rdbtools.callbacks import JSONCallback, JSONLinesCallback, DiffCallback, ProtocolCallback, JDJSONCallback, FanOutCallback
+from rdbtools.memprofiler import MemoryCallback, PrintAllKeys, StatsAggregator, BoundedStatsAggregator, TopKeysReport, NamespaceAggregator, merge_states
 
 __version__ = '0.1.6'
 VERSION = tuple(map(int, __version__.split('.')))
 
 __all__ = [
-    'RdbParser', 'RdbCallback', 'JSONCallback', 'DiffCallback', 'MemoryCallback', 'ProtocolCallback', 'PrintAllKeys', 'JDJSONCallback']
+    'RdbParser', 'RdbCallback', 'JSONCallback', 'JSONLinesCallback', 'DiffCallback', 'MemoryCallback', 'ProtocolCallback', 'PrintAllKeys', 'JDJSONCallback', 'FanOutCallback']
 
@@ -0,0 +1,46 @@
+'''
+asyncio support : parsing dumps that arrive on an asyncio.StreamReader, such as a socket or
+the body of an HTTP request, without a thread per parse. Needs python 3.6 or later.
+
+Chunks are pushed to RdbParser.feed as they are read, so many dumps can be parsed concurrently
+in one event loop, each holding at most a chunk and its largest entry in memory, see RdbParser.feed.
+
+    async def handle(reader, writer):
+        async for event, args in iter_events(reader, filters={'types' : ['hash']}):
+            ...
+'''
+import inspect
+
+from rdbtools.parser import RdbParser, CALLBACK_EVENTS, EventRecorder, callback_events
+
+DEFAULT_CHUNK_SIZE = 65536
+
+async def iter_events(reader, filters = None, events = CALLBACK_EVENTS, chunk_size = DEFAULT_CHUNK_SIZE):
+    '''
+    Parses the dump read from `reader`, an asyncio.StreamReader, and yields its parse events
+    as (method name, args) tuples, in order. Only `events` are yielded.
+    Raises an exception if the stream ends before the dump does.
+    '''
+    recorder = EventRecorder(events)
+    parser = RdbParser(recorder, filters)
+    while True:
+        data = await reader.read(chunk_size)
+        if data:
+            parser.feed(data)
+        else:
+            parser.close()
+        for event in recorder.take():
+            yield event
+        if not data:
+            break
+
+async def parse_stream(reader, callback, filters = None, chunk_size = DEFAULT_CHUNK_SIZE):
+    '''
+    Parses the dump read from `reader`, an asyncio.StreamReader, and calls the methods of
+    `callback` like RdbParser.parse does. Methods can be coroutine functions, each one is
+    awaited before the next event is delivered.
+    '''
+    async for event, args in iter_events(reader, filters, callback_events(callback), chunk_size):
+        result = getattr(callback, event)(*args)
+        if inspect.isawaitable(result):
+            await result
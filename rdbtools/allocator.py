@@ -0,0 +1,96 @@
+'''
+Allocator models used by MemoryCallback to estimate how many bytes an allocation really takes.
+
+Redis asks the allocator for exactly the bytes it needs, but the allocator hands out
+blocks of fixed size classes. Small allocations are rounded up a lot, so adding up
+requested sizes underestimates memory usage.
+
+Each model precomputes a lookup table of allocated bytes for small sizes, so rounding
+a size is a single list index. Larger sizes are computed directly.
+'''
+
+# Sizes below this are answered from the precomputed table
+TABLE_SIZE = 16384
+
+class Allocator(object):
+    '''Base class for allocator models. Subclasses implement `size_class`'''
+    name = None
+
+    def __init__(self, pointer_size=8):
+        self._pointer_size = pointer_size
+        size_class = self.size_class
+        self.table = [size_class(size) for size in range(TABLE_SIZE)]
+
+    def size_class(self, size):
+        '''Returns the number of bytes used by an allocation of `size` bytes'''
+        raise NotImplementedError()
+
+    def allocated(self, size):
+        if size < TABLE_SIZE:
+            return self.table[size]
+        return self.size_class(size)
+
+class JemallocAllocator(Allocator):
+    '''
+    Size classes of jemalloc, the default allocator of redis on linux.
+
+    8 bytes, then multiples of 16 up to 128. After that, every power of two
+    is split in 4 equally spaced classes : 160, 192, 224, 256, 320, 384 ...
+    '''
+    name = 'jemalloc'
+
+    def size_class(self, size):
+        if size <= 8:
+            return 8
+        if size <= 128:
+            return (size + 15) & ~15
+        spacing = 1 << ((size - 1).bit_length() - 3)
+        return (size + spacing - 1) & ~(spacing - 1)
+
+class LibcAllocator(Allocator):
+    '''
+    glibc malloc. Every chunk has a size_t header and is aligned to two size_t,
+    with a minimum chunk of four size_t.
+    '''
+    name = 'libc'
+
+    def size_class(self, size):
+        size_t = self._pointer_size
+        alignment = 2 * size_t
+        chunk = (size + size_t + alignment - 1) & ~(alignment - 1)
+        return max(chunk, 4 * size_t)
+
+ALLOCATORS = {
+    JemallocAllocator.name : JemallocAllocator,
+    LibcAllocator.name : LibcAllocator,
+}
+
+# The flat model adds one pointer of malloc overhead to every string and does no rounding
+ALLOCATOR_FLAT = 'flat'
+ALLOCATOR_NAMES = (ALLOCATOR_FLAT, ) + tuple(sorted(ALLOCATORS))
+
+def get_allocator(allocator, pointer_size):
+    '''
+    Returns an Allocator for `allocator`, which is an Allocator instance, a name from
+    ALLOCATOR_NAMES, or None. The flat model is returned as None.
+    '''
+    if allocator is None or isinstance(allocator, Allocator):
+        return allocator
+    if allocator == ALLOCATOR_FLAT:
+        return None
+    if not allocator in ALLOCATORS:
+        raise Exception('get_allocator', 'Invalid allocator %s. Expected one of %s' % (allocator, ", ".join(ALLOCATOR_NAMES)))
+    return ALLOCATORS[allocator](pointer_size)
+
+def sds_header_size(length):
+    '''
+    Header of an sds string of `length` bytes, see sdshdr8/16/32/64 in sds.h.
+    The header holds len and alloc in the smallest integer that fits, plus a flags byte.
+    '''
+    if length < 1 << 8:
+        return 3
+    elif length < 1 << 16:
+        return 5
+    elif length < 1 << 32:
+        return 9
+    return 17
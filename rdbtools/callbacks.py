@@ -3,11 +3,15 @@ import re
 from decimal import Decimal
 import sys
 import struct
-from rdbtools.parser import RdbCallback, RdbParser
+import binascii
+from rdbtools.parser import RdbCallback, RdbParser, compile_filters, filters_match, is_noop_method
+from rdbtools.output import OutputSink, text_type, integer_types
 
-ESCAPE = re.compile(ur'[\x00-\x1f\\"\b\f\n\r\t\u2028\u2029]')
+ESCAPE = re.compile(u'[\\x00-\\x1f\\\\"\\b\\f\\n\\r\\t\u2028\u2029]')
 ESCAPE_ASCII = re.compile(r'([\\"]|[^\ -~])')
-HAS_UTF8 = re.compile(r'[\x80-\xff]')
+# the same patterns for byte strings, values are only decoded when they need escaping
+ESCAPE_ASCII_BYTES = re.compile(br'([\\"]|[^\ -~])')
+HAS_UTF8 = re.compile(br'[\x80-\xff]')
 ESCAPE_DCT = {
     '\\': '\\\\',
     '"': '\\"',
@@ -23,7 +27,7 @@ for i in range(0x20):
     ESCAPE_DCT.setdefault(chr(i), '\\u%04x' % (i,))
 
 def _floatconstants():
-    _BYTES = '7FF80000000000007FF0000000000000'.decode('hex')
+    _BYTES = binascii.unhexlify(b'7FF80000000000007FF0000000000000')
     # The struct module in Python 2.4 would get frexp() out of range here
     # when an endian is specified in the format string. Fixed in Python 2.5+
     if sys.byteorder != 'big':
@@ -33,70 +37,193 @@ def _floatconstants():
 
 NaN, PosInf, NegInf = _floatconstants()
 
+KEY_CACHE_SIZE = 100000
+KEY_CACHE_MAX_LENGTH = 256
+
 def _encode_basestring(s):
     """Return a JSON representation of a Python string"""
-    if isinstance(s, str) and HAS_UTF8.search(s) is not None:
+    if isinstance(s, bytes) and HAS_UTF8.search(s) is not None:
         s = s.decode('utf-8')
     def replace(match):
         return ESCAPE_DCT[match.group(0)]
     return u'"' + ESCAPE.sub(replace, s) + u'"'
 
+def _escape_char(s):
+    try:
+        return ESCAPE_DCT[s]
+    except KeyError:
+        n = ord(s)
+        if n < 0x10000:
+            #return '\\u{0:04x}'.format(n)
+            return '\\u%04x' % (n,)
+        else:
+            # surrogate pair
+            n -= 0x10000
+            s1 = 0xd800 | ((n >> 10) & 0x3ff)
+            s2 = 0xdc00 | (n & 0x3ff)
+            return '\\u%04x\\u%04x' % (s1, s2)
+
+def _replace_ascii(match):
+    return _escape_char(match.group(0))
+
+def _replace_byte(match):
+    # bytes of values that are not valid utf-8 are escaped one by one, as latin-1 characters
+    return _escape_char(match.group(0).decode('latin-1')).encode('ascii')
+
+def _escape_bytes(s):
+    """Escapes a byte string byte by byte, the way values that are not valid utf-8 are"""
+    return ESCAPE_ASCII_BYTES.sub(_replace_byte, s)
+
 def _encode_basestring_ascii(s):
-    """Return an ASCII-only JSON representation of a Python string
+    """Return an ASCII-only JSON representation of a Python string, as a byte string
 
     """
-    try :
-        if isinstance(s, str) and HAS_UTF8.search(s) is not None:
-            s = s.decode('utf-8')
-    except:
-        pass
-
-    def replace(match):
-        s = match.group(0)
+    if isinstance(s, bytes):
+        # Fast path : printable ASCII without quotes or backslashes needs no escaping,
+        # which is by far the common case for redis keys and values
+        if ESCAPE_ASCII_BYTES.search(s) is None:
+            return b'"' + s + b'"'
         try:
-            return ESCAPE_DCT[s]
-        except KeyError:
-            n = ord(s)
-            if n < 0x10000:
-                #return '\\u{0:04x}'.format(n)
-                return '\\u%04x' % (n,)
-            else:
-                # surrogate pair
-                n -= 0x10000
-                s1 = 0xd800 | ((n >> 10) & 0x3ff)
-                s2 = 0xdc00 | (n & 0x3ff)
-                return '\\u%04x\\u%04x' % (s1, s2)
-    return '"' + str(ESCAPE_ASCII.sub(replace, s)) + '"'
+            s = s.decode('utf-8')
+        except UnicodeDecodeError:
+            return b'"' + _escape_bytes(s) + b'"'
+    return b'"' + ESCAPE_ASCII.sub(_replace_ascii, s).encode('ascii') + b'"'
 
 def _encode(s, quote_numbers = True):
     if quote_numbers:
-        qn = '"'
+        qn = b'"'
     else:
-        qn = ''
-    if isinstance(s, int) or isinstance(s, long):
-        return qn + str(s) + qn
+        qn = b''
+    if isinstance(s, integer_types):
+        return qn + b'%d' % s + qn
     elif isinstance(s, float):
         if s != s:
-            return "NaN"
+            return b"NaN"
         elif s == PosInf:
-            return "Infinity"
+            return b"Infinity"
         elif s == NegInf:
-            return "-Infinity"
+            return b"-Infinity"
         else:
-            return qn + str(s) + qn
+            return qn + str(s).encode('ascii') + qn
     else:
         return _encode_basestring_ascii(s)
 
 def encode_key(s):
     return _encode(s, quote_numbers=True)
 
+class KeyEncoder(object):
+    """
+    encode_key with a cache of escaped string keys, kept by a callback for the length of a dump :
+    hash fields, set members and key prefixes repeat a lot across a dump. The cache is dropped
+    once it holds `size` keys, and by clear, which callbacks call at the end of the dump.
+    """
+    def __init__(self, size = KEY_CACHE_SIZE):
+        self._size = size
+        self._cache = {}
+
+    def __call__(self, s):
+        if type(s) is bytes and len(s) <= KEY_CACHE_MAX_LENGTH:
+            cache = self._cache
+            try:
+                return cache[s]
+            except KeyError:
+                pass
+            if len(cache) >= self._size:
+                cache.clear()
+            encoded = cache[s] = _encode(s, quote_numbers=True)
+            return encoded
+        return _encode(s, quote_numbers=True)
+
+    def clear(self):
+        self._cache = {}
+
 def encode_value(s):
     return _encode(s, quote_numbers=False)
 
+if bytes is str:
+    encode_key_text = encode_key
+else:
+    def encode_key_text(s):
+        """encode_key as a str, for reports formatted as text"""
+        return encode_key(s).decode('ascii')
+
+def _utf8_tail_length(data):
+    """Length of the utf-8 sequence left incomplete at the end of `data`"""
+    tail = bytearray(data[-3:])
+    for i in range(1, len(tail) + 1):
+        byte = tail[-i]
+        if byte & 0xC0 != 0x80:
+            if byte & 0xE0 == 0xC0:
+                needed = 2
+            elif byte & 0xF0 == 0xE0:
+                needed = 3
+            elif byte & 0xF8 == 0xF0:
+                needed = 4
+            else:
+                needed = 1
+            return i if i < needed else 0
+    return 0
+
+class ChunkEncoder(object):
+    """
+    Escapes a string value given in chunks, see RdbCallback.set_begin, the way encode_value
+    escapes it whole, without the quotes, so the output does not depend on the chunk size.
+
+    encode_value escapes the whole value byte by byte when it is not valid utf-8, so non ASCII
+    bytes cannot be escaped before that is known. From its first non ASCII byte, a value is held
+    until it turns out to be invalid utf-8, from where on every chunk is escaped byte by byte,
+    or until its end. ASCII text and binary values are not held, valid utf-8 text is.
+    """
+    def __init__(self):
+        # the value from its first non ASCII byte, while it can still be valid utf-8
+        self._held = bytearray()
+        # bytes at the start of _held known to be valid utf-8
+        self._checked = 0
+        self._bytewise = False
+
+    def encode(self, chunk):
+        if self._bytewise:
+            return _escape_bytes(chunk)
+        if not self._held:
+            match = HAS_UTF8.search(chunk)
+            if match is None:
+                return _encode_basestring_ascii(chunk)[1:-1]
+            head, chunk = chunk[:match.start()], chunk[match.start():]
+            head = _encode_basestring_ascii(head)[1:-1] if head else b''
+        else:
+            head = b''
+        held = self._held
+        held += chunk
+        # a sequence split at the end of the chunk is checked once the rest of it arrives
+        end = len(held) - _utf8_tail_length(held)
+        try:
+            memoryview(held)[self._checked:end].tobytes().decode('utf-8')
+        except UnicodeDecodeError:
+            return head + self._flush_bytewise()
+        self._checked = end
+        return head
+
+    def _flush_bytewise(self):
+        self._bytewise = True
+        held, self._held, self._checked = self._held, bytearray(), 0
+        return _escape_bytes(bytes(held))
+
+    def end(self):
+        if self._bytewise:
+            self._bytewise = False
+            return b''
+        if not self._held:
+            return b''
+        if self._checked < len(self._held):
+            # the value ends in the middle of a utf-8 sequence
+            return self._flush_bytewise() + self.end()
+        held, self._held, self._checked = self._held, bytearray(), 0
+        return _encode_basestring_ascii(bytes(held))[1:-1]
 
 class JSONCallback(RdbCallback):
     def __init__(self, out):
-        self._out = out
+        self._out = OutputSink.wrap(out)
+        self._encode_key = KeyEncoder()
         self._is_first_db = True
         self._has_databases = False
         self._is_first_key_in_db = True
@@ -104,97 +231,214 @@ class JSONCallback(RdbCallback):
         self._element_index = 0
 
     def start_rdb(self):
-        self._out.write('[')
+        self._out.write(b'[')
 
     def start_database(self, db_number):
         if not self._is_first_db:
-            self._out.write('},')
-        self._out.write('{')
+            self._out.write(b'},{')
+        else:
+            self._out.write(b'{')
         self._is_first_db = False
         self._has_databases = True
         self._is_first_key_in_db = True
 
     def end_database(self, db_number):
-        pass
+        self._out.flush()
 
     def end_rdb(self):
         if self._has_databases:
-            self._out.write('}')
-        self._out.write(']')
+            self._out.write(b'}]')
+        else:
+            self._out.write(b']')
+        self._out.flush()
+        self._encode_key.clear()
 
     def _start_key(self, key, length):
-        if not self._is_first_key_in_db:
-            self._out.write(',')
-        self._out.write('\r\n')
+        # Returns the separator to emit in front of the key, so that
+        # every event results in a single write
+        if self._is_first_key_in_db:
+            sep = b'\r\n'
+        else:
+            sep = b',\r\n'
         self._is_first_key_in_db = False
         self._elements_in_key = length
         self._element_index = 0
+        return sep
 
     def _end_key(self, key):
         pass
 
-    def _write_comma(self):
-        if self._element_index > 0 and self._element_index < self._elements_in_key :
-            self._out.write(',')
-        self._element_index = self._element_index + 1
+    def _comma(self):
+        index = self._element_index
+        self._element_index = index + 1
+        if index > 0 and index < self._elements_in_key :
+            return b','
+        return b''
 
     def set(self, key, value, expiry, info):
-        self._start_key(key, 0)
-        self._out.write('%s:%s' % (encode_key(key), encode_value(value)))
+        self._out.write(self._start_key(key, 0) + self._encode_key(key) + b':' + encode_value(value))
+
+    def set_begin(self, key, length, expiry, info):
+        self._chunks = ChunkEncoder()
+        self._out.write(self._start_key(key, 0) + self._encode_key(key) + b':"')
+
+    def set_chunk(self, key, chunk):
+        self._out.write(self._chunks.encode(chunk))
+
+    def set_end(self, key):
+        self._out.write(self._chunks.end() + b'"')
+        self._chunks = None
 
     def start_hash(self, key, length, expiry, info):
-        self._start_key(key, length)
-        self._out.write('%s:{' % encode_key(key))
+        self._out.write(self._start_key(key, length) + self._encode_key(key) + b':{')
 
     def hset(self, key, field, value):
-        self._write_comma()
-        self._out.write('%s:%s' % (encode_key(field), encode_value(value)))
+        self._out.write(self._comma() + self._encode_key(field) + b':' + encode_value(value))
 
     def end_hash(self, key):
         self._end_key(key)
-        self._out.write('}')
+        self._out.write(b'}')
 
     def start_set(self, key, cardinality, expiry, info):
-        self._start_key(key, cardinality)
-        self._out.write('%s:[' % encode_key(key))
+        self._out.write(self._start_key(key, cardinality) + self._encode_key(key) + b':[')
 
     def sadd(self, key, member):
-        self._write_comma()
-        self._out.write('%s' % encode_value(member))
+        self._out.write(self._comma() + encode_value(member))
 
     def end_set(self, key):
         self._end_key(key)
-        self._out.write(']')
+        self._out.write(b']')
 
     def start_list(self, key, length, expiry, info):
-        self._start_key(key, length)
-        self._out.write('%s:[' % encode_key(key))
+        self._out.write(self._start_key(key, length) + self._encode_key(key) + b':[')
 
     def rpush(self, key, value) :
-        self._write_comma()
-        self._out.write('%s' % encode_value(value))
+        self._out.write(self._comma() + encode_value(value))
 
     def end_list(self, key):
         self._end_key(key)
-        self._out.write(']')
+        self._out.write(b']')
 
     def start_sorted_set(self, key, length, expiry, info):
-        self._start_key(key, length)
-        self._out.write('%s:{' % encode_key(key))
+        self._out.write(self._start_key(key, length) + self._encode_key(key) + b':{')
 
     def zadd(self, key, score, member):
-        self._write_comma()
-        self._out.write('%s:%s' % (encode_key(member), encode_value(score)))
+        self._out.write(self._comma() + self._encode_key(member) + b':' + encode_value(score))
 
     def end_sorted_set(self, key):
         self._end_key(key)
-        self._out.write('}')
+        self._out.write(b'}')
+
+
+class JSONLinesCallback(RdbCallback):
+    '''Writes one self-contained JSON object per key, one per line (JSON Lines)
+
+        {"db":0,"type":"hash","key":"user:1","ttl":null,"value":{"name":"x"}}
+
+        `ttl` is the expiry as a unix timestamp in seconds, or null if the key does not expire.
+        Every line can be processed on its own, so the output can be split and consumed in parallel.
+    '''
+    def __init__(self, out):
+        self._out = OutputSink.wrap(out)
+        self._encode_key = KeyEncoder()
+        self._dbnum = 0
+        self._parts = []
+
+    def start_database(self, db_number):
+        self._dbnum = db_number
+
+    def end_database(self, db_number):
+        self._out.flush()
+
+    def end_rdb(self):
+        self._out.flush()
+        self._encode_key.clear()
+
+    def _start_key(self, key, data_type, expiry, opening):
+        if expiry is None:
+            ttl = b'null'
+        else:
+            ttl = b'%d' % _unix_timestamp(expiry)
+        self._parts = [b'{"db":%d,"type":"%s","key":%s,"ttl":%s,"value":%s' % (
+            self._dbnum, data_type, self._encode_key(key), ttl, opening)]
+
+    def _end_key(self, closing):
+        parts = self._parts
+        parts.append(closing)
+        self._out.writev(parts)
+        self._parts = []
+
+    def set(self, key, value, expiry, info):
+        self._start_key(key, b'string', expiry, encode_value(value))
+        self._end_key(b'}\n')
+
+    def set_begin(self, key, length, expiry, info):
+        self._chunks = ChunkEncoder()
+        self._start_key(key, b'string', expiry, b'"')
+        self._out.writev(self._parts)
+        self._parts = []
+
+    def set_chunk(self, key, chunk):
+        self._out.write(self._chunks.encode(chunk))
+
+    def set_end(self, key):
+        self._out.write(self._chunks.end() + b'"}\n')
+        self._chunks = None
+
+    def start_hash(self, key, length, expiry, info):
+        self._start_key(key, b'hash', expiry, b'{')
+
+    def hset(self, key, field, value):
+        parts = self._parts
+        if len(parts) > 1:
+            parts.append(b',')
+        parts.append(self._encode_key(field) + b':' + encode_value(value))
+
+    def end_hash(self, key):
+        self._end_key(b'}}\n')
+
+    def start_set(self, key, cardinality, expiry, info):
+        self._start_key(key, b'set', expiry, b'[')
+
+    def sadd(self, key, member):
+        parts = self._parts
+        if len(parts) > 1:
+            parts.append(b',')
+        parts.append(encode_value(member))
+
+    def end_set(self, key):
+        self._end_key(b']}\n')
+
+    def start_list(self, key, length, expiry, info):
+        self._start_key(key, b'list', expiry, b'[')
+
+    def rpush(self, key, value):
+        parts = self._parts
+        if len(parts) > 1:
+            parts.append(b',')
+        parts.append(encode_value(value))
+
+    def end_list(self, key):
+        self._end_key(b']}\n')
+
+    def start_sorted_set(self, key, length, expiry, info):
+        self._start_key(key, b'sortedset', expiry, b'{')
+
+    def zadd(self, key, score, member):
+        parts = self._parts
+        if len(parts) > 1:
+            parts.append(b',')
+        parts.append(self._encode_key(member) + b':' + encode_value(score))
+
+    def end_sorted_set(self, key):
+        self._end_key(b'}}\n')
 
 
 
 class JDJSONCallback(RdbCallback):
     def __init__(self, out):
-        self._out = out
+        self._out = OutputSink.wrap(out)
+        self._encode_key = KeyEncoder()
         self._is_first_db = True
         self._has_databases = False
         self._is_first_key_in_db = True
@@ -207,25 +451,26 @@ class JDJSONCallback(RdbCallback):
 
     def start_database(self, db_number):
         if not self._is_first_db:
-            self._out.write('},')
+            self._out.write(b'},')
         #self._out.write('{')
         self._is_first_db = False
         self._has_databases = True
         self._is_first_key_in_db = True
 
     def end_database(self, db_number):
-        pass
+        self._out.flush()
 
     def end_rdb(self):
         #if self._has_databases:
         #    self._out.write('}')
         #self._out.write(']')
-        pass
+        self._out.flush()
+        self._encode_key.clear()
 
     def _start_key(self, key, length):
         if not self._is_first_key_in_db:
-            self._out.write(',')
-        self._out.write('\r\n')
+            self._out.write(b',')
+        self._out.write(b'\r\n')
         self._is_first_key_in_db = False
         self._elements_in_key = length
         self._element_index = 0
@@ -235,57 +480,57 @@ class JDJSONCallback(RdbCallback):
 
     def _write_comma(self):
         if self._element_index > 0 and self._element_index < self._elements_in_key :
-            self._out.write(',')
+            self._out.write(b',')
         self._element_index = self._element_index + 1
 
     def set(self, key, value, expiry, info):
         #self._start_key(key, 0)
-        self._out.write('%s,%s' % (encode_key(key), encode_value(value)))
-        self._out.write('\n')
+        self._out.write(b'%s,%s' % (self._encode_key(key), encode_value(value)))
+        self._out.write(b'\n')
 
     def start_hash(self, key, length, expiry, info):
         self._start_key(key, length)
-        self._out.write('%s:{' % encode_key(key))
+        self._out.write(b'%s:{' % self._encode_key(key))
 
     def hset(self, key, field, value):
         self._write_comma()
-        self._out.write('%s:%s' % (encode_key(field), encode_value(value)))
+        self._out.write(b'%s:%s' % (self._encode_key(field), encode_value(value)))
 
     def end_hash(self, key):
         self._end_key(key)
-        self._out.write('}')
+        self._out.write(b'}')
 
     def start_set(self, key, cardinality, expiry, info):
         self._start_key(key, cardinality)
-        self._out.write('%s:[' % encode_key(key))
+        self._out.write(b'%s:[' % self._encode_key(key))
 
     def sadd(self, key, member):
         self._write_comma()
-        self._out.write('%s' % encode_value(member))
+        self._out.write(b'%s' % encode_value(member))
 
     def end_set(self, key):
         self._end_key(key)
-        self._out.write(']')
+        self._out.write(b']')
 
     def start_list(self, key, length, expiry, info):
         self._start_key(key, length)
-        self._out.write('%s:[' % encode_key(key))
+        self._out.write(b'%s:[' % self._encode_key(key))
 
     def rpush(self, key, value) :
         self._write_comma()
-        self._out.write('%s' % encode_value(value))
+        self._out.write(b'%s' % encode_value(value))
 
     def end_list(self, key):
         self._end_key(key)
-        self._out.write(']')
+        self._out.write(b']')
 
     def start_sorted_set(self, key, length, expiry, info):
         self._start_key(key, length)
-        self._out.write('%s:{' % encode_key(key))
+        self._out.write(b'%s:{' % self._encode_key(key))
 
     def zadd(self, key, score, member):
         self._write_comma()
-        self._out.write('%s:%s' % (encode_key(member), encode_value(score)))
+        self._out.write(b'%s:%s' % (self._encode_key(member), encode_value(score)))
 
     def end_sorted_set(self, key):
         self._end_key(key)
@@ -297,7 +542,8 @@ class DiffCallback(RdbCallback):
     '''Prints the contents of RDB in a format that is unix sort friendly,
         so that two rdb files can be diffed easily'''
     def __init__(self, out):
-        self._out = out
+        self._out = OutputSink.wrap(out)
+        self._encode_key = KeyEncoder()
         self._index = 0
         self._dbnum = 0
 
@@ -308,21 +554,31 @@ class DiffCallback(RdbCallback):
         self._dbnum = db_number
 
     def end_database(self, db_number):
-        pass
+        self._out.flush()
 
     def end_rdb(self):
-        pass
+        self._out.flush()
+        self._encode_key.clear()
 
     def set(self, key, value, expiry, info):
-        self._out.write('db=%d %s -> %s' % (self._dbnum, encode_key(key), encode_value(value)))
-        self.newline()
+        self._out.write(b'db=%d %s -> %s\r\n' % (self._dbnum, self._encode_key(key), encode_value(value)))
+
+    def set_begin(self, key, length, expiry, info):
+        self._chunks = ChunkEncoder()
+        self._out.write(b'db=%d %s -> "' % (self._dbnum, self._encode_key(key)))
+
+    def set_chunk(self, key, chunk):
+        self._out.write(self._chunks.encode(chunk))
+
+    def set_end(self, key):
+        self._out.write(self._chunks.end() + b'"\r\n')
+        self._chunks = None
 
     def start_hash(self, key, length, expiry, info):
         pass
 
     def hset(self, key, field, value):
-        self._out.write('db=%d %s . %s -> %s' % (self._dbnum, encode_key(key), encode_key(field), encode_value(value)))
-        self.newline()
+        self._out.write(b'db=%d %s . %s -> %s\r\n' % (self._dbnum, self._encode_key(key), self._encode_key(field), encode_value(value)))
 
     def end_hash(self, key):
         pass
@@ -331,8 +587,7 @@ class DiffCallback(RdbCallback):
         pass
 
     def sadd(self, key, member):
-        self._out.write('db=%d %s { %s }' % (self._dbnum, encode_key(key), encode_value(member)))
-        self.newline()
+        self._out.write(b'db=%d %s { %s }\r\n' % (self._dbnum, self._encode_key(key), encode_value(member)))
 
     def end_set(self, key):
         pass
@@ -341,8 +596,7 @@ class DiffCallback(RdbCallback):
         self._index = 0
 
     def rpush(self, key, value) :
-        self._out.write('db=%d %s[%d] -> %s' % (self._dbnum, encode_key(key), self._index, encode_value(value)))
-        self.newline()
+        self._out.write(b'db=%d %s[%d] -> %s\r\n' % (self._dbnum, self._encode_key(key), self._index, encode_value(value)))
         self._index = self._index + 1
 
     def end_list(self, key):
@@ -352,24 +606,31 @@ class DiffCallback(RdbCallback):
         self._index = 0
 
     def zadd(self, key, score, member):
-        self._out.write('db=%d %s[%d] -> {%s, score=%s}' % (self._dbnum, encode_key(key), self._index, encode_key(member), encode_value(score)))
-        self.newline()
+        self._out.write(b'db=%d %s[%d] -> {%s, score=%s}\r\n' % (self._dbnum, self._encode_key(key), self._index, self._encode_key(member), encode_value(score)))
         self._index = self._index + 1
 
     def end_sorted_set(self, key):
         pass
 
     def newline(self):
-        self._out.write('\r\n')
+        self._out.write(b'\r\n')
 
 
 def _unix_timestamp(dt):
      return calendar.timegm(dt.utctimetuple())
 
+def _protocol_arg(arg):
+    # Bulk string lengths are in bytes, so everything is sent as an encoded byte string
+    if isinstance(arg, bytes):
+        return arg
+    if isinstance(arg, text_type):
+        return arg.encode('utf-8')
+    return str(arg).encode('ascii')
+
 
 class ProtocolCallback(RdbCallback):
     def __init__(self, out):
-        self._out = out
+        self._out = OutputSink.wrap(out)
         self.reset()
 
     def reset(self):
@@ -395,20 +656,42 @@ class ProtocolCallback(RdbCallback):
             self.expireat(key, self.get_expiry_seconds(key))
 
     def emit(self, *args):
-        self._out.write(u"*" + unicode(len(args)) + u"\r\n")
+        parts = [b'*%d\r\n' % len(args)]
         for arg in args:
-            self._out.write(u"$" + unicode(len(unicode(arg))) + u"\r\n")
-            self._out.write(unicode(arg) + u"\r\n")
+            arg = _protocol_arg(arg)
+            parts.append(b'$%d\r\n' % len(arg))
+            parts.append(arg)
+            parts.append(b'\r\n')
+        self._out.writev(parts)
 
     def start_database(self, db_number):
         self.reset()
         self.select(db_number)
 
+    def end_database(self, db_number):
+        self._out.flush()
+
+    def end_rdb(self):
+        self._out.flush()
+
     # String handling
 
     def set(self, key, value, expiry, info):
         self.pre_expiry(key, expiry)
-        self.emit('SET', key, value)
+        self.emit(b'SET', key, value)
+        self.post_expiry(key)
+
+    def set_begin(self, key, length, expiry, info):
+        # the length of the value is known up front, so its chunks are written as they come
+        self.pre_expiry(key, expiry)
+        key = _protocol_arg(key)
+        self._out.writev([b'*3\r\n$3\r\nSET\r\n$%d\r\n' % len(key), key, b'\r\n$%d\r\n' % length])
+
+    def set_chunk(self, key, chunk):
+        self._out.write(chunk)
+
+    def set_end(self, key):
+        self._out.write(b'\r\n')
         self.post_expiry(key)
 
     # Hash handling
@@ -417,7 +700,7 @@ class ProtocolCallback(RdbCallback):
         self.pre_expiry(key, expiry)
 
     def hset(self, key, field, value):
-        self.emit('HSET', key, field, value)
+        self.emit(b'HSET', key, field, value)
 
     def end_hash(self, key):
         self.post_expiry(key)
@@ -428,7 +711,7 @@ class ProtocolCallback(RdbCallback):
         self.pre_expiry(key, expiry)
 
     def sadd(self, key, member):
-        self.emit('SADD', key, member)
+        self.emit(b'SADD', key, member)
 
     def end_set(self, key):
         self.post_expiry(key)
@@ -439,7 +722,7 @@ class ProtocolCallback(RdbCallback):
         self.pre_expiry(key, expiry)
 
     def rpush(self, key, value):
-        self.emit('RPUSH', key, value)
+        self.emit(b'RPUSH', key, value)
 
     def end_list(self, key):
         self.post_expiry(key)
@@ -450,7 +733,7 @@ class ProtocolCallback(RdbCallback):
         self.pre_expiry(key, expiry)
 
     def zadd(self, key, score, member):
-        self.emit('ZADD', key, score, member)
+        self.emit(b'ZADD', key, score, member)
 
     def end_sorted_set(self, key):
         self.post_expiry(key)
@@ -458,7 +741,139 @@ class ProtocolCallback(RdbCallback):
     # Other misc commands
 
     def select(self, db_number):
-        self.emit('SELECT', db_number)
+        self.emit(b'SELECT', db_number)
 
     def expireat(self, key, timestamp):
-        self.emit('EXPIREAT', key, timestamp)
+        self.emit(b'EXPIREAT', key, timestamp)
+
+
+class FanOutCallback(RdbCallback):
+    '''Forwards parse events to several callbacks, so that one parse produces several reports
+
+        `outputs` is a list of callbacks, or of (callback, filters) tuples where `filters`
+        is a filter dictionary as described in RdbParser. Keys that do not match the filters
+        of an output are not forwarded to it.
+
+        Values are decoded once by the parser and the same objects are passed to every callback.
+        The parser itself should be given `union_filters` of the output filters, so that keys
+        nobody wants are skipped without being decoded.
+    '''
+    def __init__(self, outputs):
+        self._outputs = []
+        for output in outputs:
+            if isinstance(output, tuple):
+                callback, filters = output
+            else:
+                callback, filters = output, None
+            self._outputs.append((callback, compile_filters(filters) if filters else None))
+        self._callbacks = [callback for callback, filters in self._outputs]
+        # callbacks that take long strings in chunks, the others get them whole
+        self._streaming = [callback for callback in self._callbacks
+                           if getattr(callback, 'set_begin', None) is not None and not is_noop_method(callback.set_begin)]
+        self._dbnum = 0
+        self._active = []
+
+    def _start_key(self, key, logical_type):
+        active = []
+        for callback, filters in self._outputs:
+            if filters is None or filters_match(filters, self._dbnum, key, logical_type):
+                active.append(callback)
+        self._active = active
+        return active
+
+    def start_rdb(self):
+        for callback in self._callbacks:
+            callback.start_rdb()
+
+    def start_database(self, db_number):
+        self._dbnum = db_number
+        for callback in self._callbacks:
+            callback.start_database(db_number)
+
+    def end_database(self, db_number):
+        for callback in self._callbacks:
+            callback.end_database(db_number)
+
+    def end_rdb(self):
+        for callback in self._callbacks:
+            callback.end_rdb()
+
+    def set(self, key, value, expiry, info):
+        for callback in self._start_key(key, 'string'):
+            callback.set(key, value, expiry, info)
+
+    def set_begin(self, key, length, expiry, info):
+        self._string = (expiry, info)
+        self._chunk_callbacks = []
+        self._chunks = None
+        for callback in self._start_key(key, 'string'):
+            if callback in self._streaming:
+                callback.set_begin(key, length, expiry, info)
+                self._chunk_callbacks.append(callback)
+            else:
+                self._chunks = []
+
+    def set_chunk(self, key, chunk):
+        for callback in self._chunk_callbacks:
+            callback.set_chunk(key, chunk)
+        if self._chunks is not None:
+            self._chunks.append(chunk)
+
+    def set_end(self, key):
+        for callback in self._chunk_callbacks:
+            callback.set_end(key)
+        if self._chunks is not None:
+            value = b''.join(self._chunks)
+            self._chunks = None
+            expiry, info = self._string
+            for callback in self._active:
+                if not callback in self._streaming:
+                    callback.set(key, value, expiry, info)
+
+    def start_hash(self, key, length, expiry, info):
+        for callback in self._start_key(key, 'hash'):
+            callback.start_hash(key, length, expiry, info)
+
+    def hset(self, key, field, value):
+        for callback in self._active:
+            callback.hset(key, field, value)
+
+    def end_hash(self, key):
+        for callback in self._active:
+            callback.end_hash(key)
+
+    def start_set(self, key, cardinality, expiry, info):
+        for callback in self._start_key(key, 'set'):
+            callback.start_set(key, cardinality, expiry, info)
+
+    def sadd(self, key, member):
+        for callback in self._active:
+            callback.sadd(key, member)
+
+    def end_set(self, key):
+        for callback in self._active:
+            callback.end_set(key)
+
+    def start_list(self, key, length, expiry, info):
+        for callback in self._start_key(key, 'list'):
+            callback.start_list(key, length, expiry, info)
+
+    def rpush(self, key, value):
+        for callback in self._active:
+            callback.rpush(key, value)
+
+    def end_list(self, key):
+        for callback in self._active:
+            callback.end_list(key)
+
+    def start_sorted_set(self, key, length, expiry, info):
+        for callback in self._start_key(key, 'sortedset'):
+            callback.start_sorted_set(key, length, expiry, info)
+
+    def zadd(self, key, score, member):
+        for callback in self._active:
+            callback.zadd(key, score, member)
+
+    def end_sorted_set(self, key):
+        for callback in self._active:
+            callback.end_sorted_set(key)
@@ -1,88 +1,332 @@
 #!/usr/bin/env python
 import os
 import sys
+import time
 from optparse import OptionParser
-from rdbtools import RdbParser, JSONCallback, DiffCallback, MemoryCallback, ProtocolCallback, PrintAllKeys
-from rdbtools.callbacks import JDJSONCallback
+from rdbtools import RdbParser, JSONCallback, JSONLinesCallback, DiffCallback, MemoryCallback, ProtocolCallback, PrintAllKeys
+from rdbtools.callbacks import JDJSONCallback, FanOutCallback
+from rdbtools.parser import union_filters, DEFAULT_STRING_CHUNK_SIZE
+from rdbtools.memprofiler import SKIPLIST_MODELS, SKIPLIST_MODEL_EXPECTED, TopKeysReport, DEFAULT_TOP_KEYS
+from rdbtools.allocator import ALLOCATOR_NAMES, ALLOCATOR_FLAT
+from rdbtools.output import open_output, new_compressor, codec_for_filename, CODECS, DEFAULT_COMPRESS_BUFFERS
+from rdbtools.records import RecordWriter
+from rdbtools.sqlite import SqliteWriter
+from rdbtools.resp import RespConnection, DEFAULT_PORT
+from rdbtools.replication import parse_replica
+from rdbtools.instrument import InstrumentedParser, KeyMemoryProfile, DEFAULT_INSTRUMENT_TOP
+from rdbtools.pipeline import PipelineParser, PIPELINE_AVAILABLE
+from rdbtools.cluster import expand_paths, run_nodes, throughput, write_summary
 
 VALID_TYPES = ("hash", "set", "string", "list", "sortedset")
+VALID_COMMANDS = ("json", "jsonl", "diff", "memory", "topkeys", "sqlite", "protocol")
+MEMORY_FORMATS = ("csv", "binary")
+# commands whose callbacks can run in the formatter processes of --pipeline
+PIPELINE_COMMANDS = ("json", "jsonl", "diff", "protocol")
+
+def add_command(option, opt_str, value, parser):
+    command, sep, output = value.partition(':')
+    if not command in VALID_COMMANDS:
+        raise Exception('Invalid Command %s' % command)
+    parser.values.outputs.append({'command' : command, 'output' : output or None, 'options' : {}})
+
+def add_filter(option, opt_str, value, parser):
+    # Filters given before the first -c apply to every output,
+    # filters given after a -c apply to that output only
+    if parser.values.outputs:
+        scope = parser.values.outputs[-1]['options']
+    else:
+        scope = parser.values.global_filters
+    if option.dest == 'keys':
+        scope['keys'] = value
+    else:
+        scope.setdefault(option.dest, []).append(value)
+
+def build_filters(options):
+    filters = {}
+    if options.get('dbs'):
+        filters['dbs'] = []
+        for x in options['dbs']:
+            try:
+                filters['dbs'].append(int(x))
+            except ValueError:
+                raise Exception('Invalid database number %s' %x)
+
+    if options.get('keys'):
+        filters['keys'] = options['keys']
+
+    if options.get('types'):
+        filters['types'] = []
+        for x in options['types']:
+            if not x in VALID_TYPES:
+                raise Exception('Invalid type provided - %s. Expected one of %s' % (x, (", ".join(VALID_TYPES))))
+            else:
+                filters['types'].append(x)
+    return filters
+
+def create_callback(command, out, to_file, options):
+    if 'diff' == command:
+        return DiffCallback(out)
+    elif 'json' == command:
+        if to_file:
+            return JDJSONCallback(out)
+        return JSONCallback(out)
+    elif 'jsonl' == command:
+        return JSONLinesCallback(out)
+    elif 'memory' == command:
+        if options.memory_format == 'binary':
+            reporter = RecordWriter(out, options.min_bytes, options.min_elements)
+        else:
+            reporter = PrintAllKeys(out, options.min_bytes, options.min_elements)
+        return MemoryCallback(reporter, 64, skiplist_model=options.skiplist_model, seed=options.seed, allocator=options.allocator)
+    elif 'sqlite' == command:
+        # out is the name of the database file, sqlite writes it by itself
+        reporter = SqliteWriter(out, options.min_bytes, options.min_elements)
+        return MemoryCallback(reporter, 64, skiplist_model=options.skiplist_model, seed=options.seed, allocator=options.allocator)
+    elif 'topkeys' == command:
+        reporter = TopKeysReport(out, options.top, options.alert_bytes, options.alert_elements, sys.stderr)
+        return MemoryCallback(reporter, 64, skiplist_model=options.skiplist_model, seed=options.seed, allocator=options.allocator)
+    elif 'protocol' == command:
+        return ProtocolCallback(out)
+    else:
+        raise Exception('Invalid Command %s' % command)
+
+class CallbackFactory(object):
+    '''Creates the callback of `command` around the file it is given, in the formatter processes of --pipeline'''
+    def __init__(self, command, to_file, options):
+        self.command = command
+        self.to_file = to_file
+        self.options = options
+
+    def __call__(self, out):
+        return create_callback(self.command, out, self.to_file, self.options)
+
 def main():
     usage = """usage: %prog [options] /path/to/dump.rdb
 
-Example : %prog --command json -k "user.*" /var/redis/6379/dump.rdb"""
+Example 1 : %prog --command json -k "user.*" /var/redis/6379/dump.rdb
+Example 2 : %prog -n 0 -c memory:memory.csv -c json:users.json -k "user.*" -c diff:dump.diff.gz /var/redis/6379/dump.rdb
+Example 3 : %prog -c memory -f memory.csv --replica localhost:6379 --save dump.rdb
+Example 4 : %prog -c memory:memory.csv "/backups/cluster/*.rdb", writes memory.<node>.csv for every dump file"""
 
     parser = OptionParser(usage=usage)
-    parser.add_option("-c", "--command", dest="command",
-                  help="Command to execute. Valid commands are json, diff, and protocol", metavar="FILE")
+    parser.set_defaults(outputs=[], global_filters={})
+    parser.add_option("-c", "--command", dest="command", type="string", action="callback", callback=add_command,
+                  help="""Command to execute. Valid commands are json, jsonl, diff, memory, topkeys, sqlite and protocol.
+                    Use command:outfile and repeat -c to produce several outputs from a single parse.
+                    -n, -k and -t given after a -c only apply to that output""", metavar="COMMAND[:FILE]")
     parser.add_option("-f", "--file", dest="output",
                   help="Output file", metavar="FILE")
-    parser.add_option("-n", "--db", dest="dbs", action="append",
+    parser.add_option("-n", "--db", dest="dbs", type="string", action="callback", callback=add_filter,
                   help="Database Number. Multiple databases can be provided. If not specified, all databases will be included.")
-    parser.add_option("-k", "--key", dest="keys", default=None,
+    parser.add_option("-k", "--key", dest="keys", type="string", action="callback", callback=add_filter,
                   help="Keys to export. This can be a regular expression")
-    parser.add_option("-t", "--type", dest="types", action="append",
+    parser.add_option("-t", "--type", dest="types", type="string", action="callback", callback=add_filter,
                   help="""Data types to include. Possible values are string, hash, set, sortedset, list. Multiple typees can be provided.
                     If not specified, all data types will be returned""")
+    parser.add_option("--skiplist-model", dest="skiplist_model", default=SKIPLIST_MODEL_EXPECTED,
+                  help="""How the memory command accounts for skiplist levels of sorted sets. Valid values are %s.
+                    Defaults to %s, which is reproducible and costs O(1) per key""" % (", ".join(SKIPLIST_MODELS), SKIPLIST_MODEL_EXPECTED))
+    parser.add_option("--seed", dest="seed", type="int", default=0,
+                  help="Random seed for the simulated skiplist model. Defaults to 0")
+    parser.add_option("--allocator", dest="allocator", default=ALLOCATOR_FLAT, type="choice", choices=ALLOCATOR_NAMES,
+                  help="""Allocator model of the memory command. Valid values are %s.
+                    Defaults to %s, which adds a fixed overhead to every string""" % (", ".join(ALLOCATOR_NAMES), ALLOCATOR_FLAT))
+    parser.add_option("--min-bytes", dest="min_bytes", type="int", default=0,
+                  help="memory and sqlite commands : only report keys using at least this many bytes")
+    parser.add_option("--min-elements", dest="min_elements", type="int", default=0,
+                  help="memory and sqlite commands : only report keys with at least this many elements")
+    parser.add_option("--memory-format", dest="memory_format", default="csv", type="choice", choices=MEMORY_FORMATS,
+                  help="""Output format of the memory command. Valid values are csv and binary.
+                    binary files can be read back with rdbtools.records.RecordFile. Defaults to csv""")
+    parser.add_option("--top", dest="top", type="int", default=DEFAULT_TOP_KEYS,
+                  help="Number of keys the topkeys command reports overall, per type and per database. Defaults to %d" % DEFAULT_TOP_KEYS)
+    parser.add_option("--alert-bytes", dest="alert_bytes", type="int", default=None,
+                  help="topkeys command : report keys using at least this many bytes on stderr as soon as they are parsed")
+    parser.add_option("--alert-elements", dest="alert_elements", type="int", default=None,
+                  help="topkeys command : report keys with at least this many elements on stderr as soon as they are parsed")
+    parser.add_option("-z", "--compress", dest="compress", default="auto",
+                  help="""Compress the output file. Valid values are %s, auto and none.
+                    Defaults to auto, which picks the compression from the extension of the output file""" % ", ".join(sorted(CODECS)))
+    parser.add_option("--compress-level", dest="compress_level", type="int", default=None,
+                  help="Compression level. Defaults to the usual level of the chosen compression")
+    parser.add_option("--compress-buffers", dest="compress_buffers", type="int", default=DEFAULT_COMPRESS_BUFFERS,
+                  help="Number of output buffers queued for the compression thread. Defaults to %d" % DEFAULT_COMPRESS_BUFFERS)
+
+    parser.add_option("--string-chunk-size", dest="string_chunk_size", type="int", default=DEFAULT_STRING_CHUNK_SIZE,
+                  help="""Strings longer than this many bytes are read and written in chunks of this size,
+                    so that huge values are never held in memory whole. Defaults to %d""" % DEFAULT_STRING_CHUNK_SIZE)
+    parser.add_option("--replica", dest="replica", metavar="HOST[:PORT]",
+                  help="""Read the rdb file from a live server instead of a file, by connecting to it as a replica.
+                    The file is parsed while the server sends it""")
+    parser.add_option("--password", dest="password",
+                  help="Password of the server given with --replica")
+    parser.add_option("--save", dest="save", metavar="FILE",
+                  help="With --replica, also save the rdb file received to FILE")
+    parser.add_option("--instrument", dest="instrument", type="int", metavar="BYTES",
+                  help="""Measure the memory the parser needs for each key whose serialized value is at least BYTES,
+                    and report the keys that needed the most once the file is parsed. Peaks need python 3""")
+    parser.add_option("--instrument-top", dest="instrument_top", type="int", default=DEFAULT_INSTRUMENT_TOP,
+                  help="Number of keys in the --instrument report. Defaults to %d" % DEFAULT_INSTRUMENT_TOP)
+    parser.add_option("--instrument-file", dest="instrument_file", metavar="FILE",
+                  help="Write the --instrument report to FILE instead of stderr")
+    parser.add_option("-j", "--processes", dest="processes", type="int", default=None,
+                  help="""Number of dump files parsed at once when several are given, each in its own process.
+                    Defaults to the number of cores""")
+    parser.add_option("--pipeline", dest="pipeline", type="int", metavar="N",
+                  help="""Experimental. Run the json, jsonl, diff or protocol command in N formatter processes, fed with the parsed keys
+                    through shared memory, to use more cores when formatting costs more than parsing. The speedup has not been
+                    measured on a multi-core machine yet, see benchmarks/bench_pipeline.py. Needs python 3.8 or later""")
 
     (options, args) = parser.parse_args()
 
-    if len(args) == 0:
+    if len(args) == 0 and not options.replica:
         parser.error("Redis RDB file not specified")
-    dump_file = args[0]
+    if args and options.replica:
+        parser.error("Give either a Redis RDB file or --replica, not both")
+    if options.save and not options.replica:
+        parser.error("--save can only be used with --replica")
+    try:
+        paths = expand_paths(args)
+    except Exception as e:
+        parser.error(e.args[-1])
 
-    filters = {}
-    if options.dbs:
-        filters['dbs'] = []
-        for x in options.dbs:
-            try:
-                filters['dbs'].append(int(x))
-            except ValueError:
-                raise Exception('Invalid database number %s' %x)
+    if not options.outputs:
+        parser.error("Command not specified")
+    if len(options.outputs) == 1 and not options.outputs[0]['output']:
+        options.outputs[0]['output'] = options.output
+    if len([o for o in options.outputs if not o['output']]) > 1:
+        parser.error("Only one command can write to stdout, use command:outfile for the others")
+    if [o for o in options.outputs if o['command'] == 'sqlite' and not o['output']]:
+        parser.error("The sqlite command needs a database file, use sqlite:file.db or -f")
 
-    if options.keys:
-        filters['keys'] = options.keys
+    if options.pipeline is not None:
+        if len(options.outputs) > 1 or not options.outputs[0]['command'] in PIPELINE_COMMANDS:
+            parser.error("--pipeline only applies to a single %s or %s command" % (", ".join(PIPELINE_COMMANDS[:-1]), PIPELINE_COMMANDS[-1]))
+        if not PIPELINE_AVAILABLE:
+            parser.error("--pipeline needs python 3.8 or later")
+        if options.instrument is not None:
+            parser.error("--pipeline and --instrument cannot be used together")
+    if len(paths) > 1:
+        if [o for o in options.outputs if not o['output']]:
+            parser.error("With several dump files, every command needs an output file, use command:outfile or -f")
+        if options.pipeline is not None:
+            parser.error("--pipeline cannot be used with several dump files")
 
-    if options.types:
-        filters['types'] = []
-        for x in options.types:
-            if not x in VALID_TYPES:
-                raise Exception('Invalid type provided - %s. Expected one of %s' % (x, (", ".join(VALID_TYPES))))
-            else:
-                filters['types'].append(x)
+    compress = options.compress
+    if compress == 'none':
+        compress = None
+    elif compress and compress != 'auto' and not compress in CODECS:
+        raise Exception('Invalid compression %s. Expected one of %s, auto or none' % (compress, ", ".join(sorted(CODECS))))
+    # unsupported codecs are reported before any output file is created
+    for output in options.outputs:
+        if output['output'] and output['command'] != 'sqlite':
+            codec = codec_for_filename(output['output']) if compress == 'auto' else compress
+            if codec:
+                try:
+                    new_compressor(codec, options.compress_level)
+                except Exception as e:
+                    parser.error(e.args[-1])
 
-    # TODO : Fix this ugly if-else code
-    if options.output:
-        with open(options.output, "ab") as f:
-            if 'diff' == options.command:
-                callback = DiffCallback(f)
-            elif 'json' == options.command:
-                callback = JDJSONCallback(f)
-            elif 'memory' == options.command:
-                reporter = PrintAllKeys(f)
-                callback = MemoryCallback(reporter, 64)
-            elif 'protocol' == options.command:
-                callback = ProtocolCallback(f)
-            else:
-                raise Exception('Invalid Command %s' % options.command)
-            parser = RdbParser(callback, filters=filters)
-            #parser = RdbParser(callback)
-            parser.parse(dump_file)
+    if len(paths) > 1:
+        start = time.time()
+        results = list(run_nodes(export_dump, paths, (options, compress), options.processes))
+        write_summary(results, throughput(results, time.time() - start), sys.stderr)
+        if [r for r in results if r.error is not None]:
+            sys.exit(1)
     else:
-        if 'diff' == options.command:
-            callback = DiffCallback(sys.stdout)
-        elif 'json' == options.command:
-            callback = JSONCallback(sys.stdout)
-        elif 'memory' == options.command:
-            reporter = PrintAllKeys(sys.stdout)
-            callback = MemoryCallback(reporter, 64)
-        elif 'protocol' == options.command:
-            callback = ProtocolCallback(sys.stdout)
+        export_dump(paths[0] if paths else None, None, options, compress)
+
+def node_output(filename, node):
+    '''
+    The output file of `node` in batch mode : {node} in `filename` is replaced by the name of the
+    node, otherwise the name is inserted before the extensions, as in memory.node1.csv.gz
+    '''
+    if not filename or node is None:
+        return filename
+    name = node.replace(os.sep, '_')
+    if name.endswith('.rdb'):
+        name = name[:-4]
+    if '{node}' in filename:
+        return filename.replace('{node}', name)
+    directory, base = os.path.split(filename)
+    stem, dot, extensions = base.partition('.')
+    return os.path.join(directory, stem + '.' + name + dot + extensions)
+
+def export_dump(dump_file, node, options, compress):
+    '''
+    Parses `dump_file`, or the server of --replica when it is None, into every output of `options`.
+    In batch mode, `node` is the name of the dump file, which goes in the names of the output files.
+    '''
+    files = []
+    try:
+        outputs = []
+        for output in options.outputs:
+            filter_options = dict(options.global_filters)
+            filter_options.update(output['options'])
+            filename = node_output(output['output'], node)
+            if output['command'] == 'sqlite':
+                out, to_file = filename, True
+            elif filename:
+                out = open_output(filename, compress, options.compress_level, options.compress_buffers)
+                files.append(out)
+                to_file = True
+            else:
+                out, to_file = sys.stdout, False
+            if options.pipeline is not None:
+                # the callbacks are created in the formatter processes
+                callback = CallbackFactory(output['command'], to_file, options)
+            else:
+                callback = create_callback(output['command'], out, to_file, options)
+            outputs.append((callback, build_filters(filter_options)))
+
+        if len(outputs) == 1:
+            callback, filters = outputs[0]
+        else:
+            filters = union_filters([f for c, f in outputs])
+            callback = FanOutCallback(outputs)
+        if options.pipeline is not None:
+            parser = PipelineParser(callback, out, filters=filters, formatters=options.pipeline,
+                                    string_chunk_size=options.string_chunk_size)
+        elif options.instrument is not None:
+            profile = KeyMemoryProfile(options.instrument, options.instrument_top)
+            parser = InstrumentedParser(callback, filters=filters, string_chunk_size=options.string_chunk_size, profile=profile)
+        else:
+            parser = RdbParser(callback, filters=filters, string_chunk_size=options.string_chunk_size)
+        if options.replica:
+            parse_from_replica(parser, options.replica, options.password, options.save)
         else:
-            raise Exception('Invalid Command %s' % options.command)
+            parser.parse(dump_file)
+        if options.instrument is not None:
+            write_instrument_report(parser.profile, node_output(options.instrument_file, node), node)
+    finally:
+        for f in files:
+            f.close()
+
+def write_instrument_report(profile, filename=None, node=None):
+    if not filename:
+        if node is not None:
+            sys.stderr.write("node : %s\n" % node)
+        profile.report(sys.stderr)
+        return
+    with open(filename, 'w') as out:
+        profile.report(out)
 
-        parser = RdbParser(callback, filters=filters)
-        parser.parse(dump_file)
+def parse_from_replica(parser, address, password=None, save=None):
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        host, port = address, DEFAULT_PORT
+    try:
+        port = int(port)
+    except ValueError:
+        raise Exception('Invalid port in %s' % address)
+    redis = RespConnection(host=host or '127.0.0.1', port=port, password=password)
+    tee = open(save, 'wb') if save else None
+    try:
+        parse_replica(parser, redis, tee)
+    finally:
+        redis.close()
+        if tee is not None:
+            tee.close()
 
 if __name__ == '__main__':
     main()
-
@@ -1,103 +1,158 @@
 #!/usr/bin/env python
-import struct
 import os
 import sys
+from itertools import chain
 
-try :
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
-    
 from optparse import OptionParser
-from rdbtools import RdbParser, JSONCallback, MemoryCallback
-from rdbtools.callbacks import encode_key
+from rdbtools import RdbParser, JSONCallback, MemoryCallback, PrintAllKeys
+from rdbtools.parser import to_bytes
+from rdbtools.callbacks import encode_key_text
+from rdbtools.allocator import ALLOCATOR_NAMES, ALLOCATOR_FLAT
+from rdbtools.resp import RespConnection, RespError
+from rdbtools.live import dump_keys
 
-from redis import StrictRedis
-from redis.exceptions import ConnectionError, ResponseError
+# Keys sent in a single pipeline of DUMP commands
+DEFAULT_WINDOW = 100
 
 def main():
-    usage = """usage: %prog [options] redis-key
+    usage = """usage: %prog [options] redis-key [redis-key ...]
 Examples :
 %prog user:13423
 %prog -h localhost -p 6379 user:13423
+%prog --keys-file keys.txt
+%prog --match "user:*" -f user_memory.csv
 """
 
     parser = OptionParser(usage=usage)
-    parser.add_option("-s", "--server", dest="host", default="127.0.0.1", 
+    parser.add_option("-s", "--server", dest="host", default="127.0.0.1",
                   help="Redis Server hostname. Defaults to 127.0.0.1")
-    parser.add_option("-p", "--port", dest="port", default=6379, type="int", 
+    parser.add_option("-p", "--port", dest="port", default=6379, type="int",
                   help="Redis Server port. Defaults to 6379")
-    parser.add_option("-a", "--password", dest="password", 
+    parser.add_option("-a", "--password", dest="password",
                   help="Password to use when connecting to the server")
-    parser.add_option("-d", "--db", dest="db", default=0,
+    parser.add_option("-d", "--db", dest="db", default=0, type="int",
                   help="Database number, defaults to 0")
-    
+    parser.add_option("--allocator", dest="allocator", default=ALLOCATOR_FLAT, type="choice", choices=ALLOCATOR_NAMES,
+                  help="Allocator model. Valid values are %s. Defaults to %s" % (", ".join(ALLOCATOR_NAMES), ALLOCATOR_FLAT))
+    parser.add_option("--keys-file", dest="keys_file", metavar="FILE",
+                  help="Read the keys from FILE, one per line. - reads them from stdin")
+    parser.add_option("-m", "--match", dest="match", metavar="PATTERN",
+                  help="Report every key matching PATTERN, found with SCAN MATCH")
+    parser.add_option("-w", "--window", dest="window", default=DEFAULT_WINDOW, type="int",
+                  help="Number of DUMP commands sent at once. Defaults to %d" % DEFAULT_WINDOW)
+    parser.add_option("-f", "--file", dest="output", metavar="FILE",
+                  help="Write the csv report of a batch to FILE instead of stdout")
+
     (options, args) = parser.parse_args()
-    
-    if len(args) == 0:
+
+    if len(args) == 0 and not options.keys_file and not options.match:
         parser.error("Key not specified")
-    redis_key = args[0]
-    print_memory_for_key(redis_key, host=options.host, port=options.port, 
-                    db=options.db, password=options.password)
 
-def print_memory_for_key(key, host='localhost', port=6379, db=0, password=None):
-    redis = connect_to_redis(host, port, db, password)
-    reporter = PrintMemoryUsage()
-    callback = MemoryCallback(reporter, 64)
-    parser = RdbParser(callback, filters={})
-    parser._key = key
+    if len(args) == 1 and not options.keys_file and not options.match:
+        print_memory_for_key(to_bytes(args[0]), host=options.host, port=options.port,
+                        db=options.db, password=options.password, allocator=options.allocator)
+        return
+
+    keys = iter_keys(args, options.keys_file)
+    redis = connect_to_redis(options.host, options.port, options.db, options.password)
+    try:
+        if options.match:
+            keys = chain(keys, redis.scan_iter(options.match))
+        out = open(options.output, "wb") if options.output else sys.stdout
+        try:
+            print_memory_for_keys(redis, keys, PrintAllKeys(out), options.db, options.allocator, options.window)
+        finally:
+            if options.output:
+                out.close()
+    finally:
+        redis.close()
 
-    raw_dump = redis.execute_command('dump', key)
-    if not raw_dump:
-        sys.stderr.write('Key %s does not exist\n' % key)
+def iter_keys(args, keys_file=None):
+    '''Yields the keys given on the command line, then those of `keys_file`, as byte strings'''
+    for key in args:
+        yield to_bytes(key)
+    if not keys_file:
+        return
+    if keys_file == '-':
+        f = getattr(sys.stdin, 'buffer', sys.stdin)
+    else:
+        f = open(keys_file, 'rb')
+    try:
+        for line in f:
+            key = line.rstrip(b'\r\n')
+            if key:
+                yield key
+    finally:
+        if f is not sys.stdin and keys_file != '-':
+            f.close()
+
+def print_memory_for_key(key, host='localhost', port=6379, db=0, password=None, allocator=None):
+    redis = connect_to_redis(host, port, db, password)
+    try:
+        found = print_memory_for_keys(redis, [key], PrintMemoryUsage(), db, allocator)
+    finally:
+        redis.close()
+    if not found:
         sys.exit(-1)
-    
-    stream = StringIO(raw_dump)
-    data_type = read_unsigned_char(stream)
-    parser.read_object(stream, data_type)
+
+def print_memory_for_keys(redis, keys, reporter, db=0, allocator=None, window=DEFAULT_WINDOW):
+    '''
+    Reports the memory used by every key of `keys` to `reporter`, a reporter of MemoryCallback.
+
+    Keys are DUMPed over the single connection `redis`, `window` keys per pipeline, see dump_keys.
+    Returns the number of keys found. Missing keys are reported on stderr.
+    '''
+    callback = MemoryCallback(reporter, 64, allocator=allocator)
+    parser = RdbParser(callback, filters={})
+    callback.start_rdb()
+    callback.start_database(db)
+    found = 0
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= window:
+            found += dump_keys(redis, parser, batch)
+            batch = []
+    found += dump_keys(redis, parser, batch)
+    callback.end_database(db)
+    callback.end_rdb()
+    return found
 
 def connect_to_redis(host, port, db, password):
     try:
-        redis = StrictRedis(host=host, port=port, db=db, password=password)
+        redis = RespConnection(host=host, port=port, db=db, password=password)
         if not check_redis_version(redis):
             sys.stderr.write('This script only works with Redis Server version 2.6.x or higher\n')
             sys.exit(-1)
-    except ConnectionError as e:
+    except (IOError, OSError) as e:
         sys.stderr.write('Could not connect to Redis Server : %s\n' % e)
         sys.exit(-1)
-    except ResponseError as e:
+    except RespError as e:
         sys.stderr.write('Could not connect to Redis Server : %s\n' % e)
         sys.exit(-1)
     return redis
-    
+
 def check_redis_version(redis):
-    server_info = redis.info()
-    version_str = server_info['redis_version']
-    version = tuple(map(int, version_str.split('.')))
-    
+    version = redis.version()
+
     if version[0] > 2 or (version[0] == 2 and version[1] >= 6) :
         return True
     else:
         return False
 
-def read_unsigned_char(f) :
-    return struct.unpack('B', f.read(1))[0]
-
 class PrintMemoryUsage():
     def next_record(self, record) :
-        print("%s\t\t\t\t%s" % ("Key", encode_key(record.key)))
+        print("%s\t\t\t\t%s" % ("Key", encode_key_text(record.key)))
         print("%s\t\t\t\t%s" % ("Bytes", record.bytes))
         print("%s\t\t\t\t%s" % ("Type", record.type))
         if record.type in ('set', 'list', 'sortedset', 'hash'):
             print("%s\t\t\t%s" % ("Encoding", record.encoding))
             print("%s\t\t%s" % ("Number of Elements", record.size))
             print("%s\t%s" % ("Length of Largest Element", record.len_largest_element))
-        
-        #print("%d,%s,%s,%d,%s,%d,%d\n" % (record.database, record.type, encode_key(record.key), 
+
+        #print("%d,%s,%s,%d,%s,%d,%d\n" % (record.database, record.type, encode_key(record.key),
         #                                         record.bytes, record.encoding, record.size, record.len_largest_element))
 
 if __name__ == '__main__':
     #print_memory_for_key('x')
     main()
-
-
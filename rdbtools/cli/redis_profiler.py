@@ -1,45 +1,159 @@
 #!/usr/bin/env python
 import os
 import sys
-from string import Template
+import json
+import time
 from optparse import OptionParser
-from rdbtools import RdbParser, MemoryCallback, PrintAllKeys, StatsAggregator
+from rdbtools import RdbParser, MemoryCallback, PrintAllKeys, StatsAggregator, BoundedStatsAggregator
+from rdbtools.memprofiler import NamespaceAggregator, DEFAULT_DELIMITERS, DEFAULT_NAMESPACE_DEPTH, DEFAULT_NAMESPACE_NODES, DEFAULT_HEAVY_HITTERS
+from rdbtools.memprofiler import SKIPLIST_MODELS, SKIPLIST_MODEL_EXPECTED, DEFAULT_SCATTER_SAMPLES
+from rdbtools.memprofiler import TopKeysReport, merge_states, DEFAULT_REPORT_POINTS, DEFAULT_REPORT_ROWS
+from rdbtools.report import write_report
+from rdbtools.allocator import ALLOCATOR_NAMES, ALLOCATOR_FLAT
+from rdbtools.cluster import expand_paths, run_nodes, throughput, write_summary
 
 def main(): 
-    usage = """usage: %prog [options] /path/to/dump.rdb
+    usage = """usage: %prog [options] /path/to/dump.rdb [/path/to/dump.rdb ...]
 
 Example 1 : %prog -k "user.*" -k "friends.*" -f memoryreport.html /var/redis/6379/dump.rdb
-Example 2 : %prog /var/redis/6379/dump.rdb"""
+Example 2 : %prog /var/redis/6379/dump.rdb
+Example 3 : %prog --state node1.state /var/redis/6379/dump.rdb, then %prog --merge node1.state node2.state ...
+Example 4 : %prog -f cluster.html "/backups/cluster/*.rdb"""
 
     parser = OptionParser(usage=usage)
 
     parser.add_option("-f", "--file", dest="output",
-                  help="Output file", metavar="FILE")
+                  help="Output file. Defaults to redis_memory_report.html, - writes the report to stdout", metavar="FILE")
     parser.add_option("-k", "--key", dest="keys", action="append",
                   help="Keys that should be grouped together. Multiple regexes can be provided")
+    parser.add_option("--skiplist-model", dest="skiplist_model", default=SKIPLIST_MODEL_EXPECTED,
+                  help="How skiplist levels of sorted sets are accounted for. Valid values are %s. Defaults to %s" % (", ".join(SKIPLIST_MODELS), SKIPLIST_MODEL_EXPECTED))
+    parser.add_option("--seed", dest="seed", type="int", default=0,
+                  help="Random seed for the simulated skiplist model. Defaults to 0")
+    parser.add_option("--allocator", dest="allocator", default=ALLOCATOR_FLAT, type="choice", choices=ALLOCATOR_NAMES,
+                  help="Allocator model. Valid values are %s. Defaults to %s" % (", ".join(ALLOCATOR_NAMES), ALLOCATOR_FLAT))
+    parser.add_option("--delimiters", dest="delimiters", default=DEFAULT_DELIMITERS,
+                  help="Characters that separate the parts of a key namespace. Defaults to %s" % DEFAULT_DELIMITERS)
+    parser.add_option("--namespace-depth", dest="namespace_depth", type="int", default=DEFAULT_NAMESPACE_DEPTH,
+                  help="Number of key parts rolled up in the namespace report. Defaults to %d" % DEFAULT_NAMESPACE_DEPTH)
+    parser.add_option("--namespace-nodes", dest="namespace_nodes", type="int", default=DEFAULT_NAMESPACE_NODES,
+                  help="Namespace prefixes kept before the smallest ones are pruned. Defaults to %d" % DEFAULT_NAMESPACE_NODES)
+    parser.add_option("--heavy-hitters", dest="heavy_hitters", type="int", default=DEFAULT_HEAVY_HITTERS,
+                  help="Number of full namespaces tracked by memory usage. Defaults to %d" % DEFAULT_HEAVY_HITTERS)
+    parser.add_option("--exact", dest="exact", action="store_true", default=False,
+                  help="Keep every distinct value in histograms and every key in scatter plots. Memory grows with the number of keys")
+    parser.add_option("--scatter-samples", dest="scatter_samples", type="int", default=DEFAULT_SCATTER_SAMPLES,
+                  help="Keys sampled per type for scatter plots. Defaults to %d" % DEFAULT_SCATTER_SAMPLES)
+    parser.add_option("--top", dest="top", type="int", default=10,
+                  help="Number of largest keys in the report, overall, per type and per database. 0 leaves them out. Defaults to 10")
+    parser.add_option("--max-points", dest="max_points", type="int", default=DEFAULT_REPORT_POINTS,
+                  help="Most keys shown in each scatter plot of the report. Defaults to %d" % DEFAULT_REPORT_POINTS)
+    parser.add_option("--max-rows", dest="max_rows", type="int", default=DEFAULT_REPORT_ROWS,
+                  help="Most rows in each table of the report. Defaults to %d" % DEFAULT_REPORT_ROWS)
+    parser.add_option("--state", dest="state", metavar="FILE",
+                  help="Write the partial state of the profiler to FILE instead of a report, to be combined later with --merge")
+    parser.add_option("--merge", dest="merge", action="store_true", default=False,
+                  help="The arguments are state files written with --state. They are merged into a single report, or a single state with --state")
+    parser.add_option("-j", "--processes", dest="processes", type="int", default=None,
+                  help="""Number of dump files parsed at once when several are given, each in its own process.
+                    Their stats are merged into a single report, with a row per node. Defaults to the number of cores""")
     
     (options, args) = parser.parse_args()
     
     if len(args) == 0:
+        if options.merge:
+            parser.error("State files not specified")
         parser.error("Redis RDB file not specified")
-    dump_file = args[0]
     
     if not options.output:
         output = "redis_memory_report.html"
     else:
         output = options.output
 
-    stats = StatsAggregator()
-    callback = MemoryCallback(stats, 64)
+    failed = False
+    if options.merge:
+        states = []
+        for state_file in args:
+            with open(state_file) as f:
+                states.append(json.load(f))
+        stats = merge_states(states)
+        nodes = None
+    else:
+        try:
+            paths = expand_paths(args)
+        except Exception as e:
+            parser.error(e.args[-1])
+        if len(paths) == 1:
+            stats = profile_dump(paths[0], options)
+            nodes = None
+        else:
+            stats, nodes = profile_nodes(paths, options)
+            failed = nodes['throughput']['failed'] > 0
+
+    if options.state:
+        with open(options.state, "w") as f:
+            json.dump(stats.get_state(), f, separators=(',', ':'))
+    else:
+        report = stats.get_report(options.max_points, options.max_rows)
+        if nodes is not None:
+            report.update(nodes)
+        if output == '-':
+            write_report(report, sys.stdout)
+        else:
+            with open(output, "wb") as f:
+                write_report(report, f)
+    if failed:
+        sys.exit(1)
+
+def create_aggregator(options):
+    namespaces = NamespaceAggregator(options.keys, options.delimiters, options.namespace_depth,
+                                     options.namespace_nodes, options.heavy_hitters)
+    if options.exact:
+        return StatsAggregator(namespaces=namespaces)
+    top_keys = TopKeysReport(None, options.top) if options.top > 0 else None
+    return BoundedStatsAggregator(scatter_samples=options.scatter_samples, seed=options.seed,
+                                  namespaces=namespaces, top_keys=top_keys)
+
+def profile_dump(dump_file, options):
+    stats = create_aggregator(options)
+    callback = MemoryCallback(stats, 64, skiplist_model=options.skiplist_model, seed=options.seed, allocator=options.allocator)
     parser = RdbParser(callback)
     parser.parse(dump_file)
-    stats_as_json = stats.get_json()
-    
-    t = open(os.path.join(os.path.dirname(__file__),"report.html.template")).read()
-    report_template = Template(t)
-    html = report_template.substitute(REPORT_JSON = stats_as_json)
-    print(html)
-    
+    return stats
+
+def profile_node(dump_file, node, options):
+    # runs in a worker process, the state is what goes back to the main one
+    return profile_dump(dump_file, options).get_state()
+
+def profile_nodes(paths, options):
+    '''
+    Profiles every dump file of `paths` in a pool of processes. Returns the merged stats of the
+    nodes that succeeded, and the nodes and throughput sections of the report.
+    A summary of the nodes is written to stderr.
+    '''
+    start = time.time()
+    results = list(run_nodes(profile_node, paths, (options,), options.processes))
+    # nodes finish in any order, they are merged in the order they were given for reproducible reports
+    results.sort(key=lambda r: paths.index(r.path))
+    totals = throughput(results, time.time() - start)
+    write_summary(results, totals, sys.stderr)
+    rows = []
+    for r in results:
+        row = {'node' : r.node, 'path' : r.path, 'file_bytes' : r.file_bytes, 'seconds' : r.seconds, 'error' : r.error}
+        if r.error is None:
+            aggregates = r.result['aggregates']
+            row['keys'] = sum(aggregates.get('type_count', {}).values())
+            row['memory'] = sum(aggregates.get('database_memory', {}).values())
+            row['type_memory'] = dict(aggregates.get('type_memory', {}))
+        rows.append(row)
+    totals['keys'] = sum(row.get('keys', 0) for row in rows)
+    totals['memory'] = sum(row.get('memory', 0) for row in rows)
+    # merging reuses the states, the rows are taken from them first
+    states = [r.result for r in results if r.error is None]
+    if not states:
+        raise Exception('profile_nodes', 'No dump file could be profiled')
+    return merge_states(states), {'nodes' : rows, 'throughput' : totals}
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import sys
+import json
+from optparse import OptionParser
+from rdbtools.allocator import ALLOCATOR_NAMES, ALLOCATOR_FLAT
+from rdbtools.live import sample_memory, SAMPLE_METHODS, SAMPLE_RANDOMKEY, DEFAULT_CONFIDENCE, DEFAULT_MARGIN
+from rdbtools.live import DEFAULT_MAX_OPS, DEFAULT_WINDOW
+from rdbtools.cli.redis_memory_for_key import connect_to_redis
+
+def main():
+    usage = """usage: %prog [options]
+
+Estimates the memory used by a live server from a sample of its keys, without BGSAVE.
+
+Example 1 : %prog -s localhost -p 6379
+Example 2 : %prog -p 6379 --samples 20000 --max-ops 500 -f estimate.json"""
+
+    parser = OptionParser(usage=usage)
+    parser.add_option("-s", "--server", dest="host", default="127.0.0.1",
+                  help="Redis Server hostname. Defaults to 127.0.0.1")
+    parser.add_option("-p", "--port", dest="port", default=6379, type="int",
+                  help="Redis Server port. Defaults to 6379")
+    parser.add_option("-a", "--password", dest="password",
+                  help="Password to use when connecting to the server")
+    parser.add_option("-d", "--db", dest="db", default=0, type="int",
+                  help="Database number, defaults to 0")
+    parser.add_option("-f", "--file", dest="output", metavar="FILE",
+                  help="Write the estimates to FILE instead of stdout")
+    parser.add_option("--method", dest="method", default=SAMPLE_RANDOMKEY, type="choice", choices=SAMPLE_METHODS,
+                  help="""How keys are sampled. randomkey draws keys with RANDOMKEY, scan takes the first keys SCAN returns.
+                    Defaults to %s""" % SAMPLE_RANDOMKEY)
+    parser.add_option("--samples", dest="samples", type="int", default=None,
+                  help="Number of keys to sample. Defaults to what --confidence and --margin need")
+    parser.add_option("--confidence", dest="confidence", type="float", default=DEFAULT_CONFIDENCE,
+                  help="Confidence level of the intervals. Defaults to %s" % DEFAULT_CONFIDENCE)
+    parser.add_option("--margin", dest="margin", type="float", default=DEFAULT_MARGIN,
+                  help="Margin of error on the share of keys of each type, used to size the sample. Defaults to %s" % DEFAULT_MARGIN)
+    parser.add_option("--max-ops", dest="max_ops", type="int", default=DEFAULT_MAX_OPS,
+                  help="Most commands sent to the server per second. 0 means no limit. Defaults to %d" % DEFAULT_MAX_OPS)
+    parser.add_option("-w", "--window", dest="window", type="int", default=DEFAULT_WINDOW,
+                  help="Number of keys fetched per pipeline. Defaults to %d" % DEFAULT_WINDOW)
+    parser.add_option("--allocator", dest="allocator", default=ALLOCATOR_FLAT, type="choice", choices=ALLOCATOR_NAMES,
+                  help="Allocator model. Valid values are %s. Defaults to %s" % (", ".join(ALLOCATOR_NAMES), ALLOCATOR_FLAT))
+
+    (options, args) = parser.parse_args()
+
+    redis = connect_to_redis(options.host, options.port, options.db, options.password)
+    try:
+        result = sample_memory(redis, options.samples, options.method, options.confidence, options.margin,
+                               options.max_ops, options.window, options.db, options.allocator)
+    finally:
+        redis.close()
+
+    # histograms of the sample, scaled to the whole database
+    stats = result.pop('stats')
+    scale = result['scale'] or 0
+    result['histograms'] = dict((heading, [[low, high, count * scale] for low, high, count in histogram.buckets()])
+                                for heading, histogram in stats.histograms.items())
+    result['percentiles'] = stats.get_percentiles()
+
+    report = json.dumps(result, sort_keys=True, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
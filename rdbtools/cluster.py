@@ -0,0 +1,186 @@
+'''
+Batch mode : the dumps of every node of a cluster, parsed concurrently in a pool of processes.
+
+The CLIs take several dump files, or glob patterns, and hand each one to `run_nodes`, which
+calls a function with the path of every file in a worker process and yields the results as
+they come. Each file gets its own process, so the memory of a large node is given back before
+the next one starts. A node that fails is reported with its error, the others carry on, and
+so is a node whose process dies, killed by a signal or out of memory.
+'''
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import namedtuple
+
+try:
+    from multiprocessing.connection import wait as wait_connections
+except ImportError:
+    # python 2, see wait_readable
+    wait_connections = None
+
+# the outcome of a node : `result` is what the function returned, None if it failed with `error`
+NodeResult = namedtuple('NodeResult', ['node', 'path', 'file_bytes', 'seconds', 'result', 'error'])
+
+# how often the workers are checked for being alive while no result comes, in seconds
+WAIT_TIMEOUT = 1.0
+
+def default_processes():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def expand_paths(patterns):
+    '''
+    The dump files named by `patterns`, in order and without duplicates. Patterns that are not
+    existing files are expanded as globs, the shell does not expand quoted ones.
+    Raises an exception for a pattern that matches nothing.
+    '''
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.exists(pattern):
+            matches = [pattern]
+        else:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise Exception('expand_paths', 'No dump file matches %s' % pattern)
+        for path in matches:
+            if not path in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+def node_names(paths):
+    '''
+    A short name for every dump file, to attribute results to nodes : the file name when they
+    are all different, such as dump-7000.rdb, otherwise the path below their common directory,
+    such as node1/dump.rdb.
+    '''
+    names = [os.path.basename(path) for path in paths]
+    if len(set(names)) == len(names):
+        return names
+    paths = [os.path.abspath(path) for path in paths]
+    common = os.path.dirname(os.path.commonprefix(paths))
+    return [os.path.relpath(path, common) for path in paths]
+
+def run_node(task):
+    '''Runs one node in a worker process, see run_nodes'''
+    function, node, path, args = task
+    start = time.time()
+    try:
+        file_bytes = os.path.getsize(path)
+        result = function(path, node, *args)
+        return NodeResult(node, path, file_bytes, time.time() - start, result, None)
+    except Exception as e:
+        sys.stderr.write('%s failed :\n%s' % (node, traceback.format_exc()))
+        error = '%s : %s' % (type(e).__name__, e)
+        return NodeResult(node, path, None, time.time() - start, None, error)
+
+def run_worker(task, connection):
+    '''The body of a worker process : runs one node and sends its NodeResult back'''
+    connection.send(run_node(task))
+    connection.close()
+
+def wait_readable(connections, timeout):
+    '''The connections that have something to read, or whose other end is closed, waiting at most `timeout` seconds'''
+    if wait_connections is not None:
+        return wait_connections(connections, timeout)
+    deadline = time.time() + timeout
+    while True:
+        ready = [c for c in connections if c.poll()]
+        if ready or time.time() >= deadline:
+            return ready
+        time.sleep(0.01)
+
+def dead_node(worker, task, start):
+    '''The NodeResult of a node whose worker process died before sending its result'''
+    function, node, path, args = task
+    worker.join()
+    if worker.exitcode is not None and worker.exitcode < 0:
+        error = 'WorkerDied : the worker process was killed by signal %d' % -worker.exitcode
+    else:
+        error = 'WorkerDied : the worker process exited with code %s' % worker.exitcode
+    sys.stderr.write('%s failed :\n%s\n' % (node, error))
+    return NodeResult(node, path, None, time.time() - start, None, error)
+
+def run_nodes(function, paths, args = (), processes = None):
+    '''
+    Calls `function(path, node, *args)` for every dump file of `paths` in up to `processes`
+    worker processes at once, as many as there are cores by default, and yields a NodeResult
+    per file as each one finishes. `function`, its arguments and its results must be picklable.
+    A worker that dies gives a NodeResult with an error, and the other files carry on.
+    With a single process or a single file, everything runs in the calling process.
+    '''
+    if processes is None:
+        processes = default_processes()
+    processes = max(1, min(processes, len(paths)))
+    tasks = [(function, node, path, args) for node, path in zip(node_names(paths), paths)]
+    if processes == 1:
+        for task in tasks:
+            yield run_node(task)
+        return
+    pending = list(reversed(tasks))
+    # connection : (worker, task, start), for every worker that has not given its result yet
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < processes:
+                task = pending.pop()
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                worker = multiprocessing.Process(target=run_worker, args=(task, sender))
+                worker.daemon = True
+                worker.start()
+                # the worker holds the only sending end, so that its death is seen as the end of the pipe
+                sender.close()
+                running[receiver] = (worker, task, time.time())
+            for receiver in wait_readable(list(running), WAIT_TIMEOUT):
+                worker, task, start = running.pop(receiver)
+                try:
+                    result = receiver.recv()
+                except Exception:
+                    # the end of the pipe, or a result cut short
+                    result = None
+                receiver.close()
+                if result is None:
+                    yield dead_node(worker, task, start)
+                else:
+                    worker.join()
+                    yield result
+            # processes started by a worker inherit its sending end, and can keep the pipe
+            # open after it died, so workers are also checked for having exited
+            for receiver, (worker, task, start) in list(running.items()):
+                if not worker.is_alive() and not receiver.poll():
+                    del running[receiver]
+                    receiver.close()
+                    yield dead_node(worker, task, start)
+    finally:
+        for receiver, (worker, task, start) in running.items():
+            worker.terminate()
+            worker.join()
+            receiver.close()
+
+def throughput(results, seconds):
+    '''The totals of a batch, `seconds` being the wall clock time it took'''
+    done = [r for r in results if r.error is None]
+    file_bytes = sum(r.file_bytes for r in done)
+    return {'files' : len(results), 'failed' : len(results) - len(done), 'file_bytes' : file_bytes,
+            'seconds' : seconds, 'node_seconds' : sum(r.seconds for r in results),
+            'bytes_per_second' : file_bytes / seconds if seconds > 0 else 0}
+
+def write_summary(results, totals, out):
+    '''Writes one line per node and the totals of the batch to `out`, a text file'''
+    out.write("%s,%s,%s,%s,%s\n" % ("node", "file_bytes", "seconds", "bytes_per_second", "error"))
+    for r in sorted(results, key=lambda r: r.node):
+        if r.error is None:
+            rate = r.file_bytes / r.seconds if r.seconds > 0 else 0
+            out.write("%s,%d,%.2f,%d,\n" % (r.node, r.file_bytes, r.seconds, rate))
+        else:
+            out.write("%s,,%.2f,,%s\n" % (r.node, r.seconds, r.error))
+    out.write("%d files, %d failed, %d bytes in %.2f seconds, %d bytes per second, %.2f seconds of node time\n" % (
+        totals['files'], totals['failed'], totals['file_bytes'], totals['seconds'],
+        totals['bytes_per_second'], totals['node_seconds']))
+    out.flush()
@@ -0,0 +1,202 @@
+'''
+Opt-in instrumentation of the memory the parser needs for each key, to size the hosts dumps are analysed on.
+
+InstrumentedParser records, for every key whose serialized value is at least `threshold` bytes,
+its serialized size, the size of what was decoded and given to the callback, and the peak of
+the python allocations made while the key was parsed and dispatched, measured with tracemalloc.
+
+Only those keys are traced : the size of each value is found by skipping over it first, then
+tracemalloc is started for the keys that reach the threshold and stopped right after them,
+so the rest of the dump is parsed at full speed. Dumps that cannot be seeked, such as a
+replication stream, cannot be skipped over first and every key is traced.
+Peaks include what the callback allocates for the key, such as an output buffer that grows
+while the key is written. They are not available on python 2, which has no tracemalloc.
+
+    profile = KeyMemoryProfile(threshold=1024 * 1024)
+    InstrumentedParser(callback, profile=profile).parse('dump.rdb')
+    profile.report(sys.stderr)
+'''
+import sys
+from collections import namedtuple
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from rdbtools.parser import RdbParser, DATA_TYPE_MAPPING, ENCODING_MAPPING, DEFAULT_STRING_CHUNK_SIZE, is_seekable
+from rdbtools.callbacks import encode_key_text
+from rdbtools.sketches import TopK
+
+DEFAULT_INSTRUMENT_THRESHOLD = 65536
+DEFAULT_INSTRUMENT_TOP = 20
+
+# the events that give values to the callback, and the arguments that are values
+VALUE_EVENTS = {'set' : (1,), 'set_chunk' : (1,), 'hset' : (1, 2), 'sadd' : (1,), 'rpush' : (1,), 'zadd' : (1, 2)}
+
+KeyMemoryRecord = namedtuple('KeyMemoryRecord', ['database', 'type', 'key', 'encoding', 'serialized', 'decoded', 'peak'])
+
+def value_size(value):
+    '''Size of a decoded value : the length of strings, 8 bytes for integers and scores'''
+    if isinstance(value, bytes):
+        return len(value)
+    return 8
+
+class KeyMemoryProfile(object):
+    '''
+    The measures of InstrumentedParser : totals over every key, and the `top` keys that reached
+    `threshold`, ranked by peak allocation, or by serialized size when peaks are not available.
+    '''
+    def __init__(self, threshold = DEFAULT_INSTRUMENT_THRESHOLD, top = DEFAULT_INSTRUMENT_TOP):
+        self.threshold = threshold
+        self.keys = 0
+        self.traced = 0
+        self.serialized = 0
+        self.decoded = 0
+        self.max_peak = None
+        # encoding : [keys, serialized, decoded, max peak] of the traced keys
+        self.encodings = {}
+        self.top = TopK(top)
+
+    def count(self, serialized, decoded):
+        '''Adds a key below the threshold, that is only counted in the totals'''
+        self.keys += 1
+        self.serialized += serialized
+        self.decoded += decoded
+
+    def add(self, record):
+        '''Adds a key that reached the threshold. Its peak is None when it could not be measured'''
+        self.count(record.serialized, record.decoded)
+        self.traced += 1
+        stats = self.encodings.get(record.encoding)
+        if stats is None:
+            stats = self.encodings[record.encoding] = [0, 0, 0, None]
+        stats[0] += 1
+        stats[1] += record.serialized
+        stats[2] += record.decoded
+        if record.peak is not None:
+            stats[3] = max(stats[3], record.peak) if stats[3] is not None else record.peak
+            self.max_peak = max(self.max_peak, record.peak) if self.max_peak is not None else record.peak
+        self.top.add(record.peak if record.peak is not None else record.serialized, record)
+
+    def report(self, out):
+        '''Writes the summary and the keys that dominated the parser memory to `out`, a text file'''
+        out.write("keys : %d, traced : %d of at least %d serialized bytes\n" % (self.keys, self.traced, self.threshold))
+        out.write("serialized bytes : %d, decoded bytes : %d\n" % (self.serialized, self.decoded))
+        out.write("largest key peak : %s\n" % format_peak(self.max_peak))
+        rss = peak_rss()
+        if rss is not None:
+            out.write("process peak rss : %d\n" % rss)
+        out.write("\n%s,%s,%s,%s,%s\n" % ("encoding", "keys", "serialized", "decoded", "max_peak"))
+        for encoding in sorted(self.encodings):
+            keys, serialized, decoded, peak = self.encodings[encoding]
+            out.write("%s,%d,%d,%d,%s\n" % (encoding, keys, serialized, decoded, format_peak(peak)))
+        out.write("\n%s,%s,%s,%s,%s,%s,%s,%s\n" % ("rank", "database", "type", "key", "encoding", "serialized", "decoded", "peak"))
+        for rank, (weight, record) in enumerate(self.top.items()):
+            out.write("%d,%d,%s,%s,%s,%d,%d,%s\n" % (rank + 1, record.database, record.type, encode_key_text(record.key),
+                                                     record.encoding, record.serialized, record.decoded, format_peak(record.peak)))
+
+def format_peak(peak):
+    return "%d" % peak if peak is not None else "n/a"
+
+def peak_rss():
+    '''The largest resident set size of the process so far, in bytes, or None when it is not known'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac os
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+class CountingReader(object):
+    '''Reads from `f` and counts the bytes read, to size the values of dumps that cannot be seeked'''
+    def __init__(self, f):
+        self._f = f
+        self.count = 0
+
+    def read(self, n):
+        data = self._f.read(n)
+        self.count += len(data)
+        return data
+
+class InstrumentedParser(RdbParser):
+    '''
+    An RdbParser that adds the measures of every key it parses to `profile`, a KeyMemoryProfile.
+    Keys that are filtered out are skipped as usual, and not measured.
+    '''
+    def __init__(self, callback, filters = None, string_chunk_size = DEFAULT_STRING_CHUNK_SIZE, profile = None):
+        self.profile = profile if profile is not None else KeyMemoryProfile()
+        self._decoded = 0
+        self._sized_file = None
+        self._seekable = False
+        # keys given to parse_dump are outside of any dump, and counted in database 0
+        self._db_number = 0
+        RdbParser.__init__(self, callback, filters, string_chunk_size)
+
+    def init_dispatch(self):
+        RdbParser.init_dispatch(self)
+        # values are counted on their way to the callback, only for the events it implements
+        for event, positions in VALUE_EVENTS.items():
+            if self._on[event] is not None:
+                self._on[event] = self._counter(self._on[event], positions)
+
+    def _counter(self, method, positions):
+        if len(positions) == 1:
+            def count(key, value, *args, **kwargs):
+                self._decoded += len(value) if isinstance(value, bytes) else 8
+                return method(key, value, *args, **kwargs)
+        else:
+            def count(key, first, second):
+                self._decoded += value_size(first) + value_size(second)
+                return method(key, first, second)
+        return count
+
+    def read_object(self, f, enc_type):
+        if f is not self._sized_file:
+            self._sized_file = f
+            self._seekable = is_seekable(f) and hasattr(f, 'tell')
+        self._decoded = 0
+        if self._seekable:
+            offset = f.tell()
+            self.skip_object(f, enc_type)
+            serialized = f.tell() - offset
+            f.seek(offset)
+            if serialized < self.profile.threshold:
+                RdbParser.read_object(self, f, enc_type)
+                self.profile.count(serialized, self._decoded)
+                return
+            peak = self._traced_read(f, enc_type)
+        else:
+            f = CountingReader(f)
+            peak = self._traced_read(f, enc_type)
+            serialized = f.count
+            if serialized < self.profile.threshold:
+                self.profile.count(serialized, self._decoded)
+                return
+        self.profile.add(KeyMemoryRecord(self._db_number, DATA_TYPE_MAPPING[enc_type], self._key,
+                                         ENCODING_MAPPING[enc_type], serialized, self._decoded, peak))
+
+    def _traced_read(self, f, enc_type):
+        '''Reads the object, and returns the peak of the allocations made meanwhile, or None'''
+        if tracemalloc is None:
+            RdbParser.read_object(self, f, enc_type)
+            return None
+        if tracemalloc.is_tracing():
+            # someone else traces the process, peaks can only be measured if they can be reset
+            if not hasattr(tracemalloc, 'reset_peak'):
+                RdbParser.read_object(self, f, enc_type)
+                return None
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            RdbParser.read_object(self, f, enc_type)
+            return tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.start()
+        try:
+            RdbParser.read_object(self, f, enc_type)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
@@ -0,0 +1,225 @@
+'''
+Memory profiling of a live server, without an rdb file.
+
+Keys are read with DUMP, in pipelined windows over a single RespConnection, and parsed
+with RdbParser.parse_dump. `sample_memory` profiles a random sample of the keyspace
+and extrapolates it to the whole database, with confidence intervals.
+'''
+import sys
+import time
+import math
+import datetime
+
+from rdbtools.parser import RdbParser
+from rdbtools.memprofiler import MemoryCallback, BoundedStatsAggregator
+from rdbtools.callbacks import encode_key_text
+from rdbtools.resp import RespError
+
+SAMPLE_RANDOMKEY = 'randomkey'
+SAMPLE_SCAN = 'scan'
+SAMPLE_METHODS = (SAMPLE_RANDOMKEY, SAMPLE_SCAN)
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MARGIN = 0.01
+DEFAULT_MAX_OPS = 1000
+DEFAULT_WINDOW = 100
+TYPES = ('string', 'list', 'set', 'sortedset', 'hash')
+
+def dump_keys(redis, parser, keys):
+    '''
+    DUMPs `keys` in a single pipeline and parses them with `parser`. The PTTL of every key
+    is asked for in the same pipeline, so that expiry overhead is accounted for.
+    Returns the number of keys parsed. Missing keys, and keys that cannot be parsed, are
+    reported on stderr and left out.
+    '''
+    commands = []
+    for key in keys:
+        commands.append(('DUMP', key))
+        commands.append(('PTTL', key))
+    replies = redis.pipeline(commands)
+    now = datetime.datetime.utcnow()
+    found = 0
+    for index, key in enumerate(keys):
+        dump, ttl = replies[2 * index], replies[2 * index + 1]
+        if isinstance(dump, RespError):
+            sys.stderr.write('Could not dump key %s : %s\n' % (encode_key_text(key), dump))
+        elif dump is None:
+            sys.stderr.write('Key %s does not exist\n' % encode_key_text(key))
+        else:
+            expiry = None
+            # PTTL is -1 for keys without expiry
+            if isinstance(ttl, int) and ttl >= 0:
+                expiry = now + datetime.timedelta(milliseconds=ttl)
+            try:
+                parser.parse_dump(key, dump, expiry)
+            except Exception as e:
+                sys.stderr.write('Could not parse key %s : %s\n' % (encode_key_text(key), e))
+                continue
+            found += 1
+    return found
+
+class RateLimiter(object):
+    '''Spaces out operations so that no more than `ops_per_second` are sent on average'''
+    def __init__(self, ops_per_second, clock=time.time, sleep=time.sleep):
+        self._interval = 1.0 / ops_per_second if ops_per_second else 0
+        self._clock = clock
+        self._sleep = sleep
+        self._next = None
+
+    def acquire(self, ops):
+        '''Waits until `ops` more operations fit in the budget'''
+        if not self._interval:
+            return
+        now = self._clock()
+        if self._next is None or self._next < now:
+            self._next = now
+        elif self._next > now:
+            self._sleep(self._next - now)
+        self._next += ops * self._interval
+
+def normal_quantile(p):
+    '''Returns z such that P(Z <= z) = p for a standard normal Z, by bisection on erf'''
+    low, high = -10.0, 10.0
+    for i in range(100):
+        middle = (low + high) / 2
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+def sample_size(population, confidence=DEFAULT_CONFIDENCE, margin=DEFAULT_MARGIN):
+    '''
+    Number of keys to sample to estimate a proportion, such as the share of keys of a type,
+    within `margin` at the given `confidence`, corrected for a finite population.
+    '''
+    z = normal_quantile(1 - (1 - confidence) / 2)
+    n = z * z * 0.25 / (margin * margin)
+    if population:
+        n = n / (1 + (n - 1) / population)
+    return int(math.ceil(min(n, population)))
+
+class Estimator(object):
+    '''
+    Running sums of a per key quantity over the sample, giving an estimate of its total
+    over the whole database, with a normal confidence interval.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.squares += value * value
+
+    def estimate(self, population, z, without_replacement=False, sample_count=None):
+        '''
+        Estimates the total over `population` keys. `without_replacement` applies the finite
+        population correction, which is right for SCAN but not for RANDOMKEY, where the same key
+        can be drawn again. `sample_count` is the size of the sample when only non zero values were added.
+        '''
+        n = sample_count if sample_count is not None else self.count
+        if not n:
+            return {'estimate' : None, 'low' : None, 'high' : None}
+        mean = self.total / n
+        variance = 0.0
+        if n > 1:
+            variance = max(self.squares - n * mean * mean, 0.0) / (n - 1)
+        standard_error = math.sqrt(variance / n)
+        if without_replacement and population > 1:
+            standard_error *= math.sqrt(max(population - n, 0) / float(population - 1))
+        estimate = population * mean
+        spread = population * z * standard_error
+        return {'estimate' : estimate, 'low' : max(estimate - spread, 0.0), 'high' : estimate + spread}
+
+class SampleCollector():
+    '''A MemoryCallback reporter that keeps the sums needed for the estimates, and passes records on to `stats`'''
+    def __init__(self, stats):
+        self.stats = stats
+        self.records = 0
+        self.bytes = Estimator()
+        self.type_bytes = dict((t, Estimator()) for t in TYPES)
+        self.type_keys = dict((t, Estimator()) for t in TYPES)
+
+    def next_record(self, record):
+        self.records += 1
+        self.bytes.add(record.bytes)
+        # per type quantities are the record's value for its own type, and 0 for the others,
+        # so only the sample count is needed to account for the zeros
+        self.type_bytes[record.type].add(record.bytes)
+        self.type_keys[record.type].add(1)
+        self.stats.next_record(record)
+
+    def get_estimates(self, population, confidence, without_replacement):
+        z = normal_quantile(1 - (1 - confidence) / 2)
+        n = self.records
+        types = {}
+        for t in TYPES:
+            if not self.type_keys[t].count:
+                continue
+            types[t] = {'keys' : self.type_keys[t].estimate(population, z, without_replacement, n),
+                        'bytes' : self.type_bytes[t].estimate(population, z, without_replacement, n)}
+        return {'bytes' : self.bytes.estimate(population, z, without_replacement), 'types' : types}
+
+def sample_memory(redis, samples=None, method=SAMPLE_RANDOMKEY, confidence=DEFAULT_CONFIDENCE, margin=DEFAULT_MARGIN,
+                  max_ops=DEFAULT_MAX_OPS, window=DEFAULT_WINDOW, db=0, allocator=None, stats=None):
+    '''
+    Profiles a sample of the keys of the database selected on `redis`, a RespConnection,
+    sending at most `max_ops` commands per second.
+
+    `samples` defaults to the sample size needed for `margin` at `confidence`, see sample_size.
+    Returns a dict with the size of the database, the sample, the estimates of the number of
+    keys and bytes per type with their confidence interval, and `stats`, the aggregator
+    the sampled records went to. Its histograms are scaled by `scale` to the whole database.
+    '''
+    population = redis.execute('DBSIZE')
+    if samples is None:
+        samples = sample_size(population, confidence, margin)
+    samples = min(samples, population) if method == SAMPLE_SCAN else samples
+    if stats is None:
+        stats = BoundedStatsAggregator()
+    collector = SampleCollector(stats)
+    callback = MemoryCallback(collector, 64, allocator=allocator)
+    parser = RdbParser(callback, filters={})
+    limiter = RateLimiter(max_ops)
+
+    callback.start_rdb()
+    callback.start_database(db)
+    if population and samples:
+        if method == SAMPLE_RANDOMKEY:
+            drawn = 0
+            while drawn < samples:
+                count = min(window, samples - drawn)
+                # RANDOMKEY, then DUMP and PTTL for every key
+                limiter.acquire(3 * count)
+                keys = [key for key in redis.pipeline([('RANDOMKEY', )] * count) if isinstance(key, bytes)]
+                dump_keys(redis, parser, keys)
+                drawn += count
+        elif method == SAMPLE_SCAN:
+            batch = []
+            taken = 0
+            cursor = None
+            while taken < samples and cursor != b'0':
+                # every page of SCAN, then DUMP and PTTL for every key
+                limiter.acquire(1)
+                cursor, keys = redis.scan(cursor or b'0', count=window)
+                for key in keys[:samples - taken]:
+                    batch.append(key)
+                    taken += 1
+                    if len(batch) >= window:
+                        limiter.acquire(2 * len(batch))
+                        dump_keys(redis, parser, batch)
+                        batch = []
+            if batch:
+                limiter.acquire(2 * len(batch))
+                dump_keys(redis, parser, batch)
+        else:
+            raise Exception('sample_memory', 'Invalid sampling method %s. Expected one of %s' % (method, ", ".join(SAMPLE_METHODS)))
+    callback.end_database(db)
+    callback.end_rdb()
+
+    estimates = collector.get_estimates(population, confidence, method == SAMPLE_SCAN)
+    return {'dbsize' : population, 'samples' : collector.records, 'method' : method, 'confidence' : confidence,
+            'scale' : float(population) / collector.records if collector.records else None,
+            'estimates' : estimates, 'stats' : stats}
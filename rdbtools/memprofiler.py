@@ -1,21 +1,190 @@
 from collections import namedtuple
 import random
 import json
+import re
 
-from rdbtools.parser import RdbCallback
-from rdbtools.callbacks import encode_key
+from rdbtools.parser import RdbCallback, string_to_long, to_bytes
+from rdbtools.callbacks import encode_key_text
+from rdbtools.output import OutputSink
+from rdbtools.allocator import get_allocator, sds_header_size
+from rdbtools.sketches import LogHistogram, ReservoirSample, TopK, PrefixTrie, SpaceSaving, state_text, state_bytes
 
 ZSKIPLIST_MAXLEVEL=32
 ZSKIPLIST_P=0.25
 REDIS_SHARED_INTEGERS = 10000
 
-MemoryRecord = namedtuple('MemoryRecord', ['database', 'type', 'key', 'bytes', 'encoding','size', 'len_largest_element'])
+try:
+    INTEGER_TYPES = (int, long)
+except NameError:
+    INTEGER_TYPES = (int, )
+
+# How the levels of skiplist nodes are accounted for
+#   expected : the expected number of levels, computed in closed form once per sorted set
+#   simulated : a random level for every member, like zslRandomLevel, from a seeded generator
+SKIPLIST_MODEL_EXPECTED = 'expected'
+SKIPLIST_MODEL_SIMULATED = 'simulated'
+SKIPLIST_MODELS = (SKIPLIST_MODEL_EXPECTED, SKIPLIST_MODEL_SIMULATED)
+
+MemoryRecord = namedtuple('MemoryRecord', ['database', 'type', 'key', 'bytes', 'encoding','size', 'len_largest_element', 'expiry'])
+# expiry is a datetime, or None when the key does not expire
+MemoryRecord.__new__.__defaults__ = (None, )
+
+DEFAULT_DELIMITERS = ':'
+DEFAULT_NAMESPACE_DEPTH = 4
+DEFAULT_NAMESPACE_NODES = 10000
+DEFAULT_HEAVY_HITTERS = 1000
+# Key segments that look like ids are replaced by *, so user:1:sessions and user:2:sessions
+# are both counted in user:*:sessions
+ID_SEGMENT = re.compile(br'(?:[0-9]+|(?=[^0-9]*[0-9])[0-9a-fA-F-]{8,})\Z')
+OTHER_GROUP = 'other'
+
+# Limits of the html report, so its size does not depend on the number of keys
+DEFAULT_REPORT_POINTS = 1000
+DEFAULT_REPORT_ROWS = 50
+
+def report_namespaces(namespaces, max_rows):
+    report = namespaces.get_namespaces()
+    report['prefixes'] = report['prefixes'][:max_rows]
+    report['heavy_hitters'] = report['heavy_hitters'][:max_rows]
+    return report
+
+# Partial results of the profiler, saved with `get_state` and combined by `merge_states`
+STATE_VERSION = 2
+AGGREGATOR_EXACT = 'exact'
+AGGREGATOR_BOUNDED = 'bounded'
+
+def key_text(key):
+    '''Returns `key` as text, escaped the same way as the json output does'''
+    return json.loads(encode_key_text(key))
+
+def load_aggregates(aggregates):
+    '''The aggregates of a state, with the database numbers json turned into strings made integers again'''
+    aggregates = dict(aggregates)
+    if 'database_memory' in aggregates:
+        aggregates['database_memory'] = dict((int(db), value) for db, value in aggregates['database_memory'].items())
+    return aggregates
+
+def load_number(text):
+    '''A number json turned into a string as a dict key'''
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def merge_counts(target, source):
+    '''Adds the counts of `source` to `target`. Both are dicts of numbers, or dicts of such dicts'''
+    for heading, value in source.items():
+        if isinstance(value, dict):
+            merge_counts(target.setdefault(heading, {}), value)
+        else:
+            target[heading] = target.get(heading, 0) + value
+
+def compile_groupings(key_groupings):
+    '''
+    Compiles a list of regexes into a single matcher. Returns a function that gives
+    the index of the first regex matching the start of a key, or None.
+    '''
+    if not key_groupings:
+        return lambda key: None
+    alternatives = "|".join("(?P<g%d>%s)" % (index, regex) for index, regex in enumerate(key_groupings))
+    try:
+        # keys are byte strings, so are the regular expressions
+        matcher = re.compile(to_bytes(alternatives))
+    except (re.error, AssertionError):
+        # too many groups, or backreferences that no longer point to the right group
+        regexes = [re.compile(to_bytes(regex)) for regex in key_groupings]
+        def match_each(key):
+            for index, regex in enumerate(regexes):
+                if regex.match(key):
+                    return index
+            return None
+        return match_each
+    def match(key):
+        m = matcher.match(key)
+        if m is None:
+            return None
+        return int(m.lastgroup[1:])
+    return match
+
+class NamespaceAggregator():
+    '''
+    Memory and key counts by key namespace, within a fixed memory budget.
+
+    Keys are split on `delimiters`, and segments that look like ids are replaced by *.
+    - prefixes : a PrefixTrie of the first `max_depth` segments, pruned to about `max_nodes` nodes
+    - heavy_hitters : a SpaceSaving sketch of the `heavy_hitters` namespaces using the most memory
+    - groups : totals per regex of `key_groupings`, keys matching none of them are counted as other
+    '''
+    def __init__(self, key_groupings = None, delimiters = DEFAULT_DELIMITERS, max_depth = DEFAULT_NAMESPACE_DEPTH,
+                 max_nodes = DEFAULT_NAMESPACE_NODES, heavy_hitters = DEFAULT_HEAVY_HITTERS):
+        self._key_groupings = list(key_groupings or [])
+        self._match_group = compile_groupings(self._key_groupings)
+        self._delimiters = delimiters
+        self._splitter = re.compile(b'([' + re.escape(to_bytes(delimiters)) + b'])')
+        self._max_depth = max_depth
+        self.prefixes = PrefixTrie(max_nodes)
+        self.heavy_hitters = SpaceSaving(heavy_hitters)
+        self.groups = {}
+
+    def namespace(self, key):
+        '''Returns the path segments of `key`, e.g. ['user:', '*:', 'sessions'] for user:42:sessions'''
+        parts = self._splitter.split(to_bytes(key))
+        path = []
+        for index in range(0, len(parts), 2):
+            segment = parts[index]
+            if ID_SEGMENT.match(segment):
+                segment = b'*'
+            if index + 1 < len(parts):
+                segment += parts[index + 1]
+            path.append(segment)
+        return path
+
+    def next_record(self, record):
+        path = self.namespace(record.key)
+        self.prefixes.add(path[:self._max_depth], record.bytes)
+        self.heavy_hitters.add(b"".join(path), record.bytes)
+
+        index = self._match_group(to_bytes(record.key))
+        group = OTHER_GROUP if index is None else self._key_groupings[index]
+        totals = self.groups.get(group)
+        if totals is None:
+            totals = self.groups[group] = {'bytes' : 0, 'keys' : 0}
+        totals['bytes'] += record.bytes
+        totals['keys'] += 1
+
+    def get_namespaces(self):
+        prefixes = [{'prefix' : key_text(prefix), 'bytes' : nbytes, 'keys' : keys}
+                    for prefix, nbytes, keys in self.prefixes.prefixes()]
+        prefixes.sort(key=lambda p: p['bytes'], reverse=True)
+        heavy_hitters = [{'namespace' : key_text(namespace), 'bytes' : nbytes, 'error' : error}
+                         for namespace, nbytes, error in self.heavy_hitters.items()]
+        return {'prefixes' : prefixes, 'pruned_below' : self.prefixes.pruned_below,
+                'heavy_hitters' : heavy_hitters, 'groups' : self.groups}
+
+    def merge(self, other):
+        self.prefixes.merge(other.prefixes)
+        self.heavy_hitters.merge(other.heavy_hitters)
+        merge_counts(self.groups, other.groups)
+
+    def get_state(self):
+        return {'key_groupings' : self._key_groupings, 'delimiters' : self._delimiters, 'max_depth' : self._max_depth,
+                'prefixes' : self.prefixes.get_state(), 'heavy_hitters' : self.heavy_hitters.get_state(),
+                'groups' : self.groups}
+
+    @classmethod
+    def from_state(cls, state):
+        namespaces = cls(state['key_groupings'], state['delimiters'], state['max_depth'])
+        namespaces.prefixes = PrefixTrie.from_state(state['prefixes'])
+        namespaces.heavy_hitters = SpaceSaving.from_state(state['heavy_hitters'])
+        namespaces.groups = state['groups']
+        return namespaces
 
 class StatsAggregator():
-    def __init__(self, key_groupings = None):
+    def __init__(self, key_groupings = None, namespaces = None):
         self.aggregates = {}
         self.scatters = {}
         self.histograms = {}
+        self.namespaces = namespaces or NamespaceAggregator(key_groupings)
 
     def next_record(self, record):
         self.add_aggregate('database_memory', record.database, record.bytes)
@@ -24,9 +193,10 @@ class StatsAggregator():
         
         self.add_aggregate('type_count', record.type, 1)
         self.add_aggregate('encoding_count', record.encoding, 1)
+        self.namespaces.next_record(record)
     
         self.add_histogram(record.type + "_length", record.size)
-        self.add_histogram(record.type + "_memory", (record.bytes/10) * 10)
+        self.add_histogram(record.type + "_memory", (record.bytes // 10) * 10)
         
         if record.type == 'list':
             self.add_scatter('list_memory_by_length', record.bytes, record.size)
@@ -65,34 +235,366 @@ class StatsAggregator():
         self.scatters[heading].append([x, y])
   
     def get_json(self):
-        return json.dumps({"aggregates":self.aggregates, "scatters":self.scatters, "histograms":self.histograms})
+        return json.dumps({"aggregates":self.aggregates, "scatters":self.scatters, "histograms":self.histograms,
+                           "namespaces":self.namespaces.get_namespaces()})
+
+    def get_report(self, max_points = DEFAULT_REPORT_POINTS, max_rows = DEFAULT_REPORT_ROWS):
+        '''
+        The data of the html report. Histograms are binned in log buckets as [low, high, count]
+        and scatters are sampled down to `max_points` points.
+        '''
+        histograms = {}
+        for heading, values in self.histograms.items():
+            histogram = LogHistogram(precision=2)
+            for value, count in values.items():
+                histogram.add(value, count)
+            histograms[heading] = [list(bucket) for bucket in histogram.buckets()]
+        scatters = {}
+        for heading, points in self.scatters.items():
+            sample = ReservoirSample(max_points)
+            for point in points:
+                sample.add(point)
+            scatters[heading] = sample.items
+        return {"aggregates":self.aggregates, "histograms":histograms, "scatters":scatters,
+                "namespaces":report_namespaces(self.namespaces, max_rows)}
+
+    def merge(self, other):
+        merge_counts(self.aggregates, other.aggregates)
+        merge_counts(self.histograms, other.histograms)
+        for heading, points in other.scatters.items():
+            self.scatters.setdefault(heading, []).extend(points)
+        self.namespaces.merge(other.namespaces)
+
+    def get_state(self):
+        return {'kind' : AGGREGATOR_EXACT, 'version' : STATE_VERSION, 'aggregates' : self.aggregates,
+                'scatters' : self.scatters, 'histograms' : self.histograms, 'namespaces' : self.namespaces.get_state()}
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls(namespaces = NamespaceAggregator.from_state(state['namespaces']))
+        stats.aggregates = load_aggregates(state['aggregates'])
+        stats.scatters = state['scatters']
+        # histograms are keyed by value, which json turns into strings
+        stats.histograms = dict((heading, dict((load_number(value), count) for value, count in values.items()))
+                                for heading, values in state['histograms'].items())
+        return stats
         
+DEFAULT_SCATTER_SAMPLES = 2000
+PERCENTILES = (50, 90, 99, 99.9)
+
+class BoundedStatsAggregator():
+    '''
+    Same report as StatsAggregator, using a fixed amount of memory however many keys there are.
+
+    Histograms use log-scaled buckets (see LogHistogram) instead of one entry per distinct value,
+    scatters keep a uniform sample of at most `scatter_samples` keys per type,
+    and per type size percentiles are estimated from fine grained log histograms.
+    '''
+    def __init__(self, key_groupings = None, scatter_samples = DEFAULT_SCATTER_SAMPLES, seed = 0,
+                 namespaces = None, top_keys = None):
+        self.aggregates = {}
+        self.scatters = {}
+        self.histograms = {}
+        self.sizes = {}
+        self.namespaces = namespaces or NamespaceAggregator(key_groupings)
+        # a TopKeysReport, or None
+        self.top_keys = top_keys
+        self._scatter_samples = scatter_samples
+        self._seed = seed
+
+    def next_record(self, record):
+        self.add_aggregate('database_memory', record.database, record.bytes)
+        self.add_aggregate('type_memory', record.type, record.bytes)
+        self.add_aggregate('encoding_memory', record.encoding, record.bytes)
+
+        self.add_aggregate('type_count', record.type, 1)
+        self.add_aggregate('encoding_count', record.encoding, 1)
+        self.namespaces.next_record(record)
+
+        self.add_histogram(record.type + "_length", record.size)
+        self.add_histogram(record.type + "_memory", record.bytes)
+        self.add_size(record.type, record.bytes)
+        if self.top_keys is not None:
+            self.top_keys.next_record(record)
+
+        if not record.type in ('list', 'hash', 'set', 'sortedset', 'string'):
+            raise Exception('Invalid data type %s' % record.type)
+        self.add_scatter(record.type + '_memory_by_length', record.bytes, record.size)
+
+    def add_aggregate(self, heading, subheading, metric):
+        aggregate = self.aggregates.get(heading)
+        if aggregate is None:
+            aggregate = self.aggregates[heading] = {}
+        aggregate[subheading] = aggregate.get(subheading, 0) + metric
+
+    def add_histogram(self, heading, metric):
+        histogram = self.histograms.get(heading)
+        if histogram is None:
+            histogram = self.histograms[heading] = LogHistogram(precision=2)
+        histogram.add(metric)
+
+    def add_size(self, heading, metric):
+        sketch = self.sizes.get(heading)
+        if sketch is None:
+            sketch = self.sizes[heading] = LogHistogram(precision=5)
+        sketch.add(metric)
+
+    def add_scatter(self, heading, x, y):
+        sample = self.scatters.get(heading)
+        if sample is None:
+            sample = self.scatters[heading] = ReservoirSample(self._scatter_samples, self._seed)
+        sample.add([x, y])
+
+    def get_percentiles(self):
+        percentiles = {}
+        for heading, sketch in self.sizes.items():
+            stats = {'count' : sketch.count, 'total' : sketch.total, 'max' : sketch.max}
+            for p in PERCENTILES:
+                stats['p%s' % p] = sketch.quantile(p / 100.0)
+            percentiles[heading] = stats
+        return percentiles
+
+    def get_json(self):
+        # histograms are keyed by the smallest value of each bucket, like the exact histograms are keyed by value
+        histograms = {}
+        for heading, histogram in self.histograms.items():
+            histograms[heading] = dict((low, count) for low, high, count in histogram.buckets())
+        scatters = dict((heading, sample.items) for heading, sample in self.scatters.items())
+        report = {"aggregates":self.aggregates, "scatters":scatters, "histograms":histograms,
+                  "percentiles":self.get_percentiles(), "namespaces":self.namespaces.get_namespaces()}
+        if self.top_keys is not None:
+            report["top_keys"] = self.top_keys.get_report()
+        return json.dumps(report)
+
+    def get_report(self, max_points = DEFAULT_REPORT_POINTS, max_rows = DEFAULT_REPORT_ROWS):
+        '''The data of the html report, see StatsAggregator.get_report'''
+        histograms = dict((heading, [list(bucket) for bucket in histogram.buckets()])
+                          for heading, histogram in self.histograms.items())
+        scatters = {}
+        for heading, sample in self.scatters.items():
+            items = sample.items
+            if len(items) > max_points:
+                items = random.Random(self._seed).sample(items, max_points)
+            scatters[heading] = items
+        report = {"aggregates":self.aggregates, "histograms":histograms, "scatters":scatters,
+                  "percentiles":self.get_percentiles(), "namespaces":report_namespaces(self.namespaces, max_rows)}
+        if self.top_keys is not None:
+            report["top_keys"] = self.top_keys.get_report(max_rows)
+        return report
+
+    def merge(self, other):
+        merge_counts(self.aggregates, other.aggregates)
+        for sketches, others, factory in ((self.histograms, other.histograms, lambda: LogHistogram(precision=2)),
+                                          (self.sizes, other.sizes, lambda: LogHistogram(precision=5)),
+                                          (self.scatters, other.scatters, lambda: ReservoirSample(self._scatter_samples, self._seed))):
+            for heading, sketch in others.items():
+                if not heading in sketches:
+                    sketches[heading] = factory()
+                sketches[heading].merge(sketch)
+        self.namespaces.merge(other.namespaces)
+        if other.top_keys is not None:
+            if self.top_keys is None:
+                self.top_keys = TopKeysReport(None, other.top_keys.k)
+            self.top_keys.merge(other.top_keys)
+
+    def get_state(self):
+        state = {'kind' : AGGREGATOR_BOUNDED, 'version' : STATE_VERSION, 'aggregates' : self.aggregates,
+                 'scatter_samples' : self._scatter_samples, 'seed' : self._seed,
+                 'histograms' : dict((heading, h.get_state()) for heading, h in self.histograms.items()),
+                 'sizes' : dict((heading, h.get_state()) for heading, h in self.sizes.items()),
+                 'scatters' : dict((heading, sample.get_state()) for heading, sample in self.scatters.items()),
+                 'namespaces' : self.namespaces.get_state()}
+        if self.top_keys is not None:
+            state['top_keys'] = self.top_keys.get_state()
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        top_keys = None
+        if state.get('top_keys') is not None:
+            top_keys = TopKeysReport.from_state(state['top_keys'])
+        stats = cls(scatter_samples = state['scatter_samples'], seed = state['seed'],
+                    namespaces = NamespaceAggregator.from_state(state['namespaces']), top_keys = top_keys)
+        stats.aggregates = load_aggregates(state['aggregates'])
+        stats.histograms = dict((heading, LogHistogram.from_state(h)) for heading, h in state['histograms'].items())
+        stats.sizes = dict((heading, LogHistogram.from_state(h)) for heading, h in state['sizes'].items())
+        stats.scatters = dict((heading, ReservoirSample.from_state(sample, stats._seed))
+                              for heading, sample in state['scatters'].items())
+        return stats
+
+def load_state(state):
+    '''Rebuilds an aggregator from the result of its `get_state`'''
+    if state.get('version') != STATE_VERSION:
+        raise Exception('load_state', 'Unsupported state version %s. Expected %d' % (state.get('version'), STATE_VERSION))
+    if state.get('kind') == AGGREGATOR_EXACT:
+        return StatsAggregator.from_state(state)
+    elif state.get('kind') == AGGREGATOR_BOUNDED:
+        return BoundedStatsAggregator.from_state(state)
+    raise Exception('load_state', 'Unknown aggregator %s' % state.get('kind'))
+
+def merge_states(states):
+    '''Merges a list of states from `get_state` into a single aggregator'''
+    if not states:
+        raise Exception('merge_states', 'No state to merge')
+    aggregators = [load_state(state) for state in states]
+    kinds = set(state['kind'] for state in states)
+    if len(kinds) > 1:
+        raise Exception('merge_states', 'Cannot merge exact and bounded states')
+    merged = aggregators[0]
+    for aggregator in aggregators[1:]:
+        merged.merge(aggregator)
+    return merged
+
+# Metrics keys can be ranked by, as (name, field of MemoryRecord)
+TOP_KEYS_METRICS = (('bytes', 'bytes'), ('elements', 'size'), ('largest_element', 'len_largest_element'))
+DEFAULT_TOP_KEYS = 100
+
+class TopKeysReport():
+    '''
+    The `k` largest keys overall, per type and per database, ranked by memory, by number of
+    elements and by length of the largest element. Memory use is O(k) per ranking.
+
+    When `alert_bytes` or `alert_elements` is set, every key that reaches it is reported
+    to `alerts` as soon as it is parsed, instead of waiting for the end of the rdb file.
+
+    The report is written to `out` as csv once the whole rdb file is parsed.
+    '''
+    def __init__(self, out, k = DEFAULT_TOP_KEYS, alert_bytes = None, alert_elements = None, alerts = None):
+        self._out = OutputSink.wrap(out) if out is not None else None
+        self._alert_bytes = alert_bytes
+        self._alert_elements = alert_elements
+        self._alerts = alerts
+        self.k = k
+        self.rankings = {}
+        # (type, database) : [(index of the metric in MemoryRecord, TopK)] of every ranking a record goes to
+        self._targets = {}
+
+    def ranking(self, scope, metric):
+        top = self.rankings.get((scope, metric))
+        if top is None:
+            top = self.rankings[(scope, metric)] = TopK(self.k)
+        return top
+
+    def next_record(self, record):
+        targets = self._targets.get((record.type, record.database))
+        if targets is None:
+            targets = self._targets[(record.type, record.database)] = [
+                (MemoryRecord._fields.index(field), self.ranking(scope, metric))
+                for scope in ('all', 'type:%s' % record.type, 'db:%d' % record.database)
+                for metric, field in TOP_KEYS_METRICS]
+        for index, top in targets:
+            top.add(record[index], record)
+
+        if self._alerts is not None:
+            if ((self._alert_bytes is not None and record.bytes >= self._alert_bytes) or
+                    (self._alert_elements is not None and record.size >= self._alert_elements)):
+                self._alerts.write("big key : database=%d type=%s key=%s bytes=%d elements=%d\n" % (
+                    record.database, record.type, encode_key_text(record.key), record.bytes, record.size))
+                self._alerts.flush()
+
+    def get_rows(self):
+        '''Yields (scope, metric, rank, record), scopes sorted by name, metrics in the order of TOP_KEYS_METRICS'''
+        metrics = [metric for metric, field in TOP_KEYS_METRICS]
+        for scope, metric in sorted(self.rankings, key=lambda sm: (sm[0] != 'all', sm[0], metrics.index(sm[1]))):
+            for rank, (weight, record) in enumerate(self.rankings[(scope, metric)].items()):
+                yield scope, metric, rank + 1, record
+
+    def get_report(self, max_rows = None):
+        report = {}
+        for scope, metric, rank, record in self.get_rows():
+            if max_rows is not None and rank > max_rows:
+                continue
+            report.setdefault(scope, {}).setdefault(metric, []).append({
+                'database' : record.database, 'type' : record.type, 'key' : key_text(record.key), 'bytes' : record.bytes,
+                'encoding' : record.encoding, 'num_elements' : record.size, 'len_largest_element' : record.len_largest_element})
+        return report
+
+    def get_json(self):
+        return json.dumps(self.get_report())
+
+    def merge(self, other):
+        for (scope, metric), top in other.rankings.items():
+            self.ranking(scope, metric).merge(top)
+
+    def get_state(self):
+        rankings = []
+        for (scope, metric), top in self.rankings.items():
+            # the report does not show expiry, so it is left out of the state
+            items = [[weight, list(record._replace(key=state_text(record.key), expiry=None))] for weight, record in top.items()]
+            rankings.append([scope, metric, items])
+        return {'k' : self.k, 'rankings' : rankings}
+
+    @classmethod
+    def from_state(cls, state):
+        report = cls(None, state['k'])
+        for scope, metric, items in state['rankings']:
+            top = report.ranking(scope, metric)
+            for weight, record in items:
+                record = MemoryRecord(*record)
+                top.add(weight, record._replace(key=state_bytes(record.key)))
+        return report
+
+    def end_rdb(self):
+        if self._out is None:
+            return
+        self._out.write("%s,%s,%s,%s,%s,%s,%s,%s,%s,%s\n" % ("scope", "rank_by", "rank", "database", "type", "key",
+                                                 "size_in_bytes", "encoding", "num_elements", "len_largest_element"))
+        for scope, metric, rank, record in self.get_rows():
+            self._out.write("%s,%s,%d,%d,%s,%s,%d,%s,%d,%d\n" % (scope, metric, rank, record.database, record.type,
+                                                 encode_key_text(record.key), record.bytes, record.encoding, record.size, record.len_largest_element))
+        self._out.flush()
+
 class PrintAllKeys():
-    def __init__(self, out):
-        self._out = out
+    '''
+    Writes a csv line for every key. Keys using fewer than `min_bytes` bytes or with fewer
+    than `min_elements` elements are skipped before anything is formatted.
+    '''
+    def __init__(self, out, min_bytes = 0, min_elements = 0):
+        self._out = OutputSink.wrap(out)
+        self._min_bytes = min_bytes
+        self._min_elements = min_elements
         self._out.write("%s,%s,%s,%s,%s,%s,%s\n" % ("database", "type", "key", 
                                                  "size_in_bytes", "encoding", "num_elements", "len_largest_element"))
     
     def next_record(self, record) :
-        self._out.write("%d,%s,%s,%d,%s,%d,%d\n" % (record.database, record.type, encode_key(record.key), 
+        if record.bytes < self._min_bytes or record.size < self._min_elements:
+            return
+        self._out.write("%d,%s,%s,%d,%s,%d,%d\n" % (record.database, record.type, encode_key_text(record.key), 
                                                  record.bytes, record.encoding, record.size, record.len_largest_element))
+
+    def flush(self):
+        self._out.flush()
     
 class MemoryCallback(RdbCallback):
     '''Calculates the memory used if this rdb file were loaded into RAM
         The memory usage is approximate, and based on heuristics.
     '''
-    def __init__(self, stream, architecture):
+    def __init__(self, stream, architecture, skiplist_model=SKIPLIST_MODEL_EXPECTED, seed=0, allocator=None):
         self._stream = stream
         self._dbnum = 0
         self._current_size = 0
         self._current_encoding = None
         self._current_length = 0
+        self._current_expiry = None
         self._len_largest_element = 0
         
         if architecture == 64 or architecture == '64':
             self._pointer_size = 8
         elif architecture == 32 or architecture == '32':
             self._pointer_size = 4
+
+        if not skiplist_model in SKIPLIST_MODELS:
+            raise Exception('MemoryCallback', 'Invalid skiplist model %s. Expected one of %s' % (skiplist_model, ", ".join(SKIPLIST_MODELS)))
+        self._simulate_skiplist = skiplist_model == SKIPLIST_MODEL_SIMULATED
+        self._random = random.Random(seed)
+        # None is the flat model, see rdbtools.allocator
+        self._allocator = get_allocator(allocator, self._pointer_size)
+        self._expected_skiplist_node_size = self.expected_skiplist_node_size()
+        # Overheads added for every element do not change, so they are computed once
+        self._hashtable_entry_size = self.hashtable_entry_overhead()
+        self._linkedlist_entry_size = self.linkedlist_entry_overhead()
+        self._skiplist_entry_size = self.skiplist_entry_overhead()
+        self._robj_size = self.robj_overhead()
         
     def start_rdb(self):
         pass
@@ -101,10 +603,20 @@ class MemoryCallback(RdbCallback):
         self._dbnum = db_number
 
     def end_database(self, db_number):
-        pass
+        self.flush_stream()
         
     def end_rdb(self):
-        pass
+        # Reporters that only produce output once everything is parsed expose end_rdb
+        end_rdb = getattr(self._stream, 'end_rdb', None)
+        if end_rdb is not None:
+            end_rdb()
+        self.flush_stream()
+
+    def flush_stream(self):
+        # Reporters that write output expose flush, aggregators do not
+        flush = getattr(self._stream, 'flush', None)
+        if flush is not None:
+            flush()
        
     def set(self, key, value, expiry, info):
         self._current_encoding = info['encoding']
@@ -113,11 +625,23 @@ class MemoryCallback(RdbCallback):
         size += self.key_expiry_overhead(expiry)
         
         length = element_length(value)
-        record = MemoryRecord(self._dbnum, "string", key, size, self._current_encoding, length, length)
+        record = MemoryRecord(self._dbnum, "string", key, size, self._current_encoding, length, length, expiry)
+        self._stream.next_record(record)
+        self.end_key()
+
+    def set_begin(self, key, length, expiry, info):
+        # long strings only need their length. set_chunk is left out, so the parser skips their bytes
+        self._current_encoding = info['encoding']
+        size = self.sizeof_string(key) + self.sizeof_raw_string(length) + self.top_level_object_overhead()
+        size += 2*self.robj_overhead()
+        size += self.key_expiry_overhead(expiry)
+
+        record = MemoryRecord(self._dbnum, "string", key, size, self._current_encoding, length, length, expiry)
         self._stream.next_record(record)
         self.end_key()
     
     def start_hash(self, key, length, expiry, info):
+        self._current_expiry = expiry
         self._current_encoding = info['encoding']
         self._current_length = length        
         size = self.sizeof_string(key)
@@ -134,19 +658,22 @@ class MemoryCallback(RdbCallback):
         self._current_size = size
     
     def hset(self, key, field, value):
-        if(element_length(field) > self._len_largest_element) :
-            self._len_largest_element = element_length(field)
-        if(element_length(value) > self._len_largest_element) :
-            self._len_largest_element = element_length(value)
+        length = element_length(field)
+        if(length > self._len_largest_element) :
+            self._len_largest_element = length
+        length = element_length(value)
+        if(length > self._len_largest_element) :
+            self._len_largest_element = length
         
         if self._current_encoding == 'hashtable':
             self._current_size += self.sizeof_string(field)
             self._current_size += self.sizeof_string(value)
-            self._current_size += self.hashtable_entry_overhead()
-            self._current_size += 2*self.robj_overhead()
+            self._current_size += self._hashtable_entry_size
+            self._current_size += 2*self._robj_size
     
     def end_hash(self, key):
-        record = MemoryRecord(self._dbnum, "hash", key, self._current_size, self._current_encoding, self._current_length, self._len_largest_element)
+        record = MemoryRecord(self._dbnum, "hash", key, self._current_size, self._current_encoding, self._current_length, self._len_largest_element,
+                              self._current_expiry)
         self._stream.next_record(record)
         self.end_key()
     
@@ -155,20 +682,23 @@ class MemoryCallback(RdbCallback):
         self.start_hash(key, cardinality, expiry, info)
 
     def sadd(self, key, member):
-        if(element_length(member) > self._len_largest_element) :
-            self._len_largest_element = element_length(member)
+        length = element_length(member)
+        if(length > self._len_largest_element) :
+            self._len_largest_element = length
             
         if self._current_encoding == 'hashtable':
             self._current_size += self.sizeof_string(member)
-            self._current_size += self.hashtable_entry_overhead()
-            self._current_size += self.robj_overhead()
+            self._current_size += self._hashtable_entry_size
+            self._current_size += self._robj_size
     
     def end_set(self, key):
-        record = MemoryRecord(self._dbnum, "set", key, self._current_size, self._current_encoding, self._current_length, self._len_largest_element)
+        record = MemoryRecord(self._dbnum, "set", key, self._current_size, self._current_encoding, self._current_length, self._len_largest_element,
+                              self._current_expiry)
         self._stream.next_record(record)
         self.end_key()
     
     def start_list(self, key, length, expiry, info):
+        self._current_expiry = expiry
         self._current_length = length
         self._current_encoding = info['encoding']
         size = self.sizeof_string(key)
@@ -185,20 +715,23 @@ class MemoryCallback(RdbCallback):
         self._current_size = size
             
     def rpush(self, key, value) :
-        if(element_length(value) > self._len_largest_element) :
-            self._len_largest_element = element_length(value)
+        length = element_length(value)
+        if(length > self._len_largest_element) :
+            self._len_largest_element = length
         
         if self._current_encoding == 'linkedlist':
             self._current_size += self.sizeof_string(value)
-            self._current_size += self.linkedlist_entry_overhead()
-            self._current_size += self.robj_overhead()
+            self._current_size += self._linkedlist_entry_size
+            self._current_size += self._robj_size
     
     def end_list(self, key):
-        record = MemoryRecord(self._dbnum, "list", key, self._current_size, self._current_encoding, self._current_length, self._len_largest_element)
+        record = MemoryRecord(self._dbnum, "list", key, self._current_size, self._current_encoding, self._current_length, self._len_largest_element,
+                              self._current_expiry)
         self._stream.next_record(record)
         self.end_key()
     
     def start_sorted_set(self, key, length, expiry, info):
+        self._current_expiry = expiry
         self._current_length = length
         self._current_encoding = info['encoding']
         size = self.sizeof_string(key)
@@ -210,27 +743,34 @@ class MemoryCallback(RdbCallback):
             size += info['sizeof_value']
         elif 'encoding' in info and info['encoding'] == 'skiplist':
             size += self.skiplist_overhead(length)
+            if not self._simulate_skiplist:
+                size += int(round(length * self._expected_skiplist_node_size))
         else:
             raise Exception('start_sorted_set', 'Could not find encoding or sizeof_value in info object %s' % info)
         self._current_size = size
     
     def zadd(self, key, score, member):
-        if(element_length(member) > self._len_largest_element):
-            self._len_largest_element = element_length(member)
+        length = element_length(member)
+        if(length > self._len_largest_element):
+            self._len_largest_element = length
         
         if self._current_encoding == 'skiplist':
             self._current_size += 8 # self.sizeof_string(score)
             self._current_size += self.sizeof_string(member)
-            self._current_size += 2*self.robj_overhead()
-            self._current_size += self.skiplist_entry_overhead()
+            self._current_size += 2*self._robj_size
+            self._current_size += self._skiplist_entry_size
+            if self._simulate_skiplist:
+                self._current_size += self.skiplist_node_size(self.zset_random_level())
     
     def end_sorted_set(self, key):
-        record = MemoryRecord(self._dbnum, "sortedset", key, self._current_size, self._current_encoding, self._current_length, self._len_largest_element)
+        record = MemoryRecord(self._dbnum, "sortedset", key, self._current_size, self._current_encoding, self._current_length, self._len_largest_element,
+                              self._current_expiry)
         self._stream.next_record(record)
         self.end_key()
         
     def end_key(self):
         self._current_encoding = None
+        self._current_expiry = None
         self._current_size = 0
         self._len_largest_element = 0
     
@@ -242,15 +782,25 @@ class MemoryCallback(RdbCallback):
         # 1 extra byte is used to store the null character at the end of the string
         # Redis internally stores integers as a long
         #  Integers less than REDIS_SHARED_INTEGERS are stored in a shared memory pool
-        try:
-            num = int(string)
+        # The parser passes integer encoded values as ints, strings only need a check
+        # when they could still be integers that were not encoded as such
+        if type(string) in INTEGER_TYPES:
+            num = string
+        else:
+            num = string_to_long(string)
+        if num is not None:
             if num < REDIS_SHARED_INTEGERS :
                 return 0
             else :
                 return 8
-        except ValueError:
-            pass
-        return len(string) + 8 + 1 + self.malloc_overhead()
+        return self.sizeof_raw_string(len(string))
+
+    def sizeof_raw_string(self, length):
+        # The size of a string of `length` bytes that is not an integer
+        if self._allocator is None:
+            return length + 8 + 1 + self.malloc_overhead()
+        # Newer redis versions pick the smallest sds header that can hold the length
+        return self._allocator.allocated(sds_header_size(length) + length + 1)
 
     def top_level_object_overhead(self):
         # Each top level object is an entry in a dictionary, and so we have to include 
@@ -276,32 +826,57 @@ class MemoryCallback(RdbCallback):
         # When the hashtable is rehashing, another instance of **table is created
         # We are assuming 0.5 percent probability of rehashing, and so multiply 
         # the size of **table by 1.5
-        return 56 + 4*self.sizeof_pointer() + self.next_power(size)*self.sizeof_pointer()*1.5
+        return self.malloc(56 + 4*self.sizeof_pointer()) + self.malloc(self.next_power(size)*self.sizeof_pointer())*1.5
         
     def hashtable_entry_overhead(self):
         # See  https://github.com/antirez/redis/blob/unstable/src/dict.h
         # Each dictEntry has 3 pointers 
-        return 3*self.sizeof_pointer()
+        return self.malloc(3*self.sizeof_pointer())
     
     def linkedlist_overhead(self):
         # See https://github.com/antirez/redis/blob/unstable/src/adlist.h
         # A list has 5 pointers + an unsigned long
-        return 8 + 5*self.sizeof_pointer()
+        return self.malloc(8 + 5*self.sizeof_pointer())
     
     def linkedlist_entry_overhead(self):
         # See https://github.com/antirez/redis/blob/unstable/src/adlist.h
         # A node has 3 pointers
-        return 3*self.sizeof_pointer()
+        return self.malloc(3*self.sizeof_pointer())
     
     def skiplist_overhead(self, size):
         return 2*self.sizeof_pointer() + self.hashtable_overhead(size) + (2*self.sizeof_pointer() + 16)
     
     def skiplist_entry_overhead(self):
-        return self.hashtable_entry_overhead() + 2*self.sizeof_pointer() + 8 + (self.sizeof_pointer() + 8) * self.zset_random_level()
+        # The skiplist node itself is accounted for separately, see skiplist_node_size
+        return self.hashtable_entry_overhead()
+
+    def skiplist_node_size(self, levels):
+        # A skiplist node has a member pointer, a double score and a backward pointer,
+        # and for each level a forward pointer and an unsigned int span
+        return self.malloc(2*self.sizeof_pointer() + 8 + (self.sizeof_pointer() + 8) * levels)
+
+    def expected_skiplist_node_size(self):
+        # zslRandomLevel keeps adding a level with probability ZSKIPLIST_P, up to ZSKIPLIST_MAXLEVEL,
+        # so a node has k levels with probability P^(k-1) * (1-P), and MAXLEVEL levels with probability P^(MAXLEVEL-1).
+        # The node sizes are rounded by the allocator, so the expectation is taken over node sizes rather than levels.
+        expected = 0.0
+        for level in range(1, ZSKIPLIST_MAXLEVEL + 1):
+            if level < ZSKIPLIST_MAXLEVEL:
+                probability = ZSKIPLIST_P ** (level - 1) * (1 - ZSKIPLIST_P)
+            else:
+                probability = ZSKIPLIST_P ** (level - 1)
+            expected += probability * self.skiplist_node_size(level)
+        return expected
     
     def robj_overhead(self):
-        return self.sizeof_pointer() + 8
+        return self.malloc(self.sizeof_pointer() + 8)
         
+    def malloc(self, size):
+        # Bytes actually used by an allocation of `size` bytes
+        if self._allocator is None:
+            return size
+        return self._allocator.allocated(size)
+
     def malloc_overhead(self):
         return self.size_t()
 
@@ -319,10 +894,10 @@ class MemoryCallback(RdbCallback):
  
     def zset_random_level(self):
         level = 1
-        rint = random.randint(0, 0xFFFF)
+        rint = self._random.randint(0, 0xFFFF)
         while (rint < ZSKIPLIST_P * 0xFFFF):
             level += 1
-            rint = random.randint(0, 0xFFFF)        
+            rint = self._random.randint(0, 0xFFFF)        
         if level < ZSKIPLIST_MAXLEVEL :
             return level
         else:
@@ -330,9 +905,12 @@ class MemoryCallback(RdbCallback):
         
 
 def element_length(element):
-    if isinstance(element, int):
+    element_type = type(element)
+    if element_type is bytes:
+        return len(element)
+    if element_type is int:
         return 8
-    if isinstance(element, long):
+    if element_type in INTEGER_TYPES:
         return 16
     else:
         return len(element)
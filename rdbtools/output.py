@@ -0,0 +1,308 @@
+import io
+import os
+import threading
+import zlib
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    text_type = unicode
+    integer_types = (int, long)
+except NameError:
+    text_type = str
+    integer_types = (int, )
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+# os.writev refuses more buffers than this in a single call
+IOV_MAX = 1024
+
+class OutputSink(object):
+    '''
+    A buffered writer shared by all the output callbacks.
+
+    Callbacks write many small fragments per element. Instead of passing every fragment to
+    the underlying file, they are gathered in one reusable bytearray which is written out in
+    large chunks of roughly `buffer_size` bytes.
+
+    `out` can be sys.stdout, a file opened in text or binary mode, or any object with a `write` method.
+    Text streams are written to through their binary buffer when they have one.
+
+    Callbacks call `flush` at database and rdb boundaries, so output is never held
+    back for longer than one database.
+    '''
+    def __init__(self, out, buffer_size=DEFAULT_BUFFER_SIZE):
+        self._out = out
+        self._buffer_size = buffer_size
+        self._buf = bytearray()
+        self._encode_text = False
+        self._fd = None
+        self.fragments = 0
+        self.write_calls = 0
+
+        stream = getattr(out, 'buffer', None)
+        if stream is not None:
+            # Anything already written through the text layer must go out first
+            out.flush()
+        elif isinstance(out, io.TextIOBase):
+            stream = out
+            self._encode_text = True
+        else:
+            stream = out
+        self._stream = stream
+
+    @classmethod
+    def wrap(cls, out):
+        '''Returns `out` if it already is an OutputSink, otherwise a new OutputSink around it'''
+        if isinstance(out, OutputSink):
+            return out
+        return cls(out)
+
+    def write(self, data):
+        self.fragments += 1
+        buf = self._buf
+        try:
+            buf += data
+        except TypeError:
+            buf += data.encode('utf-8')
+        if len(buf) >= self._buffer_size:
+            self._drain()
+
+    def writev(self, fragments):
+        '''
+        Writes a list of fragments.
+
+        Small lists are appended to the buffer. A list that is larger than the whole buffer is
+        handed to the underlying stream in one call, using os.writev when the stream is a real file.
+        '''
+        self.fragments += len(fragments)
+        fragments = [f.encode('utf-8') if isinstance(f, text_type) else f for f in fragments]
+        size = sum(len(f) for f in fragments)
+        if size >= self._buffer_size:
+            self._drain()
+            self._write_fragments(fragments)
+            return
+        buf = self._buf
+        for f in fragments:
+            buf += f
+        if len(buf) >= self._buffer_size:
+            self._drain()
+
+    def flush(self):
+        '''Writes out everything buffered so far and flushes the underlying stream'''
+        self._drain()
+        flush = getattr(self._stream, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def close(self):
+        self.flush()
+
+    def _drain(self):
+        if not self._buf:
+            return
+        # The chunk is copied so that the bytearray can be reused right away,
+        # even if the stream holds on to what it was given
+        self._write_chunk(bytes(self._buf))
+        del self._buf[:]
+
+    def _write_chunk(self, chunk):
+        self.write_calls += 1
+        if self._encode_text:
+            chunk = chunk.decode('utf-8', 'replace')
+        self._stream.write(chunk)
+
+    def _write_fragments(self, fragments):
+        fd = self._fileno()
+        if fd is None:
+            self.write_calls += 1
+            if self._encode_text:
+                fragments = [f.decode('utf-8', 'replace') for f in fragments]
+            self._stream.writelines(fragments)
+            return
+        # Bypassing the file object, so whatever it buffered must be written first
+        self._stream.flush()
+        for start in range(0, len(fragments), IOV_MAX):
+            batch = fragments[start:start + IOV_MAX]
+            while batch:
+                self.write_calls += 1
+                written = os.writev(fd, batch)
+                # Partial writes are possible, e.g. on pipes
+                index = 0
+                while index < len(batch) and written >= len(batch[index]):
+                    written -= len(batch[index])
+                    index += 1
+                batch = batch[index:]
+                if batch and written:
+                    batch[0] = batch[0][written:]
+
+    def _fileno(self):
+        if self._fd is None:
+            self._fd = -1
+            if hasattr(os, 'writev') and not self._encode_text:
+                try:
+                    self._fd = self._stream.fileno()
+                except (AttributeError, IOError, ValueError, io.UnsupportedOperation):
+                    pass
+        if self._fd < 0:
+            return None
+        return self._fd
+
+
+def _gzip_compressor(level):
+    # wbits of 16 + MAX_WBITS makes zlib write a gzip header and trailer
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def _bz2_compressor(level):
+    import bz2
+    return bz2.BZ2Compressor(level)
+
+def _xz_compressor(level):
+    import lzma
+    return lzma.LZMACompressor(preset=level)
+
+def _zstd_compressor(level):
+    try:
+        # python 3.14 and later
+        from compression import zstd
+        return zstd.ZstdCompressor(level=level)
+    except ImportError:
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compressobj()
+
+# codec name : (compressor factory, default level, file extensions)
+CODECS = {
+    'gzip' : (_gzip_compressor, 6, ('.gz', '.gzip')),
+    'bz2' : (_bz2_compressor, 9, ('.bz2', )),
+    'xz' : (_xz_compressor, 6, ('.xz', '.lzma')),
+    'zstd' : (_zstd_compressor, 3, ('.zst', '.zstd')),
+}
+
+DEFAULT_COMPRESS_BUFFERS = 8
+
+def codec_for_filename(filename):
+    '''Returns the codec implied by the extension of `filename`, or None'''
+    lower = filename.lower()
+    for name, (factory, level, extensions) in CODECS.items():
+        if lower.endswith(extensions):
+            return name
+    return None
+
+def new_compressor(codec, level=None):
+    '''
+    A compressor object of `codec`, with `compress` and `flush` methods, at `level` or the default
+    level of the codec. Raises an exception if the codec is unknown or not supported by this python.
+    '''
+    if not codec in CODECS:
+        raise Exception('new_compressor', 'Unknown compression %s. Expected one of %s' % (codec, ", ".join(sorted(CODECS))))
+    factory, default_level, extensions = CODECS[codec]
+    if level is None:
+        level = default_level
+    try:
+        return factory(level)
+    except ImportError:
+        raise Exception('new_compressor', 'Compression %s is not supported by this python' % codec)
+
+def open_output(filename, compression=None, level=None, buffers=DEFAULT_COMPRESS_BUFFERS, mode="ab"):
+    '''
+    Opens `filename` for writing.
+
+    `compression` is one of gzip, bz2, xz or zstd, 'auto' to pick the codec from the file
+    extension, or None for plain output. Compressed files are returned as a CompressedFile.
+    The codec is checked before the file is opened, so a file is not created if it is not supported.
+    '''
+    if compression == 'auto':
+        compression = codec_for_filename(filename)
+    if not compression:
+        return open(filename, mode)
+    compressor = new_compressor(compression, level)
+    raw = open(filename, mode)
+    try:
+        return CompressedFile(raw, compression, level, buffers, close_fileobj=True, compressor=compressor)
+    except Exception:
+        raw.close()
+        raise
+
+class CompressedFile(object):
+    '''
+    A write-only file that compresses on a dedicated writer thread.
+
+    `write` hands the data to the writer thread through a queue that holds at most
+    `buffers` chunks, so compression overlaps with parsing while memory stays bounded.
+    Data should be written in large chunks, which is what OutputSink does.
+
+    `flush` waits until everything written so far is compressed and handed to `fileobj`.
+    It does not end the compressed stream, that only happens in `close`.
+    `compressor` is a compressor already made by new_compressor, one is made otherwise.
+    '''
+    def __init__(self, fileobj, codec='gzip', level=None, buffers=DEFAULT_COMPRESS_BUFFERS, close_fileobj=False,
+                 compressor=None):
+        if compressor is None:
+            compressor = new_compressor(codec, level)
+        self._compressor = compressor
+        self._fileobj = fileobj
+        self._close_fileobj = close_fileobj
+        self._queue = queue.Queue(maxsize=max(1, buffers))
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='rdbtools-compress')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        compress = self._compressor.compress
+        write = self._fileobj.write
+        while True:
+            chunk = self._queue.get()
+            try:
+                if chunk is None:
+                    return
+                if self._error is None:
+                    data = compress(chunk)
+                    if data:
+                        write(data)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError('write to closed CompressedFile')
+        self._check_error()
+        if data:
+            self._queue.put(bytes(data))
+
+    def writelines(self, fragments):
+        self.write(b''.join(fragments))
+
+    def flush(self):
+        self._queue.join()
+        self._check_error()
+        self._fileobj.flush()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self._check_error()
+            self._fileobj.write(self._compressor.flush())
+            self._fileobj.flush()
+        finally:
+            if self._close_fileobj:
+                self._fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
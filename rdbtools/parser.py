@@ -1,14 +1,24 @@
 # This Python file uses the following encoding: utf-8
 import struct
-import io
+import dis
 import sys
 import datetime
 import re
 
 try :
-    from StringIO import StringIO
+    # reads from the string it is given without copying it
+    from cStringIO import StringIO as BytesReader
 except ImportError:
-    from io import StringIO
+    # shares the bytes it is given until it is written to
+    from io import BytesIO as BytesReader
+
+try :
+    xrange
+except NameError:
+    xrange = range
+
+# indexing bytes gives ints on python 3, and strings of length 1 on python 2
+BYTES_ARE_INTS = isinstance(b'0'[0], int)
 
 REDIS_RDB_6BITLEN = 0
 REDIS_RDB_14BITLEN = 1
@@ -41,11 +51,40 @@ DATA_TYPE_MAPPING = {
     0 : "string", 1 : "list", 2 : "set", 3 : "sortedset", 4 : "hash",
     9 : "hash", 10 : "list", 11 : "set", 12 : "sortedset", 13 : "hash"}
 
+# the encodings reported in the `info` dictionary of each type
+ENCODING_MAPPING = {
+    0 : "string", 1 : "linkedlist", 2 : "hashtable", 3 : "skiplist", 4 : "hashtable",
+    9 : "zipmap", 10 : "ziplist", 11 : "intset", 12 : "ziplist", 13 : "ziplist"}
+
+# callback methods, and the methods that receive an `info` dictionary
+CALLBACK_EVENTS = ('start_rdb', 'start_database', 'set', 'set_begin', 'set_chunk', 'set_end',
+    'start_hash', 'hset', 'end_hash', 'start_set', 'sadd', 'end_set', 'start_list', 'rpush', 'end_list',
+    'start_sorted_set', 'zadd', 'end_sorted_set', 'end_database', 'end_rdb')
+INFO_EVENTS = ('set', 'set_begin', 'start_hash', 'start_set', 'start_list', 'start_sorted_set')
+
+# strings longer than this are given in chunks of this size to callbacks that implement set_begin
+DEFAULT_STRING_CHUNK_SIZE = 1024 * 1024
+# strings that could be integers are always given whole
+MIN_STRING_CHUNK_SIZE = 32
+
+# callback methods that receive the keys of each logical type
+TYPE_EVENTS = {
+    "string" : ('set', 'set_begin', 'set_chunk', 'set_end'),
+    "list" : ('start_list', 'rpush', 'end_list'),
+    "set" : ('start_set', 'sadd', 'end_set'),
+    "sortedset" : ('start_sorted_set', 'zadd', 'end_sorted_set'),
+    "hash" : ('start_hash', 'hset', 'end_hash')}
+
 class RdbCallback:
     """
     A Callback to handle events as the Redis dump file is parsed.
     This callback provides a serial and fast access to the dump file.
 
+    Keys, values, fields and members that the dump stores as integers are passed as python ints.
+    That covers the REDIS_RDB_ENC_INT8/16/32 string encodings, the integer entries of ziplists
+    and the members of intsets. Everything else is passed as a string, so callbacks can tell
+    the two apart with a type check instead of parsing strings again.
+
     """
     def start_rdb(self):
         """
@@ -78,6 +117,37 @@ class RdbCallback:
         """
         pass
 
+    def set_begin(self, key, length, expiry, info):
+        """
+        Callback to handle the start of a string value too long to be given at once
+
+        Callbacks that implement it receive strings longer than the string chunk size of
+        the parser as a call to `set_begin`, calls to `set_chunk` and a call to `set_end`,
+        instead of a call to `set`. Shorter strings are still given to `set`.
+
+        `length` is the length of the value in bytes
+        `key`, `expiry` and `info` are as in `set`
+
+        """
+        pass
+
+    def set_chunk(self, key, chunk):
+        """
+        Callback to handle the next part of a string value started with `set_begin`
+
+        `chunk` is a string of at most the string chunk size of the parser.
+        If this method does nothing, the value is skipped instead of read.
+
+        """
+        pass
+
+    def set_end(self, key):
+        """
+        Called when there are no more parts of a string value started with `set_begin`
+
+        """
+        pass
+
     def start_hash(self, key, length, expiry, info):
         """Callback to handle the start of a hash
 
@@ -256,15 +326,26 @@ class RdbParser :
 
         If filter is None, results will not be filtered
         If dbs, keys or types is None or Empty, no filtering will be done on that axis
+
+    string_chunk_size is the size of the chunks strings are given in to set_chunk, see RdbCallback.set_begin
     """
-    def __init__(self, callback, filters = None) :
+    def __init__(self, callback, filters = None, string_chunk_size = DEFAULT_STRING_CHUNK_SIZE) :
         """
             `callback` is the object that will receive parse events
         """
         self._callback = callback
+        self._string_chunk_size = max(string_chunk_size, MIN_STRING_CHUNK_SIZE)
         self._key = None
         self._expiry = None
+        # state of the push interface, see feed
+        self._feed_buffer = bytearray()
+        self._feed_needed = 0
+        # a string value passed on as it is fed, see start_string_value
+        self._feed_string = None
+        self._feed_started = False
+        self._feed_done = False
         self.init_filter(filters)
+        self.init_dispatch()
     
     # +-------+-------------+-----------+-----------------+-----+-----------+
     # | REDIS | RDB-VERSION | SELECT-DB | KEY-VALUE-PAIRS | EOF | CHECK-SUM |
@@ -376,44 +457,295 @@ class RdbParser :
         callback object during the parsing operation.
         """
         with open(filename, "rb") as f:
-            self.verify_magic_string(f.read(5))
-            self.verify_version(f.read(4))
-            self._callback.start_rdb()
+            self.parse_fd(f)
 
-            is_first_database = True
+    def parse_fd(self, f):
+        """
+        Same as parse, reading the dump from `f`, a binary file object such as a socket stream.
+        Only the bytes up to the EOF opcode are read, the checksum is left in `f`.
+        """
+        self.verify_magic_string(f.read(5))
+        self.verify_version(f.read(4))
+        self.start_parse()
+        read_entry = self.read_entry
+        while read_entry(f) :
+            pass
+
+    def start_parse(self):
+        self.init_dispatch()
+        self._db_number = 0
+        self._is_first_database = True
+        if self._on['start_rdb'] is not None:
+            self._on['start_rdb']()
+
+    def read_entry(self, f):
+        """
+        Reads the next entry of the dump, a key and its value or an opcode, and calls the callback for it.
+        Returns False once the EOF opcode is read.
+        """
+        on = self._on
+        self._expiry = None
+        data_type = read_unsigned_char(f)
+
+        if data_type == REDIS_RDB_OPCODE_EXPIRETIME_MS :
+            self._expiry = to_datetime(read_unsigned_long(f) * 1000)
+            data_type = read_unsigned_char(f)
+        elif data_type == REDIS_RDB_OPCODE_EXPIRETIME :
+            self._expiry = to_datetime(read_unsigned_int(f) * 1000000)
+            data_type = read_unsigned_char(f)
+
+        if data_type == REDIS_RDB_OPCODE_SELECTDB :
+            if not self._is_first_database and on['end_database'] is not None :
+                on['end_database'](self._db_number)
+            self._is_first_database = False
+            self._db_number = self.read_length(f)
+            if on['start_database'] is not None :
+                on['start_database'](self._db_number)
+            return True
+
+        if data_type == REDIS_RDB_OPCODE_EOF :
+            if on['end_database'] is not None :
+                on['end_database'](self._db_number)
+            if on['end_rdb'] is not None :
+                on['end_rdb']()
+            return False
+
+        db_number = self._db_number
+        if self.matches_filter(db_number) :
+            self._key = self.read_string(f)
+            if self.matches_filter(db_number, self._key, data_type):
+                self.read_object(f, data_type)
+            else:
+                self.skip_object(f, data_type)
+        else :
+            self.skip_key_and_object(f, data_type)
+        return True
+
+    def skip_entry(self, f):
+        """Reads past the next entry of the dump without calling the callback"""
+        data_type = read_unsigned_char(f)
+        if data_type == REDIS_RDB_OPCODE_EXPIRETIME_MS :
+            skip(f, 8)
+            data_type = read_unsigned_char(f)
+        elif data_type == REDIS_RDB_OPCODE_EXPIRETIME :
+            skip(f, 4)
+            data_type = read_unsigned_char(f)
+        if data_type == REDIS_RDB_OPCODE_SELECTDB :
+            self.read_length(f)
+        elif data_type != REDIS_RDB_OPCODE_EOF :
+            self.skip_key_and_object(f, data_type)
+
+    def feed(self, data):
+        """
+        Push interface : parses `data`, the next chunk of a dump, and calls the methods of the
+        callback for every entry the chunk completes. Chunks can be of any size and split entries
+        anywhere, the start of an incomplete entry is kept until the rest of it is fed.
+        Call close once the whole dump has been fed.
+
+            parser = RdbParser(callback)
+            for chunk in chunks :
+                parser.feed(chunk)
+            parser.close()
+
+        Memory use is bounded by the largest entry of the dump, plus the last chunk fed.
+        Long uncompressed strings are the exception : when the callback has set_begin, or when
+        the key is filtered out, their value is passed on (or dropped) in chunks of
+        string_chunk_size as it is fed, and is never held whole.
+        """
+        if self._feed_done :
+            # only the checksum follows the EOF opcode
+            return
+        buffer = self._feed_buffer
+        buffer += data
+        if len(buffer) < self._feed_needed :
+            return
+        position = 0
+        if not self._feed_started :
+            if len(buffer) < 9 :
+                self._feed_needed = 9
+                return
+            self.verify_magic_string(bytes(buffer[:5]))
+            self.verify_version(bytes(buffer[5:9]))
+            self.start_parse()
+            self._feed_started = True
+            position = 9
+        while True :
+            if self._feed_string is not None :
+                position = self.feed_string_value(buffer, position)
+                if self._feed_string is not None :
+                    break
+            reader = BufferReader(buffer, position)
+            try :
+                self.skip_entry(reader)
+            except IncompleteEntry as e :
+                value_position = self.start_string_value(buffer, position)
+                if value_position is not None :
+                    position = value_position
+                    continue
+                # entries are scanned again from their start when more data is fed, so the buffer
+                # has to double before the next attempt, which keeps the rescans linear overall
+                self._feed_needed = max(e.needed, 2 * len(buffer) - position) - position
+                break
+            # the entry is complete, it is read from the buffer without copying it first
+            more = self.read_entry(BufferReader(buffer, position))
+            position = reader.position
+            if not more :
+                self._feed_done = True
+                break
+        del buffer[:position]
+
+    def start_string_value(self, buffer, position):
+        """
+        Starts passing on the value of the incomplete entry at `position` of the feed buffer as it
+        arrives, when it is a long uncompressed string that is streamed to set_chunk or skipped.
+        Returns the position of the value in the buffer, or None when the entry has to be buffered whole.
+        """
+        reader = BufferReader(buffer, position)
+        try :
+            expiry = None
+            data_type = read_unsigned_char(reader)
+            if data_type == REDIS_RDB_OPCODE_EXPIRETIME_MS :
+                expiry = to_datetime(read_unsigned_long(reader) * 1000)
+                data_type = read_unsigned_char(reader)
+            elif data_type == REDIS_RDB_OPCODE_EXPIRETIME :
+                expiry = to_datetime(read_unsigned_int(reader) * 1000000)
+                data_type = read_unsigned_char(reader)
+            if data_type != REDIS_RDB_TYPE_STRING :
+                return None
+            key = self.read_string(reader)
+            length, is_encoded = self.read_length_with_encoding(reader)
+        except IncompleteEntry :
+            return None
+        if is_encoded or length <= self._string_chunk_size :
+            return None
+        db_number = self._db_number
+        read = (self.matches_filter(db_number) and self.matches_filter(db_number, key, data_type)
+                and REDIS_RDB_TYPE_STRING in self._readers)
+        if read :
+            if self._on['set_begin'] is None :
+                # set takes the value whole
+                return None
+            self._key = key
+            self._expiry = expiry
+            self._on['set_begin'](key, length, expiry, info={'encoding':'string'} if self._wants_info['set_begin'] else None)
+        # [bytes of the value still to come, whether they go to the callback]
+        self._feed_string = [length, read]
+        return reader.position
+
+    def feed_string_value(self, buffer, position):
+        """
+        Passes on the part of the string started by start_string_value that is in the feed buffer
+        from `position`, in the same chunks as read_string_chunks. Returns the position after it.
+        """
+        remaining, read = self._feed_string
+        chunk_size = self._string_chunk_size
+        set_chunk = self._on['set_chunk'] if read else None
+        available = len(buffer) - position
+        while remaining > 0 :
+            n = min(remaining, chunk_size)
+            if available < n :
+                break
+            if set_chunk is not None :
+                set_chunk(self._key, memoryview(buffer)[position:position + n].tobytes())
+            position += n
+            available -= n
+            remaining -= n
+        if remaining > 0 :
+            self._feed_string[0] = remaining
+            # what is left of the buffer is moved to its start by feed
+            self._feed_needed = min(remaining, chunk_size)
+            return position
+        self._feed_string = None
+        if read and self._on['set_end'] is not None :
+            self._on['set_end'](self._key)
+        return position
+
+    def close(self):
+        """Ends a dump given to feed, and raises an exception if it was truncated"""
+        self._feed_needed = 0
+        self.feed(b'')
+        if not self._feed_done :
+            raise Exception('close', 'Truncated dump, %d bytes left in an incomplete entry' % len(self._feed_buffer))
+        self._feed_buffer = bytearray()
+
+    @classmethod
+    def iter_keys(cls, source, filters = None):
+        """
+        Pull interface : yields a KeyEntry for every key of the dump `source`, a filename or
+        a binary file object, that matches `filters`. Values are only decoded when the value
+        or iter_elements method of the entry is called, and skipped otherwise.
+
+            for entry in RdbParser.iter_keys('/var/redis/6379/dump.rdb', {"types" : ["hash"]}) :
+                if entry.raw_size > 1024 * 1024 :
+                    print(entry.key, len(entry.value()))
+
+        When `source` is seekable, values are read again from it when decoded, so entries can
+        only be decoded until the iteration ends. Otherwise every entry keeps its raw value.
+        """
+        parser = cls(ValueCollector(), filters)
+        f = open(source, "rb") if isinstance(source, (str, type(u''))) else source
+        try :
+            parser.verify_magic_string(f.read(5))
+            parser.verify_version(f.read(4))
+            parser.init_dispatch()
+            seekable = is_seekable(f)
             db_number = 0
             while True :
-                self._expiry = None
+                expiry = None
                 data_type = read_unsigned_char(f)
-
                 if data_type == REDIS_RDB_OPCODE_EXPIRETIME_MS :
-                    self._expiry = to_datetime(read_unsigned_long(f) * 1000)
+                    expiry = to_datetime(read_unsigned_long(f) * 1000)
                     data_type = read_unsigned_char(f)
                 elif data_type == REDIS_RDB_OPCODE_EXPIRETIME :
-                    self._expiry = to_datetime(read_unsigned_int(f) * 1000000)
+                    expiry = to_datetime(read_unsigned_int(f) * 1000000)
                     data_type = read_unsigned_char(f)
 
                 if data_type == REDIS_RDB_OPCODE_SELECTDB :
-                    if not is_first_database :
-                        self._callback.end_database(db_number)
-                    is_first_database = False
-                    db_number = self.read_length(f)
-                    self._callback.start_database(db_number)
+                    db_number = parser.read_length(f)
                     continue
-
                 if data_type == REDIS_RDB_OPCODE_EOF :
-                    self._callback.end_database(db_number)
-                    self._callback.end_rdb()
                     break
-
-                if self.matches_filter(db_number) :
-                    self._key = self.read_string(f)
-                    if self.matches_filter(db_number, self._key, data_type):
-                        self.read_object(f, data_type)
-                    else:
-                        self.skip_object(f, data_type)
+                if not parser.matches_filter(db_number) :
+                    parser.skip_key_and_object(f, data_type)
+                    continue
+                key = parser.read_string(f)
+                parser._key = key
+                if not parser.matches_filter(db_number, key, data_type) :
+                    parser.skip_object(f, data_type)
+                    continue
+                if seekable :
+                    offset = f.tell()
+                    parser.skip_object(f, data_type)
+                    raw = None
+                    raw_size = f.tell() - offset
                 else :
-                    self.skip_key_and_object(f, data_type)
+                    recorder = RecordingReader(f)
+                    parser.skip_object(recorder, data_type)
+                    offset = None
+                    raw = recorder.getvalue()
+                    raw_size = len(raw)
+                yield KeyEntry(parser, db_number, key, data_type, expiry, raw_size, f, offset, raw)
+        finally :
+            if f is not source :
+                f.close()
+
+    def parse_dump(self, key, dump, expiry = None):
+        """
+        Parses the payload returned by the DUMP command for `key`, and calls the methods
+        of the callback object for that key only. `dump` is a byte string.
+
+        start_rdb, start_database and the matching end events are left to the caller,
+        so that any number of keys can be parsed in between.
+        """
+        # The payload is the object, the rdb version as 2 bytes and a crc64 of 8 bytes.
+        # The version is not checked : servers from 3.2 on write versions this parser does not
+        # read files of, but only the encoding of the object matters, and unknown ones raise
+        if len(dump) < 11:
+            raise Exception('parse_dump', 'Invalid DUMP payload for key %s' % key)
+        f = BytesReader(dump)
+        self._key = key
+        self._expiry = expiry
+        self.read_object(f, read_unsigned_char(f))
 
     def read_length_with_encoding(self, f) :
         length = 0
@@ -466,8 +798,9 @@ class RdbParser :
     # 当进行载入时，读入器先检测字符串保存的方式，再根据不同的保存方式，用不同的方法取出内容，并将内容保存到新建的字符串对象当中
     def read_string(self, f) :
         tup = self.read_length_with_encoding(f)
-        length = tup[0]
-        is_encoded = tup[1]
+        return self.read_string_value(f, tup[0], tup[1])
+
+    def read_string_value(self, f, length, is_encoded) :
         val = None
         if is_encoded : #REDIS_RDB_ENCVAL 3 时, is_encoded为true
             if length == REDIS_RDB_ENC_INT8 : #REDIS_RDB_ENC_INT8 0  8 bit signed integer
@@ -490,68 +823,154 @@ class RdbParser :
     #
     # REDIS_HASH_ZIPMAP，REDIS_LIST_ZIPLIST，REDIS_SET_INTSET和REDIS_ZSET_ZIPLIST这四种数据类型都是只在rdb文件中才有的类型，其他的数据类型其实就是val对象中type字段存储的值
     def read_object(self, f, enc_type) :
-        if enc_type == REDIS_RDB_TYPE_STRING : # REDIS_RDB_TYPE_STRING = 0 字符串
+        reader = self._readers.get(enc_type)
+        if reader is None :
+            if not enc_type in DATA_TYPE_MAPPING :
+                raise Exception('read_object', 'Invalid object type %d for key %s' % (enc_type, self._key))
+            # None of the callback methods for this type do anything
+            self.skip_object(f, enc_type)
+            return
+        reader(f)
+
+    def init_dispatch(self):
+        """
+        Inspects the callback and builds the table of methods to call for each event.
+
+        Methods that the callback does not override, or that do nothing, are left out
+        and never called. The `info` dictionary is only built for methods that read it.
+        Types for which all methods are left out are skipped instead of decoded.
+        """
+        self._on = {}
+        self._wants_info = {}
+        for event in CALLBACK_EVENTS :
+            method = getattr(self._callback, event, None)
+            if method is None or is_noop_method(method) :
+                method = None
+            self._on[event] = method
+            if event in INFO_EVENTS :
+                self._wants_info[event] = method is not None and method_reads_argument(method, 'info')
+
+        readers = {
+            REDIS_RDB_TYPE_STRING : self.read_string_object,
+            REDIS_RDB_TYPE_LIST : self.read_list,
+            REDIS_RDB_TYPE_SET : self.read_set,
+            REDIS_RDB_TYPE_ZSET : self.read_zset,
+            REDIS_RDB_TYPE_HASH : self.read_hash,
+            REDIS_RDB_TYPE_HASH_ZIPMAP : self.read_zipmap,
+            REDIS_RDB_TYPE_LIST_ZIPLIST : self.read_ziplist,
+            REDIS_RDB_TYPE_SET_INTSET : self.read_intset,
+            REDIS_RDB_TYPE_ZSET_ZIPLIST : self.read_zset_from_ziplist,
+            REDIS_RDB_TYPE_HASH_ZIPLIST : self.read_hash_from_ziplist,
+        }
+        self._readers = {}
+        for enc_type, reader in readers.items() :
+            events = TYPE_EVENTS[DATA_TYPE_MAPPING[enc_type]]
+            if any(self._on[event] is not None for event in events) :
+                self._readers[enc_type] = reader
+
+    def read_string_object(self, f) : # REDIS_RDB_TYPE_STRING = 0 字符串
+        if self._on['set_begin'] is not None :
+            length, is_encoded = self.read_length_with_encoding(f)
+            if not is_encoded and length > self._string_chunk_size :
+                # read straight from the file, one chunk at a time
+                self.read_string_chunks(f, length)
+                return
+            val = self.read_string_value(f, length, is_encoded)
+            if isinstance(val, bytes) and len(val) > self._string_chunk_size :
+                # a compressed string, only the decompressed value is held in memory
+                self.read_string_chunks(BytesReader(val), len(val))
+                return
+        else :
             val = self.read_string(f)
-            self._callback.set(self._key, val, self._expiry, info={'encoding':'string'})
-        elif enc_type == REDIS_RDB_TYPE_LIST : # REDIS_RDB_TYPE_LIST = 1
-            # A redis list is just a sequence of strings
-            # We successively read strings from the stream and create a list from it
-            # The lists are in order i.e. the first string is the head,
-            # and the last string is the tail of the list
-            length = self.read_length(f)
-            self._callback.start_list(self._key, length, self._expiry, info={'encoding':'linkedlist' })
-            for count in xrange(0, length) :
-                val = self.read_string(f)
-                self._callback.rpush(self._key, val)
-            self._callback.end_list(self._key)
-        elif enc_type == REDIS_RDB_TYPE_SET : # REDIS_RDB_TYPE_SET = 2 这里的set是无序的(non-deterministic)
-            # A redis list is just a sequence of strings
-            # We successively read strings from the stream and create a set from it
-            # Note that the order of strings is non-deterministic
-            length = self.read_length(f)
-            self._callback.start_set(self._key, length, self._expiry, info={'encoding':'hashtable'})
-            for count in xrange(0, length) :
-                val = self.read_string(f)
-                self._callback.sadd(self._key, val)
-            self._callback.end_set(self._key)
-        elif enc_type == REDIS_RDB_TYPE_ZSET : # REDIS_RDB_TYPE_ZSET = 3
-            length = self.read_length(f)
-            self._callback.start_sorted_set(self._key, length, self._expiry, info={'encoding':'skiplist'})
-            for count in xrange(0, length) :
-                val = self.read_string(f)
-                dbl_length = read_unsigned_char(f)
-                score = f.read(dbl_length)
-                if isinstance(score, str):
-                    score = float(score)
-                self._callback.zadd(self._key, score, val)
-            self._callback.end_sorted_set(self._key)
-
-        # +-----------+------+---------+-------+--------+----------+
-        # | entry-num | key1 | value1  |  ...  |  keyn  |  valuen  |
-        # +-----------+------+---------+-------+--------+----------+ 
-        # entry-num : hash中[键值对]的数量
-        # key : string类型的key
-        # value : string类型的value
-        elif enc_type == REDIS_RDB_TYPE_HASH : # REDIS_RDB_TYPE_HASH = 4
-            length = self.read_length(f)
-            self._callback.start_hash(self._key, length, self._expiry, info={'encoding':'hashtable'})
-            for count in xrange(0, length) :
-                field = self.read_string(f) # read key
-                value = self.read_string(f) # read value
-                self._callback.hset(self._key, field, value)
-            self._callback.end_hash(self._key)
-        elif enc_type == REDIS_RDB_TYPE_HASH_ZIPMAP : # REDIS_RDB_TYPE_HASH_ZIPMAP = 9
-            self.read_zipmap(f)
-        elif enc_type == REDIS_RDB_TYPE_LIST_ZIPLIST : # REDIS_RDB_TYPE_LIST_ZIPLIST = 10
-            self.read_ziplist(f)
-        elif enc_type == REDIS_RDB_TYPE_SET_INTSET : # REDIS_RDB_TYPE_SET_INTSET = 11
-            self.read_intset(f)
-        elif enc_type == REDIS_RDB_TYPE_ZSET_ZIPLIST : # REDIS_RDB_TYPE_ZSET_ZIPLIST = 12
-            self.read_zset_from_ziplist(f)
-        elif enc_type == REDIS_RDB_TYPE_HASH_ZIPLIST : # REDIS_RDB_TYPE_HASH_ZIPLIST = 13
-            self.read_hash_from_ziplist(f)
+        if self._on['set'] is not None :
+            self._on['set'](self._key, val, self._expiry, info={'encoding':'string'} if self._wants_info['set'] else None)
+
+    def read_string_chunks(self, f, length) :
+        on = self._on
+        on['set_begin'](self._key, length, self._expiry, info={'encoding':'string'} if self._wants_info['set_begin'] else None)
+        set_chunk = on['set_chunk']
+        if set_chunk is None :
+            skip(f, length)
         else :
-            raise Exception('read_object', 'Invalid object type %d for key %s' % (enc_type, self._key))
+            chunk_size = self._string_chunk_size
+            remaining = length
+            while remaining > 0 :
+                chunk = f.read(min(remaining, chunk_size))
+                if not chunk :
+                    raise Exception('read_string_chunks', 'Unexpected end of file in the value of key %s' % self._key)
+                set_chunk(self._key, chunk)
+                remaining -= len(chunk)
+        if on['set_end'] is not None :
+            on['set_end'](self._key)
+
+    def read_list(self, f) : # REDIS_RDB_TYPE_LIST = 1
+        # A redis list is just a sequence of strings
+        # We successively read strings from the stream and create a list from it
+        # The lists are in order i.e. the first string is the head,
+        # and the last string is the tail of the list
+        on = self._on
+        length = self.read_length(f)
+        if on['start_list'] is not None :
+            on['start_list'](self._key, length, self._expiry, info={'encoding':'linkedlist' } if self._wants_info['start_list'] else None)
+        rpush = on['rpush']
+        for count in xrange(0, length) :
+            val = self.read_string(f)
+            if rpush is not None :
+                rpush(self._key, val)
+        if on['end_list'] is not None :
+            on['end_list'](self._key)
+
+    def read_set(self, f) : # REDIS_RDB_TYPE_SET = 2 这里的set是无序的(non-deterministic)
+        # A redis list is just a sequence of strings
+        # We successively read strings from the stream and create a set from it
+        # Note that the order of strings is non-deterministic
+        on = self._on
+        length = self.read_length(f)
+        if on['start_set'] is not None :
+            on['start_set'](self._key, length, self._expiry, info={'encoding':'hashtable'} if self._wants_info['start_set'] else None)
+        sadd = on['sadd']
+        for count in xrange(0, length) :
+            val = self.read_string(f)
+            if sadd is not None :
+                sadd(self._key, val)
+        if on['end_set'] is not None :
+            on['end_set'](self._key)
+
+    def read_zset(self, f) : # REDIS_RDB_TYPE_ZSET = 3
+        on = self._on
+        length = self.read_length(f)
+        if on['start_sorted_set'] is not None :
+            on['start_sorted_set'](self._key, length, self._expiry, info={'encoding':'skiplist'} if self._wants_info['start_sorted_set'] else None)
+        zadd = on['zadd']
+        for count in xrange(0, length) :
+            val = self.read_string(f)
+            dbl_length = read_unsigned_char(f)
+            score = f.read(dbl_length)
+            score = float(score)
+            if zadd is not None :
+                zadd(self._key, score, val)
+        if on['end_sorted_set'] is not None :
+            on['end_sorted_set'](self._key)
+
+    # +-----------+------+---------+-------+--------+----------+
+    # | entry-num | key1 | value1  |  ...  |  keyn  |  valuen  |
+    # +-----------+------+---------+-------+--------+----------+ 
+    # entry-num : hash中[键值对]的数量
+    # key : string类型的key
+    # value : string类型的value
+    def read_hash(self, f) : # REDIS_RDB_TYPE_HASH = 4
+        on = self._on
+        length = self.read_length(f)
+        if on['start_hash'] is not None :
+            on['start_hash'](self._key, length, self._expiry, info={'encoding':'hashtable'} if self._wants_info['start_hash'] else None)
+        hset = on['hset']
+        for count in xrange(0, length) :
+            field = self.read_string(f) # read key
+            value = self.read_string(f) # read value
+            if hset is not None :
+                hset(self._key, field, value)
+        if on['end_hash'] is not None :
+            on['end_hash'](self._key)
 
     def skip_key_and_object(self, f, data_type):
         self.skip_string(f)
@@ -627,10 +1046,15 @@ class RdbParser :
     # +-----+--------+
     def read_intset(self, f) :
         raw_string = self.read_string(f)
-        buff = StringIO(raw_string)
+        buff = BytesReader(raw_string)
         encoding = read_unsigned_int(buff)
         num_entries = read_unsigned_int(buff)
-        self._callback.start_set(self._key, num_entries, self._expiry, info={'encoding':'intset', 'sizeof_value':len(raw_string)})
+        on = self._on
+        if on['start_set'] is not None :
+            on['start_set'](self._key, num_entries, self._expiry, info={'encoding':'intset', 'sizeof_value':len(raw_string)} if self._wants_info['start_set'] else None)
+        sadd = on['sadd']
+        if sadd is None :
+            num_entries = 0
         for x in xrange(0, num_entries) :
             if encoding == 8 :
                 entry = read_unsigned_long(buff)
@@ -640,8 +1064,9 @@ class RdbParser :
                 entry = read_unsigned_short(buff)
             else :
                 raise Exception('read_intset', 'Invalid encoding %d for key %s' % (encoding, self._key))
-            self._callback.sadd(self._key, entry)
-        self._callback.end_set(self._key)
+            sadd(self._key, entry)
+        if on['end_set'] is not None :
+            on['end_set'](self._key)
     
     # area        |<---- ziplist header ---->|<----------- entries ------------->|<-end->|
     # 
@@ -662,18 +1087,23 @@ class RdbParser :
     # zlend     uint8_t     255 的二进制值 1111 1111 （UINT8_MAX） ，用于标记 ziplist 的末端
     def read_ziplist(self, f) :
         raw_string = self.read_string(f)
-        buff = StringIO(raw_string)
+        buff = BytesReader(raw_string)
         zlbytes = read_unsigned_int(buff)
         tail_offset = read_unsigned_int(buff)
         num_entries = read_unsigned_short(buff)
-        self._callback.start_list(self._key, num_entries, self._expiry, info={'encoding':'ziplist', 'sizeof_value':len(raw_string)})
-        for x in xrange(0, num_entries) :
-            val = self.read_ziplist_entry(buff)
-            self._callback.rpush(self._key, val)
-        zlist_end = read_unsigned_char(buff)
-        if zlist_end != 255 :
-            raise Exception('read_ziplist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
-        self._callback.end_list(self._key)
+        on = self._on
+        if on['start_list'] is not None :
+            on['start_list'](self._key, num_entries, self._expiry, info={'encoding':'ziplist', 'sizeof_value':len(raw_string)} if self._wants_info['start_list'] else None)
+        rpush = on['rpush']
+        if rpush is not None :
+            for x in xrange(0, num_entries) :
+                val = self.read_ziplist_entry(buff)
+                rpush(self._key, val)
+            zlist_end = read_unsigned_char(buff)
+            if zlist_end != 255 :
+                raise Exception('read_ziplist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
+        if on['end_list'] is not None :
+            on['end_list'](self._key)
 
     #           |<--  element 1 -->|<--  element 2 -->|<--   .......   -->|
     # 
@@ -690,45 +1120,55 @@ class RdbParser :
     # 多个元素之间按 score 值从小到大排序， 如果两个元素的 score 相同， 那么按字典序对 member 进行对比， 决定那个元素排在前面， 那个元素排在后面
     def read_zset_from_ziplist(self, f) :
         raw_string = self.read_string(f)
-        buff = StringIO(raw_string)
+        buff = BytesReader(raw_string)
         zlbytes = read_unsigned_int(buff)
         tail_offset = read_unsigned_int(buff)
         num_entries = read_unsigned_short(buff)
         if (num_entries % 2) :
             raise Exception('read_zset_from_ziplist', "Expected even number of elements, but found %d for key %s" % (num_entries, self._key))
-        num_entries = num_entries /2
-        self._callback.start_sorted_set(self._key, num_entries, self._expiry, info={'encoding':'ziplist', 'sizeof_value':len(raw_string)})
-        for x in xrange(0, num_entries) :
-            member = self.read_ziplist_entry(buff)
-            score = self.read_ziplist_entry(buff)
-            if isinstance(score, str) :
-                score = float(score)
-            self._callback.zadd(self._key, score, member)
-        zlist_end = read_unsigned_char(buff)
-        if zlist_end != 255 :
-            raise Exception('read_zset_from_ziplist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
-        self._callback.end_sorted_set(self._key)
+        num_entries = num_entries // 2
+        on = self._on
+        if on['start_sorted_set'] is not None :
+            on['start_sorted_set'](self._key, num_entries, self._expiry, info={'encoding':'ziplist', 'sizeof_value':len(raw_string)} if self._wants_info['start_sorted_set'] else None)
+        zadd = on['zadd']
+        if zadd is not None :
+            for x in xrange(0, num_entries) :
+                member = self.read_ziplist_entry(buff)
+                score = self.read_ziplist_entry(buff)
+                if isinstance(score, bytes) :
+                    score = float(score)
+                zadd(self._key, score, member)
+            zlist_end = read_unsigned_char(buff)
+            if zlist_end != 255 :
+                raise Exception('read_zset_from_ziplist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
+        if on['end_sorted_set'] is not None :
+            on['end_sorted_set'](self._key)
     
     # hashmap的键值对是作为连续的条目存储在ziplist里
     # 注意：这是在rdb版本4引入，它废弃了在先前版本里使用的zipmap
     def read_hash_from_ziplist(self, f) :
         raw_string = self.read_string(f)
-        buff = StringIO(raw_string)
+        buff = BytesReader(raw_string)
         zlbytes = read_unsigned_int(buff)
         tail_offset = read_unsigned_int(buff)
         num_entries = read_unsigned_short(buff)
         if (num_entries % 2) :
             raise Exception('read_hash_from_ziplist', "Expected even number of elements, but found %d for key %s" % (num_entries, self._key))
-        num_entries = num_entries / 2
-        self._callback.start_hash(self._key, num_entries, self._expiry, info={'encoding':'ziplist', 'sizeof_value':len(raw_string)})
-        for x in xrange(0, num_entries) :
-            field = self.read_ziplist_entry(buff)
-            value = self.read_ziplist_entry(buff)
-            self._callback.hset(self._key, field, value)
-        zlist_end = read_unsigned_char(buff)
-        if zlist_end != 255 :
-            raise Exception('read_hash_from_ziplist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
-        self._callback.end_hash(self._key)
+        num_entries = num_entries // 2
+        on = self._on
+        if on['start_hash'] is not None :
+            on['start_hash'](self._key, num_entries, self._expiry, info={'encoding':'ziplist', 'sizeof_value':len(raw_string)} if self._wants_info['start_hash'] else None)
+        hset = on['hset']
+        if hset is not None :
+            for x in xrange(0, num_entries) :
+                field = self.read_ziplist_entry(buff)
+                value = self.read_ziplist_entry(buff)
+                hset(self._key, field, value)
+            zlist_end = read_unsigned_char(buff)
+            if zlist_end != 255 :
+                raise Exception('read_hash_from_ziplist', "Invalid zip list end - %d for key %s" % (zlist_end, self._key))
+        if on['end_hash'] is not None :
+            on['end_hash'](self._key)
 
     # area        |<------------------- entry -------------------->|
     # 
@@ -842,10 +1282,13 @@ class RdbParser :
     # TODO : 这里不对的啊！应该在len前面还有一个field，记录zipmap中entry个数
     def read_zipmap(self, f) :
         raw_string = self.read_string(f)
-        buff = io.BytesIO(bytearray(raw_string))
+        buff = BytesReader(raw_string)
         num_entries = read_unsigned_char(buff) # 看吧，这里读出来entry个数了吧！
-        self._callback.start_hash(self._key, num_entries, self._expiry, info={'encoding':'zipmap', 'sizeof_value':len(raw_string)})
-        while True :
+        on = self._on
+        if on['start_hash'] is not None :
+            on['start_hash'](self._key, num_entries, self._expiry, info={'encoding':'zipmap', 'sizeof_value':len(raw_string)} if self._wants_info['start_hash'] else None)
+        hset = on['hset']
+        while hset is not None :
             next_length = self.read_zipmap_next_length(buff)
             if next_length is None :
                 break
@@ -855,14 +1298,14 @@ class RdbParser :
                 raise Exception('read_zip_map', 'Unexepcted end of zip map for key %s' % self._key)
             free = read_unsigned_char(buff)
             value = buff.read(next_length)
-            try:
-                value = int(value)
-            except ValueError:
-                pass
+            num = string_to_long(value)
+            if num is not None :
+                value = num
 
             skip(buff, free)
-            self._callback.hset(self._key, key, value)
-        self._callback.end_hash(self._key)
+            hset(self._key, key, value)
+        if on['end_hash'] is not None :
+            on['end_hash'](self._key)
 
     # 如果第一个字节位于 0 到252，那么它是zipmap的长度。如果第一个字节是253，读取下4个字节作为无符号整数来表示zipmap的长度
     # 254 和 255 对这个字段是非法的
@@ -878,7 +1321,7 @@ class RdbParser :
             return None
 
     def verify_magic_string(self, magic_string) :
-        if magic_string != 'REDIS' :
+        if magic_string != b'REDIS' :
             raise Exception('verify_magic_string', 'Invalid File Format')
 
     def verify_version(self, version_str) :
@@ -887,42 +1330,12 @@ class RdbParser :
             raise Exception('verify_version', 'Invalid RDB version number %d' % version)
 
     def init_filter(self, filters):
-        self._filters = {}
-        if not filters:
-            filters={}
-
-        if not 'dbs' in filters:
-            self._filters['dbs'] = None
-        elif isinstance(filters['dbs'], int):
-            self._filters['dbs'] = (filters['dbs'], )
-        elif isinstance(filters['dbs'], list):
-            self._filters['dbs'] = [int(x) for x in filters['dbs']]
-        else:
-            raise Exception('init_filter', 'invalid value for dbs in filter %s' %filters['dbs'])
-
-        if not ('keys' in filters and filters['keys']):
-            self._filters['keys'] = re.compile(".*")
-        else:
-            self._filters['keys'] = re.compile(filters['keys'])
-
-        if not 'types' in filters:
-            self._filters['types'] = ('set', 'hash', 'sortedset', 'string', 'list')
-        elif isinstance(filters['types'], str):
-            self._filters['types'] = (filters['types'], )
-        elif isinstance(filters['types'], list):
-            self._filters['types'] = [str(x) for x in filters['types']]
-        else:
-            raise Exception('init_filter', 'invalid value for types in filter %s' %filters['types'])
+        self._filters = compile_filters(filters)
 
     def matches_filter(self, db_number, key=None, data_type=None):
-        if self._filters['dbs'] and (not db_number in self._filters['dbs']):
-            return False
-        if key and (not self._filters['keys'].match(str(key))):
-            return False
-
-        if data_type is not None and (not self.get_logical_type(data_type) in self._filters['types']):
-            return False
-        return True
+        if data_type is not None:
+            data_type = self.get_logical_type(data_type)
+        return filters_match(self._filters, db_number, key, data_type)
 
     def get_logical_type(self, data_type):
         return DATA_TYPE_MAPPING[data_type]
@@ -932,45 +1345,381 @@ class RdbParser :
     # | LZF-FLAG | COMPRESSED-LEN | COMPRESSED-CONTENT |
     # +----------+----------------+--------------------+
     def lzf_decompress(self, compressed, expected_length):
-        in_stream = bytearray(compressed) #python内置函数
+        # literal runs and back references are copied as slices, not byte by byte
+        in_stream = compressed if BYTES_ARE_INTS else bytearray(compressed)
         in_len = len(in_stream)
         in_index = 0
         out_stream = bytearray()
-        out_index = 0
 
         while in_index < in_len :
             ctrl = in_stream[in_index]
-            if not isinstance(ctrl, int) :
-                raise Exception('lzf_decompress', 'ctrl should be a number %s for key %s' % (str(ctrl), self._key))
             in_index = in_index + 1
 
-            # TODO : 还没有弄清楚COMPRESSED-LEN为何以32为界限, 进行不同的处理
-            if ctrl < 32 :
-                for x in xrange(0, ctrl + 1) :
-                    out_stream.append(in_stream[in_index])
-                    #sys.stdout.write(chr(in_stream[in_index]))
-                    in_index = in_index + 1
-                    out_index = out_index + 1
-            else :
+            if ctrl < 32 : # 字面量，后面跟着 ctrl + 1 个未压缩的字节
+                out_stream += in_stream[in_index:in_index + ctrl + 1]
+                in_index = in_index + ctrl + 1
+            else : # 回溯引用，复制已解压的 length + 2 个字节
                 length = ctrl >> 5
                 if length == 7 :
                     length = length + in_stream[in_index]
                     in_index = in_index + 1
+                length = length + 2
 
+                out_index = len(out_stream)
                 ref = out_index - ((ctrl & 0x1f) << 8) - in_stream[in_index] - 1
                 in_index = in_index + 1
-                for x in xrange(0, length + 2) :
-                    out_stream.append(out_stream[ref])
-                    ref = ref + 1
-                    out_index = out_index + 1
+                if ref < 0 :
+                    raise Exception('lzf_decompress', 'Invalid back reference for key %s' % self._key)
+                if ref + length <= out_index :
+                    out_stream += out_stream[ref:ref + length]
+                else :
+                    # the reference overlaps the bytes it produces, it repeats the last out_index - ref bytes
+                    pattern = out_stream[ref:out_index]
+                    out_stream += (pattern * (length // len(pattern) + 1))[:length]
         if len(out_stream) != expected_length :
             raise Exception('lzf_decompress', 'Expected lengths do not match %d != %d for key %s' % (len(out_stream), expected_length, self._key))
-        return str(out_stream)
+        return bytes(out_stream)
+
+def compile_filters(filters):
+    """
+    Validates a filter dictionary as described in RdbParser,
+    and returns it with the key regular expression compiled
+    """
+    compiled = {}
+    if not filters:
+        filters={}
+
+    if not 'dbs' in filters:
+        compiled['dbs'] = None
+    elif isinstance(filters['dbs'], int):
+        compiled['dbs'] = (filters['dbs'], )
+    elif isinstance(filters['dbs'], list):
+        compiled['dbs'] = [int(x) for x in filters['dbs']]
+    else:
+        raise Exception('init_filter', 'invalid value for dbs in filter %s' %filters['dbs'])
+
+    if not ('keys' in filters and filters['keys']):
+        compiled['keys'] = None
+    else:
+        keys = filters['keys']
+        # keys are byte strings, so is the regular expression they are matched with
+        if BYTES_ARE_INTS and not isinstance(keys, bytes):
+            keys = keys.encode('utf-8')
+        compiled['keys'] = re.compile(keys)
+
+    if not 'types' in filters:
+        compiled['types'] = ('set', 'hash', 'sortedset', 'string', 'list')
+    elif isinstance(filters['types'], str):
+        compiled['types'] = (filters['types'], )
+    elif isinstance(filters['types'], list):
+        compiled['types'] = [str(x) for x in filters['types']]
+    else:
+        raise Exception('init_filter', 'invalid value for types in filter %s' %filters['types'])
+    return compiled
+
+def filters_match(compiled, db_number, key=None, logical_type=None):
+    """Checks a database, key and logical type such as 'hash' against filters from `compile_filters`"""
+    if compiled['dbs'] and (not db_number in compiled['dbs']):
+        return False
+    if key and compiled['keys'] is not None and (not compiled['keys'].match(to_bytes(key))):
+        return False
+
+    if logical_type is not None and (not logical_type in compiled['types']):
+        return False
+    return True
+
+def to_bytes(value):
+    """Returns `value` as a byte string. Integers, such as int encoded keys, are written in decimal"""
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, type(u'')):
+        value = str(value)
+    return value.encode('utf-8')
+
+def union_filters(filters_list):
+    """
+    Returns a filter dictionary that lets through everything that matches at least one
+    of the filters in `filters_list`. An axis without a filter in any of them is not filtered.
+    """
+    union = {}
+    filters_list = [f or {} for f in filters_list]
+    if not filters_list:
+        return union
+
+    if all(f.get('dbs') not in (None, []) for f in filters_list):
+        dbs = set()
+        for f in filters_list:
+            if isinstance(f['dbs'], int):
+                dbs.add(f['dbs'])
+            else:
+                dbs.update(int(x) for x in f['dbs'])
+        union['dbs'] = sorted(dbs)
+
+    if all(f.get('keys') for f in filters_list):
+        union['keys'] = '|'.join('(?:%s)' % f['keys'] for f in filters_list)
+
+    if all('types' in f for f in filters_list):
+        types = set()
+        for f in filters_list:
+            if isinstance(f['types'], str):
+                types.add(f['types'])
+            else:
+                types.update(str(x) for x in f['types'])
+        union['types'] = sorted(types)
+    return union
+
+# The strings redis considers integers, see string2l in util.c
+INTEGER_STRING = re.compile(br'(?:-?[1-9][0-9]{0,19}|0)\Z')
+LONG_MIN = -(1 << 63)
+LONG_MAX = (1 << 63) - 1
+
+def string_to_long(string):
+    """
+    Returns the integer value of `string` if redis would store it as an integer, otherwise None.
+    No exceptions are raised for strings that are not integers, which is the common case.
+    """
+    if len(string) > 20 or INTEGER_STRING.match(string) is None :
+        return None
+    value = int(string)
+    if value < LONG_MIN or value > LONG_MAX :
+        return None
+    return value
+
+def _noop(self):
+    pass
+
+def _noop_with_docstring(self):
+    """Does nothing"""
+    pass
+
+_NOOP_CODES = (_noop.__code__.co_code, _noop_with_docstring.__code__.co_code)
+
+def is_noop_method(method):
+    """True if `method` is a plain python function whose body does nothing, such as `pass`"""
+    func = getattr(method, '__func__', method)
+    code = getattr(func, '__code__', None)
+    if code is None or not code.co_code in _NOOP_CODES :
+        return False
+    # `return 5` compiles to the same instructions as `pass`, only the constant differs
+    consts = list(code.co_consts)
+    if func.__doc__ is not None and consts and consts[0] == func.__doc__ :
+        consts = consts[1:]
+    return all(c is None for c in consts)
+
+def method_reads_argument(method, name):
+    """
+    True unless `method` is a plain python function that never reads its argument `name`.
+    Anything that cannot be inspected is assumed to read it.
+    """
+    func = getattr(method, '__func__', method)
+    code = getattr(func, '__code__', None)
+    if code is None :
+        return True
+    if not name in code.co_varnames[:code.co_argcount] or name in code.co_cellvars :
+        return True
+    if 'locals' in code.co_names or 'vars' in code.co_names :
+        return True
+    if hasattr(dis, 'get_instructions') :
+        for instruction in dis.get_instructions(code) :
+            if instruction.opcode in dis.haslocal :
+                argval = instruction.argval
+                if argval == name or (isinstance(argval, tuple) and name in argval) :
+                    return True
+        return False
+    # python 2 : walk the raw bytecode
+    index = code.co_varnames.index(name)
+    co_code = code.co_code
+    i = 0
+    while i < len(co_code) :
+        op = ord(co_code[i])
+        if op >= dis.HAVE_ARGUMENT :
+            arg = ord(co_code[i+1]) | (ord(co_code[i+2]) << 8)
+            if op in dis.haslocal and arg == index :
+                return True
+            i += 3
+        else :
+            i += 1
+    return False
+
+class KeyEntry(object):
+    """
+    A key of the dump, yielded by RdbParser.iter_keys. `type` is the logical type, such as hash,
+    `encoding` is the encoding in the dump, such as ziplist, and `raw_size` is the size of the
+    serialized value in bytes. The value is decoded by `value` or `iter_elements`.
+    """
+    __slots__ = ('db', 'key', 'type', 'encoding', 'expiry', 'raw_size', '_parser', '_data_type', '_file', '_offset', '_raw')
+
+    def __init__(self, parser, db, key, data_type, expiry, raw_size, f, offset, raw):
+        self.db = db
+        self.key = key
+        self.type = DATA_TYPE_MAPPING[data_type]
+        self.encoding = ENCODING_MAPPING[data_type]
+        self.expiry = expiry
+        self.raw_size = raw_size
+        self._parser = parser
+        self._data_type = data_type
+        self._file = f
+        self._offset = offset
+        self._raw = raw
+
+    def raw_value(self):
+        '''The serialized value, as stored in the dump'''
+        if self._raw is not None :
+            return self._raw
+        f = self._file
+        if getattr(f, 'closed', False) :
+            raise Exception('raw_value', 'The dump of key %s was closed, values can only be decoded during the iteration' % self.key)
+        position = f.tell()
+        try :
+            f.seek(self._offset)
+            return f.read(self.raw_size)
+        finally :
+            f.seek(position)
+
+    def iter_elements(self):
+        """
+        Decodes the value and yields its elements : the value itself for a string, members for
+        lists and sets, (member, score) pairs for sorted sets and (field, value) pairs for hashes.
+        """
+        collector = self._parser._callback
+        collector.elements = []
+        parser = self._parser
+        parser._key = self.key
+        parser._expiry = self.expiry
+        parser.read_object(BytesReader(self.raw_value()), self._data_type)
+        elements, collector.elements = collector.elements, None
+        return iter(elements)
+
+    def value(self):
+        """Decodes the value as a string, list, set, dict of member to score for sorted sets, or dict for hashes"""
+        if self.type == "string" :
+            return next(self.iter_elements())
+        elif self.type == "list" :
+            return list(self.iter_elements())
+        elif self.type == "set" :
+            return set(self.iter_elements())
+        return dict(self.iter_elements())
+
+    def __repr__(self):
+        return 'KeyEntry(db=%d, key=%r, type=%s, encoding=%s, raw_size=%d)' % (
+            self.db, self.key, self.type, self.encoding, self.raw_size)
+
+class ValueCollector(RdbCallback):
+    """The callback KeyEntry decodes values with, it collects the elements of a single key"""
+    def __init__(self):
+        self.elements = None
+
+    def set(self, key, value, expiry, info):
+        self.elements.append(value)
+
+    def rpush(self, key, value):
+        self.elements.append(value)
+
+    def sadd(self, key, member):
+        self.elements.append(member)
+
+    def zadd(self, key, score, member):
+        self.elements.append((member, score))
+
+    def hset(self, key, field, value):
+        self.elements.append((field, value))
+
+class EventRecorder(object):
+    """
+    A callback that records the parse events it receives as (method name, args) tuples.
+    Only `events` are recorded, the parser skips the types no recorded event is about.
+    """
+    def __init__(self, events = CALLBACK_EVENTS):
+        self.events = []
+        for event in events:
+            setattr(self, event, self._recorder(event))
+
+    def _recorder(self, event):
+        append = self.events.append
+        def record(*args, **kwargs):
+            # the parser passes `info` by keyword, it is recorded as the last argument
+            if 'info' in kwargs:
+                args += (kwargs['info'],)
+            append((event, args))
+        return record
+
+    def take(self):
+        """Returns the events recorded since the last call"""
+        # the recording methods hold on to the list they append to, so it is emptied in place
+        events = self.events[:]
+        del self.events[:]
+        return events
+
+def callback_events(callback):
+    """The events `callback` implements, see RdbParser.init_dispatch"""
+    return [event for event in CALLBACK_EVENTS
+            if getattr(callback, event, None) is not None and not is_noop_method(getattr(callback, event))]
+
+class RecordingReader(object):
+    """Reads from `f` and keeps a copy of everything read, to get the raw value of non seekable dumps"""
+    def __init__(self, f):
+        self._f = f
+        self._chunks = []
+
+    def read(self, n):
+        data = self._f.read(n)
+        self._chunks.append(data)
+        return data
+
+    def getvalue(self):
+        return b''.join(self._chunks)
+
+class IncompleteEntry(Exception):
+    """Raised by BufferReader when an entry goes past the data fed so far"""
+    def __init__(self, needed):
+        Exception.__init__(self, needed)
+        self.needed = needed
+
+class BufferReader(object):
+    """A file like view of a bytearray from `position`, that raises IncompleteEntry instead of reading short"""
+    def __init__(self, buffer, position = 0):
+        self._buffer = buffer
+        self.position = position
+
+    def read(self, n):
+        end = self.position + n
+        if end > len(self._buffer) :
+            raise IncompleteEntry(end)
+        data = memoryview(self._buffer)[self.position:end].tobytes()
+        self.position = end
+        return data
+
+    def seek(self, offset, whence = 0):
+        # lets skip move past long values without copying them
+        position = self.position + offset if whence == 1 else offset
+        if position > len(self._buffer) :
+            raise IncompleteEntry(position)
+        self.position = position
+        return position
+
+# skips at least this long seek instead of reading, when the file can
+SKIP_SEEK_MIN = 65536
 
 def skip(f, free):
+    if free >= SKIP_SEEK_MIN :
+        try :
+            f.seek(free, 1)
+            return
+        except (AttributeError, IOError, ValueError) :
+            pass
     if free :
         f.read(free)
 
+def is_seekable(f):
+    seekable = getattr(f, 'seekable', None)
+    if seekable is not None :
+        return seekable()
+    try :
+        f.seek(0, 1)
+        return True
+    except (AttributeError, IOError) :
+        return False
+
 def ntohl(f) :
     val = read_unsigned_int(f)
     new_val = 0
@@ -989,37 +1738,48 @@ def to_datetime(usecs_since_epoch):
     delta = datetime.timedelta(microseconds = useconds)
     return dt + delta
 
+# compiled once, the readers are called for every length and ziplist entry
+_SIGNED_CHAR = struct.Struct('b')
+_UNSIGNED_CHAR = struct.Struct('B')
+_SIGNED_SHORT = struct.Struct('h')
+_UNSIGNED_SHORT = struct.Struct('H')
+_SIGNED_INT = struct.Struct('i')
+_UNSIGNED_INT = struct.Struct('I')
+_BIG_ENDIAN_UNSIGNED_INT = struct.Struct('>I')
+_24BIT_SIGNED = struct.Struct('<Hb')
+_SIGNED_LONG = struct.Struct('q')
+_UNSIGNED_LONG = struct.Struct('Q')
+
 def read_signed_char(f) :
-    return struct.unpack('b', f.read(1))[0]
+    return _SIGNED_CHAR.unpack(f.read(1))[0]
 
 def read_unsigned_char(f) :
-    return struct.unpack('B', f.read(1))[0]
+    return _UNSIGNED_CHAR.unpack(f.read(1))[0]
 
 def read_signed_short(f) :
-    return struct.unpack('h', f.read(2))[0]
+    return _SIGNED_SHORT.unpack(f.read(2))[0]
 
 def read_unsigned_short(f) :
-    return struct.unpack('H', f.read(2))[0]
+    return _UNSIGNED_SHORT.unpack(f.read(2))[0]
 
 def read_signed_int(f) :
-    return struct.unpack('i', f.read(4))[0]
+    return _SIGNED_INT.unpack(f.read(4))[0]
 
 def read_unsigned_int(f) :
-    return struct.unpack('I', f.read(4))[0]
+    return _UNSIGNED_INT.unpack(f.read(4))[0]
 
 def read_big_endian_unsigned_int(f):
-    return struct.unpack('>I', f.read(4))[0]
+    return _BIG_ENDIAN_UNSIGNED_INT.unpack(f.read(4))[0]
 
 def read_24bit_signed_number(f):
-    s = '0' + f.read(3)
-    num = struct.unpack('i', s)[0]
-    return num >> 8
+    low, high = _24BIT_SIGNED.unpack(f.read(3))
+    return (high << 16) | low
 
 def read_signed_long(f) :
-    return struct.unpack('q', f.read(8))[0]
+    return _SIGNED_LONG.unpack(f.read(8))[0]
 
 def read_unsigned_long(f) :
-    return struct.unpack('Q', f.read(8))[0]
+    return _UNSIGNED_LONG.unpack(f.read(8))[0]
 
 def string_as_hexcode(string) :
     for s in string :
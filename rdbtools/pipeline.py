@@ -0,0 +1,352 @@
+'''
+Pipeline mode : decoding and formatting on separate cores, for output callbacks such as
+JSONCallback and ProtocolCallback, where formatting costs more than decoding.
+
+This mode is experimental. Its output is tested against RdbParser, but its speedup has only
+been measured on a single core so far, where it is slower than RdbParser. Run
+benchmarks/bench_pipeline.py on the host before relying on it.
+
+The decoding process parses the dump and writes its events, in batches of whole keys, to a
+ring buffer in a multiprocessing.shared_memory block per formatter. Batches go to the
+formatter processes in turn, each one runs its own callback on its batches and writes the
+output to a second ring buffer, which the decoding process reads in the same order and
+writes to `out`. The output is the same as with RdbParser, and needs python 3.8 or later.
+
+Callbacks only carry state from a key to the next through the database events and whether a
+key was written since, such as the separator in front of a key in JSON. Every formatter
+receives the database events of every batch and the first key of each type after them,
+stripped of their elements, and discards what they write. Callbacks that keep other state across keys, such as
+MemoryCallback, cannot be split this way.
+
+    with open('dump.json', 'wb') as out:
+        PipelineParser(JSONCallback, out, formatters=3).parse('dump.rdb')
+'''
+import io
+import pickle
+import struct
+import threading
+
+try:
+    import multiprocessing
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# python 2 and python 3 before 3.8 have no shared memory
+PIPELINE_AVAILABLE = shared_memory is not None
+
+from rdbtools.parser import RdbParser, EventRecorder, callback_events, DEFAULT_STRING_CHUNK_SIZE
+from rdbtools.output import OutputSink
+
+DEFAULT_FORMATTERS = 2
+# a batch is sent once it holds at least this many events, at the end of a key
+DEFAULT_BATCH_EVENTS = 10000
+DEFAULT_RING_SIZE = 8 * 1024 * 1024
+# how often a process blocked on a ring checks that the other end is still alive, in seconds
+WAIT_TIMEOUT = 1.0
+
+# events that are not about a key, every formatter gets them
+STRUCTURE_EVENTS = frozenset(('start_rdb', 'start_database', 'end_database', 'end_rdb'))
+
+# bytes written, bytes read, closed by the writer, aborted by either end
+RING_HEADER = struct.Struct('<QQBB')
+MESSAGE_LENGTH = struct.Struct('<Q')
+
+class PipelineAborted(Exception):
+    '''Raised on one end of a ring buffer when the other end failed'''
+    pass
+
+class RingBuffer(object):
+    '''
+    A stream of bytes from one process to another, through a shared memory block of `size` bytes.
+
+    The positions are kept in the block, and only read or written under `condition`, which
+    the reader and the writer wait on while the ring is empty or full. The data itself is
+    copied outside of it. Rings are given to the other process as an argument of Process.
+    '''
+    def __init__(self, size, context):
+        self.size = size
+        self._shm = shared_memory.SharedMemory(create=True, size=RING_HEADER.size + size)
+        RING_HEADER.pack_into(self._shm.buf, 0, 0, 0, 0, 0)
+        self._condition = context.Condition()
+        # a process, or anything with is_alive, whose death unblocks waits on this ring
+        self.peer = None
+
+    def __getstate__(self):
+        return {'size' : self.size, 'name' : self._shm.name, 'condition' : self._condition}
+
+    def __setstate__(self, state):
+        self.size = state['size']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._condition = state['condition']
+        self.peer = None
+
+    def _wait(self):
+        if not self._condition.wait(WAIT_TIMEOUT) and self.peer is not None and not self.peer.is_alive():
+            raise PipelineAborted('The other end of the pipeline exited')
+
+    def _set(self, index, value):
+        header = list(RING_HEADER.unpack_from(self._shm.buf, 0))
+        header[index] = value
+        RING_HEADER.pack_into(self._shm.buf, 0, *header)
+        self._condition.notify_all()
+
+    def write(self, data):
+        data = memoryview(data)
+        buf = self._shm.buf
+        size = self.size
+        while len(data):
+            with self._condition:
+                while True:
+                    written, read, closed, aborted = RING_HEADER.unpack_from(buf, 0)
+                    if aborted:
+                        raise PipelineAborted('The pipeline was aborted')
+                    free = size - (written - read)
+                    if free:
+                        break
+                    self._wait()
+            start = written % size
+            n = min(free, len(data), size - start)
+            position = RING_HEADER.size + start
+            buf[position:position + n] = data[:n]
+            data = data[n:]
+            with self._condition:
+                self._set(0, written + n)
+
+    def read(self, n):
+        '''Reads exactly `n` bytes. Returns b'' if the writer closed the ring before any was written'''
+        buf = self._shm.buf
+        size = self.size
+        parts = []
+        remaining = n
+        while remaining:
+            with self._condition:
+                while True:
+                    written, read, closed, aborted = RING_HEADER.unpack_from(buf, 0)
+                    if aborted:
+                        raise PipelineAborted('The pipeline was aborted')
+                    if written > read:
+                        break
+                    if closed:
+                        if remaining == n:
+                            return b''
+                        raise PipelineAborted('The pipeline was closed in the middle of a message')
+                    self._wait()
+            start = read % size
+            count = min(written - read, remaining, size - start)
+            position = RING_HEADER.size + start
+            parts.append(bytes(buf[position:position + count]))
+            remaining -= count
+            with self._condition:
+                self._set(1, read + count)
+        return b''.join(parts)
+
+    def write_message(self, data):
+        self.write(MESSAGE_LENGTH.pack(len(data)))
+        self.write(data)
+
+    def read_message(self):
+        '''Reads the next message, or returns None once the writer closed the ring'''
+        header = self.read(MESSAGE_LENGTH.size)
+        if not header:
+            return None
+        return self.read(MESSAGE_LENGTH.unpack(header)[0])
+
+    def close(self):
+        '''Tells the reader that nothing more will be written'''
+        with self._condition:
+            self._set(2, 1)
+
+    def abort(self):
+        '''Makes both ends raise PipelineAborted, instead of waiting for each other'''
+        with self._condition:
+            self._set(3, 1)
+
+    def release(self, unlink = False):
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+def skeleton(events, entries):
+    '''
+    The events of a batch that formatters that do not own it need to keep the state of their
+    callback : the database events, and after them the first key of each kind, without its elements.
+    Keys are of the same kind when they start with the same event, such as start_hash.
+    `entries` are the (start, end) index of the events of each entry of the dump in `events`.
+    '''
+    result = []
+    seen = set()
+    for start, end in entries:
+        event, args = events[start]
+        if event in STRUCTURE_EVENTS:
+            result.extend(events[start:end])
+            seen.clear()
+        elif not event in seen:
+            seen.add(event)
+            if event == 'set':
+                args = (args[0], b'') + args[2:]
+            result.append((event, args))
+            if end - start > 1:
+                result.append(events[end - 1])
+    return result
+
+def run_formatter(callback_factory, source, output):
+    '''
+    The formatter processes : runs a callback made by `callback_factory` on every batch read
+    from `source`, and writes the output of each batch as a message to `output`.
+    '''
+    source.peer = output.peer = multiprocessing.parent_process()
+    buffer = io.BytesIO()
+    sink = OutputSink(buffer)
+    callback = callback_factory(sink)
+    methods = {}
+    def dispatch(events):
+        for event, args in events:
+            method = methods.get(event)
+            if method is None:
+                method = methods[event] = getattr(callback, event)
+            method(*args)
+        sink.flush()
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+    try:
+        while True:
+            message = source.read_message()
+            if message is None:
+                break
+            context, events = pickle.loads(message)
+            dispatch(context)
+            output.write_message(dispatch(events))
+        output.close()
+    except PipelineAborted:
+        pass
+    except BaseException:
+        source.abort()
+        output.abort()
+        raise
+    finally:
+        source.release()
+        output.release()
+
+class PipelineParser(object):
+    '''
+    Parses a dump like RdbParser, with `formatters` processes running the callbacks made by
+    `callback_factory`, each called with the file object to write to. The output of all the
+    callbacks is written to `out`, in order.
+
+    `callback_factory` must be picklable, unless processes are started by fork.
+    Batches hold about `batch_events` events, each ring buffer `ring_size` bytes.
+    '''
+    def __init__(self, callback_factory, out, filters = None, formatters = DEFAULT_FORMATTERS,
+                 string_chunk_size = DEFAULT_STRING_CHUNK_SIZE, batch_events = DEFAULT_BATCH_EVENTS,
+                 ring_size = DEFAULT_RING_SIZE):
+        if not PIPELINE_AVAILABLE:
+            raise Exception('PipelineParser', 'The pipeline mode needs python 3.8 or later')
+        self._callback_factory = callback_factory
+        self._out = out
+        self._filters = filters
+        self._formatters = max(formatters, 1)
+        self._string_chunk_size = string_chunk_size
+        self._batch_events = batch_events
+        self._ring_size = ring_size
+        self._error = None
+
+    def parse(self, filename):
+        with open(filename, "rb") as f:
+            self.parse_fd(f)
+
+    def parse_fd(self, f):
+        context = multiprocessing.get_context()
+        self._error = None
+        # the events are recorded with the methods the callbacks implement, so that the
+        # types they ignore are skipped and strings are given in chunks if they take them
+        events = callback_events(self._callback_factory(io.BytesIO()))
+        recorder = EventRecorder(events)
+        parser = RdbParser(recorder, self._filters, self._string_chunk_size)
+        inputs = [RingBuffer(self._ring_size, context) for i in range(self._formatters)]
+        outputs = [RingBuffer(self._ring_size, context) for i in range(self._formatters)]
+        workers = []
+        try:
+            for source, output in zip(inputs, outputs):
+                worker = context.Process(target=run_formatter, args=(self._callback_factory, source, output))
+                worker.daemon = True
+                worker.start()
+                source.peer = output.peer = worker
+                workers.append(worker)
+            collector = threading.Thread(target=self._collect, args=(outputs, inputs))
+            collector.daemon = True
+            collector.start()
+            try:
+                self._decode(parser, recorder, f, inputs)
+            except PipelineAborted:
+                pass
+            except BaseException:
+                for ring in inputs + outputs:
+                    ring.abort()
+                raise
+            finally:
+                for ring in inputs:
+                    ring.close()
+                collector.join()
+            for worker in workers:
+                worker.join()
+            # a failed formatter makes the other processes abort, its own error is the one reported
+            failed = [worker.exitcode for worker in workers if worker.exitcode]
+            if failed:
+                raise Exception('PipelineParser', 'A formatter process failed with exit code %d' % failed[0])
+            if self._error is not None:
+                raise self._error
+        finally:
+            for worker in workers:
+                worker.join()
+            for ring in inputs + outputs:
+                ring.release(unlink=True)
+
+    def _decode(self, parser, recorder, f, inputs):
+        events = recorder.events
+        formatters = len(inputs)
+        # the skeleton of the batches each formatter did not get, see skeleton
+        pending = [[] for ring in inputs]
+        batch = 0
+        parser.verify_magic_string(f.read(5))
+        parser.verify_version(f.read(4))
+        parser.start_parse()
+        entries = [(0, len(events))] if events else []
+        more = True
+        while more:
+            start = len(events)
+            more = parser.read_entry(f)
+            if len(events) > start:
+                entries.append((start, len(events)))
+            if len(events) < self._batch_events and more:
+                continue
+            owner = batch % formatters
+            if formatters > 1:
+                stripped = skeleton(events, entries)
+                for i in range(formatters):
+                    if i != owner:
+                        pending[i].extend(stripped)
+            inputs[owner].write_message(pickle.dumps((pending[owner], events), pickle.HIGHEST_PROTOCOL))
+            pending[owner] = []
+            del events[:]
+            entries = []
+            batch += 1
+
+    def _collect(self, outputs, inputs):
+        # batches were given to the formatters in turn, their output is read back in the same order
+        sink = OutputSink.wrap(self._out)
+        batch = 0
+        try:
+            while True:
+                chunk = outputs[batch % len(outputs)].read_message()
+                if chunk is None:
+                    break
+                sink.write(chunk)
+                batch += 1
+            sink.flush()
+        except BaseException as e:
+            self._error = e
+            for ring in inputs:
+                ring.abort()
@@ -0,0 +1,172 @@
+'''
+A compact binary file of MemoryRecords, the binary counterpart of the csv written by PrintAllKeys.
+
+The file is a header, a sequence of blocks and a footer :
+
+    header : the 8 byte magic
+    block  : row count (uint32), key heap size (uint32), the rows, then the key heap
+    row    : key offset in the heap (uint32), key length (uint32), bytes, num_elements,
+             len_largest_element (uint64 each), database (uint16), type and encoding codes (uint8 each)
+    footer : the file offset of every block (uint64 each), the number of blocks and of rows (uint64 each),
+             then the magic again
+
+Rows have a fixed width, so numeric columns can be scanned without touching the keys.
+Blocks are written as soon as they are full, and the footer makes the file readable
+from the end with a memory map, see RecordFile.
+'''
+import bisect
+import mmap
+import struct
+
+from rdbtools.output import OutputSink
+from rdbtools.memprofiler import MemoryRecord
+
+MAGIC = b'RDBMREC1'
+BLOCK_HEADER = struct.Struct('<II')
+ROW = struct.Struct('<IIQQQHBB')
+FOOTER = struct.Struct('<QQ8s')
+OFFSET = struct.Struct('<Q')
+DEFAULT_BLOCK_ROWS = 65536
+
+TYPES = ('string', 'list', 'set', 'sortedset', 'hash')
+ENCODINGS = ('string', 'linkedlist', 'ziplist', 'hashtable', 'intset', 'skiplist', 'zipmap')
+TYPE_CODES = dict((name, code) for code, name in enumerate(TYPES))
+ENCODING_CODES = dict((name, code) for code, name in enumerate(ENCODINGS))
+
+class RecordWriter():
+    '''
+    A reporter for MemoryCallback that writes records in the binary format described above.
+    Records using fewer than `min_bytes` bytes or with fewer than `min_elements` elements are skipped.
+    '''
+    def __init__(self, out, min_bytes = 0, min_elements = 0, block_rows = DEFAULT_BLOCK_ROWS):
+        self._out = OutputSink.wrap(out)
+        self._min_bytes = min_bytes
+        self._min_elements = min_elements
+        self._block_rows = block_rows
+        self._rows = bytearray()
+        self._heap = bytearray()
+        self._block_count = 0
+        self._offset = 0
+        self._block_offsets = []
+        self.rows = 0
+        self._write(MAGIC)
+
+    def _write(self, data):
+        self._out.write(data)
+        self._offset += len(data)
+
+    def next_record(self, record):
+        if record.bytes < self._min_bytes or record.size < self._min_elements:
+            return
+        key = record.key
+        if not isinstance(key, bytes):
+            key = str(key).encode('utf-8')
+        self._rows += ROW.pack(len(self._heap), len(key), int(record.bytes), record.size, record.len_largest_element,
+                               record.database, TYPE_CODES[record.type], ENCODING_CODES[record.encoding])
+        self._heap += key
+        self._block_count += 1
+        self.rows += 1
+        if self._block_count >= self._block_rows:
+            self._write_block()
+
+    def _write_block(self):
+        if not self._block_count:
+            return
+        self._block_offsets.append(self._offset)
+        self._write(BLOCK_HEADER.pack(self._block_count, len(self._heap)))
+        self._write(bytes(self._rows))
+        self._write(bytes(self._heap))
+        del self._rows[:]
+        del self._heap[:]
+        self._block_count = 0
+
+    def flush(self):
+        self._write_block()
+        self._out.flush()
+
+    def end_rdb(self):
+        self._write_block()
+        for offset in self._block_offsets:
+            self._write(OFFSET.pack(offset))
+        self._write(FOOTER.pack(len(self._block_offsets), self.rows, MAGIC))
+        self._out.flush()
+
+class RecordFile(object):
+    '''
+    Reads a file written by RecordWriter through a memory map.
+
+    Records are looked up by index, `file[i]`, or iterated over. `column` reads a single
+    numeric column without decoding keys.
+    '''
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        size = len(self._map)
+        if size < len(MAGIC) + FOOTER.size or self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise Exception('RecordFile', '%s is not a memory record file' % filename)
+        block_count, self.rows, magic = FOOTER.unpack_from(self._map, size - FOOTER.size)
+        if magic != MAGIC:
+            self.close()
+            raise Exception('RecordFile', '%s is truncated' % filename)
+        index_offset = size - FOOTER.size - block_count * OFFSET.size
+        # (offset of the rows, offset of the key heap, number of rows) of every block
+        self._blocks = []
+        self._first_rows = []
+        first_row = 0
+        for block in range(block_count):
+            offset = OFFSET.unpack_from(self._map, index_offset + block * OFFSET.size)[0]
+            row_count, heap_size = BLOCK_HEADER.unpack_from(self._map, offset)
+            self._blocks.append((offset + BLOCK_HEADER.size, offset + BLOCK_HEADER.size + row_count * ROW.size, row_count))
+            self._first_rows.append(first_row)
+            first_row += row_count
+
+    def __len__(self):
+        return self.rows
+
+    def _locate(self, index):
+        if index < 0:
+            index += self.rows
+        if index < 0 or index >= self.rows:
+            raise IndexError('record index out of range')
+        block = bisect.bisect_right(self._first_rows, index) - 1
+        rows_offset, heap_offset, row_count = self._blocks[block]
+        return rows_offset + (index - self._first_rows[block]) * ROW.size, heap_offset
+
+    def _record(self, row_offset, heap_offset):
+        key_offset, key_length, nbytes, size, largest, database, type_code, encoding_code = ROW.unpack_from(self._map, row_offset)
+        start = heap_offset + key_offset
+        return MemoryRecord(database, TYPES[type_code], self._map[start:start + key_length], nbytes,
+                            ENCODINGS[encoding_code], size, largest)
+
+    def __getitem__(self, index):
+        return self._record(*self._locate(index))
+
+    def __iter__(self):
+        for rows_offset, heap_offset, row_count in self._blocks:
+            for row in range(row_count):
+                yield self._record(rows_offset + row * ROW.size, heap_offset)
+
+    def column(self, name):
+        '''Yields the values of one of the numeric columns : bytes, size, len_largest_element or database'''
+        field = ('key_offset', 'key_length', 'bytes', 'size', 'len_largest_element', 'database').index(name)
+        unpack_from = ROW.unpack_from
+        for rows_offset, heap_offset, row_count in self._blocks:
+            for row in range(row_count):
+                yield unpack_from(self._map, rows_offset + row * ROW.size)[field]
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,127 @@
+'''
+Reading the rdb file of a live server the way a replica does, without BGSAVE and a copy.
+
+The connection asks for a full resynchronization with PSYNC ? -1 (SYNC on servers older than 2.8),
+and the server answers with the rdb payload, framed either as $<length> or, for diskless
+replication, as $EOF:<40 byte mark> followed by the payload and the mark again.
+ReplicationStream reads that payload as a file object, so that RdbParser.parse_fd parses
+it while it arrives. It can write a copy of the payload to disk on the way.
+'''
+import io
+
+from rdbtools.resp import RespError
+
+EOF_MARK_LENGTH = 40
+CHUNK_SIZE = 65536
+
+class ReplicationStream(io.RawIOBase):
+    '''
+    The rdb payload of a full resynchronization, read from `f`, the buffered file of the connection.
+
+    Exactly one of `length` and `eof_mark` is given, depending on the framing the server chose.
+    Every byte of the payload read is also written to `tee` when it is not None.
+    This is a raw stream, the parser reads it through an io.BufferedReader, see parse_replica.
+    '''
+    def __init__(self, f, length = None, eof_mark = None, tee = None):
+        io.RawIOBase.__init__(self)
+        self._f = f
+        self._remaining = length
+        self._mark = eof_mark
+        self._tee = tee
+        self._buffer = bytearray()
+        self._position = 0
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._mark is None:
+            data = self._f.read1(min(len(b), self._remaining)) if self._remaining else b''
+            if self._remaining and not data:
+                raise IOError('Replication stream closed before the end of the rdb payload')
+            self._remaining -= len(data)
+        else:
+            data = self._read_before_mark(len(b))
+        n = len(data)
+        b[:n] = data
+        self.bytes_read += n
+        if self._tee is not None and n:
+            self._tee.write(data)
+        return n
+
+    def _read_before_mark(self, n):
+        # like redis, the payload ends at the first occurrence of the mark. Until a mark is found,
+        # the last bytes received are held back, as they could be the start of one
+        while True:
+            end = self._buffer.find(self._mark, self._position)
+            if end == self._position:
+                return b''
+            if end < 0:
+                end = len(self._buffer) - EOF_MARK_LENGTH + 1
+            if end > self._position:
+                break
+            data = self._f.read1(CHUNK_SIZE)
+            if not data:
+                raise IOError('Replication stream closed before the end of the rdb payload')
+            self._buffer += data
+        data = bytes(self._buffer[self._position:min(end, self._position + n)])
+        self._position += len(data)
+        if self._position >= CHUNK_SIZE:
+            del self._buffer[:self._position]
+            self._position = 0
+        return data
+
+    def finish(self, reader):
+        '''
+        Reads the rest of the payload, such as the checksum, through `reader`,
+        the buffered reader the parser used.
+        '''
+        while reader.read(CHUNK_SIZE):
+            pass
+
+def start_sync(redis):
+    '''
+    Asks `redis`, a RespConnection, for a full resynchronization and reads up to the start
+    of the rdb payload. Returns the framing as a (length, eof_mark) pair, one of them being None.
+    '''
+    # servers that do not know capa answer with an error, and use the $<length> framing
+    redis.pipeline([('REPLCONF', 'capa', 'eof')])
+    reply = redis.pipeline([('PSYNC', '?', '-1')])[0]
+    if isinstance(reply, RespError):
+        # servers older than 2.8 only know SYNC, which sends the payload without a reply first
+        redis.send('SYNC')
+    elif not reply.startswith(b'FULLRESYNC'):
+        raise RespError('Expected FULLRESYNC, got %s' % reply.decode('utf-8', 'replace'))
+    f = redis.file
+    while True:
+        line = f.readline()
+        if not line:
+            raise IOError('Connection to %s:%s closed before the rdb payload' % (redis.host, redis.port))
+        line = line.rstrip(b'\r\n')
+        # the server sends empty lines while it is producing the rdb file
+        if not line:
+            continue
+        if line.startswith(b'-'):
+            raise RespError(line[1:].decode('utf-8', 'replace'))
+        if line.startswith(b'$EOF:'):
+            mark = line[5:]
+            if len(mark) != EOF_MARK_LENGTH:
+                raise IOError('Invalid rdb payload mark %r' % mark)
+            return None, mark
+        if line.startswith(b'$'):
+            return int(line[1:]), None
+        raise IOError('Unexpected reply before the rdb payload : %r' % line)
+
+def parse_replica(parser, redis, tee = None):
+    '''
+    Parses the rdb file of the server `redis` is connected to with `parser`, an RdbParser,
+    as it is transferred. The payload is also written to `tee` when it is not None.
+    Returns the ReplicationStream the payload was read from. The connection cannot be used afterwards.
+    '''
+    length, mark = start_sync(redis)
+    stream = ReplicationStream(redis.file, length, mark, tee)
+    reader = io.BufferedReader(stream, CHUNK_SIZE)
+    parser.parse_fd(reader)
+    stream.finish(reader)
+    return stream
@@ -0,0 +1,37 @@
+'''
+Html report of redis-profiler.
+
+The report is the template rdbtools/cli/report.html.template with the data of the report
+in place of ${REPORT_JSON}. The data comes from the `get_report` method of the aggregators,
+which bins and samples everything, so the page stays a few hundred KB on any dump.
+'''
+import os
+import json
+
+from rdbtools.output import OutputSink
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), 'cli', 'report.html.template')
+PLACEHOLDER = '${REPORT_JSON}'
+
+def load_template(template = TEMPLATE):
+    '''Returns the text before and after the data placeholder of `template`'''
+    with open(template) as f:
+        text = f.read()
+    if not PLACEHOLDER in text:
+        raise Exception('load_template', 'The report template %s has no %s' % (template, PLACEHOLDER))
+    head, sep, tail = text.partition(PLACEHOLDER)
+    return head, tail
+
+def write_report(report, out, template = TEMPLATE):
+    '''
+    Writes the html report for `report`, the result of `get_report`, to `out`.
+    The json is encoded and written piece by piece, it is never held in memory as a whole.
+    '''
+    head, tail = load_template(template)
+    sink = OutputSink.wrap(out)
+    sink.write(head)
+    for chunk in json.JSONEncoder(sort_keys=True).iterencode(report):
+        # the data is inside a script element, which a key containing </script> would end
+        sink.write(chunk.replace('</', '<\\/'))
+    sink.write(tail)
+    sink.flush()
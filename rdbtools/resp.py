@@ -0,0 +1,174 @@
+'''
+A minimal client for the redis protocol (RESP), used by the tools that read keys from a live server.
+
+It only does what those tools need : one connection, commands sent one at a time or
+pipelined in windows, and raw access to the socket for replication.
+Bulk replies are returned as bytes, so binary DUMP payloads are never decoded.
+
+It replaces redis-py because replication reads the rdb payload that follows PSYNC straight
+off the socket, as a stream, where redis-py would read it as a single reply held in memory.
+A single connection is enough : every tool sends its pipelines one after the other.
+'''
+import io
+import socket
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+try:
+    from socket import SocketIO
+except ImportError:
+    class SocketIO(io.RawIOBase):
+        '''The raw reader of a socket, python 2 has no io based socket files'''
+        def __init__(self, sock, mode):
+            io.RawIOBase.__init__(self)
+            self._sock = sock
+
+        def readable(self):
+            return True
+
+        def readinto(self, b):
+            return self._sock.recv_into(b)
+
+DEFAULT_PORT = 6379
+
+class RespError(Exception):
+    '''An error reply of the server'''
+    pass
+
+def encode_command(args):
+    '''Encodes a command as a RESP array of bulk strings'''
+    parts = [b'*' + str(len(args)).encode('ascii') + b'\r\n']
+    for arg in args:
+        if isinstance(arg, text_type):
+            arg = arg.encode('utf-8')
+        elif not isinstance(arg, bytes):
+            arg = str(arg).encode('ascii')
+        parts.append(b'$' + str(len(arg)).encode('ascii') + b'\r\n')
+        parts.append(arg)
+        parts.append(b'\r\n')
+    return b''.join(parts)
+
+class RespConnection(object):
+    '''
+    A connection to a redis server.
+
+    `execute` sends a command and returns its reply, raising RespError on error replies.
+    `pipeline` sends a list of commands at once and returns their replies in order,
+    with error replies returned as RespError instances instead of being raised.
+    '''
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, password=None, db=0, timeout=None):
+        self.host = host
+        self.port = port
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # a BufferedReader, whose read1 returns what has arrived without waiting for more
+        self._file = io.BufferedReader(SocketIO(self._sock, 'rb'))
+        if password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+
+    def send(self, *args):
+        self._sock.sendall(encode_command(args))
+
+    def execute(self, *args):
+        self.send(*args)
+        reply = self.read_reply()
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def pipeline(self, commands):
+        if not commands:
+            return []
+        self._sock.sendall(b''.join(encode_command(args) for args in commands))
+        return [self.read_reply() for args in commands]
+
+    def readline(self):
+        '''Reads a line of the protocol, without its \\r\\n'''
+        line = self._file.readline()
+        if not line.endswith(b'\r\n'):
+            raise IOError('Connection to %s:%s closed' % (self.host, self.port))
+        return line[:-2]
+
+    def read(self, length):
+        '''Reads exactly `length` bytes, a short read means the server went away'''
+        data = self._file.read(length)
+        if len(data) != length:
+            raise IOError('Connection to %s:%s closed' % (self.host, self.port))
+        return data
+
+    def read_reply(self):
+        line = self.readline()
+        prefix, rest = line[:1], line[1:]
+        if prefix == b'+':
+            return rest
+        elif prefix == b'-':
+            return RespError(rest.decode('utf-8', 'replace'))
+        elif prefix == b':':
+            return int(rest)
+        elif prefix == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.read(length + 2)
+            return data[:-2]
+        elif prefix == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self.read_reply() for i in range(length)]
+        raise IOError('Invalid reply from %s:%s : %r' % (self.host, self.port, line))
+
+    @property
+    def file(self):
+        '''The buffered file the replies are read from, for protocols that leave RESP, such as replication'''
+        return self._file
+
+    def info(self, section=None):
+        '''Returns the INFO reply as a dict of strings'''
+        reply = self.execute('INFO', section) if section else self.execute('INFO')
+        info = {}
+        for line in reply.decode('utf-8', 'replace').splitlines():
+            if ':' in line and not line.startswith('#'):
+                name, value = line.split(':', 1)
+                info[name] = value
+        return info
+
+    def version(self):
+        '''Returns the version of the server as a tuple of ints'''
+        return tuple(int(part) for part in self.info('server')['redis_version'].split('.')[:3])
+
+    def scan(self, cursor=b'0', match=None, count=1000):
+        '''Sends a single SCAN, and returns the next cursor and the keys of the page'''
+        args = ['SCAN', cursor]
+        if match is not None:
+            args += ['MATCH', match]
+        args += ['COUNT', count]
+        cursor, keys = self.execute(*args)
+        return cursor, keys
+
+    def scan_iter(self, match=None, count=1000):
+        '''Yields every key of the selected database with SCAN, optionally only those matching `match`'''
+        cursor = b'0'
+        while True:
+            cursor, keys = self.scan(cursor, match, count)
+            for key in keys:
+                yield key
+            if cursor == b'0':
+                break
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,391 @@
+'''
+Fixed size summaries used by the memory profiler on very large dumps.
+
+Every structure here uses the same amount of memory no matter how many values are added to it.
+
+Every structure can also be saved with `get_state`, which returns plain lists and dicts that
+can be written as json, and rebuilt with `from_state`. Two structures of the same kind are
+combined with `merge`, so summaries built on different machines can be added up.
+'''
+import heapq
+import random
+
+def state_text(value):
+    '''
+    Returns `value` as text when it is a byte string, so it can be written as json.
+    Every byte is kept as the character of the same code, see state_bytes.
+    '''
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return value
+
+def state_bytes(value):
+    '''Returns the byte string a text from `state_text` was made from. Other values are returned as is'''
+    if isinstance(value, type(u'')):
+        return value.encode('latin-1')
+    return value
+
+class LogHistogram(object):
+    '''
+    A histogram of non-negative integers with log-scaled buckets, backed by a flat list.
+
+    Values below `2 ** precision` get a bucket each. Above that, every power of two is split
+    into `2 ** precision` equally wide buckets, so a bucket is never wider than
+    1 / 2 ** precision of the values it holds. With the default precision of 5 that is ~3%,
+    which makes the histogram usable as a quantile sketch as well.
+    '''
+    def __init__(self, precision=5):
+        self.precision = precision
+        self.sub_buckets = 1 << precision
+        # enough buckets for any 64 bit value
+        self.counts = [0] * ((64 - precision + 1) * self.sub_buckets)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def bucket(self, value):
+        '''Returns the index of the bucket that holds `value`'''
+        if value < self.sub_buckets:
+            return value
+        shift = value.bit_length() - self.precision - 1
+        return (shift << self.precision) + (value >> shift)
+
+    def bucket_bounds(self, index):
+        '''Returns the smallest and largest value held by the bucket at `index`'''
+        if index < self.sub_buckets:
+            return index, index
+        shift = (index >> self.precision) - 1
+        mantissa = (index & (self.sub_buckets - 1)) | self.sub_buckets
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def add(self, value, count=1):
+        value = int(value)
+        if value < 0:
+            value = 0
+        self.counts[self.bucket(value)] += count
+        self.count += count
+        self.total += value * count
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        '''Returns an estimate of the `q` quantile, 0 <= q <= 1, or None if the histogram is empty'''
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            if seen > rank:
+                low, high = self.bucket_bounds(index)
+                return min((low + high) // 2, self.max)
+        return self.max
+
+    def buckets(self):
+        '''Yields (smallest value, largest value, count) for every non empty bucket'''
+        for index, count in enumerate(self.counts):
+            if count:
+                low, high = self.bucket_bounds(index)
+                yield low, high, count
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise Exception('LogHistogram', 'Cannot merge histograms of precision %d and %d' % (self.precision, other.precision))
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def get_state(self):
+        # only non empty buckets are saved, as [index, count] pairs
+        return {'precision' : self.precision, 'count' : self.count, 'total' : self.total, 'max' : self.max,
+                'counts' : [[index, count] for index, count in enumerate(self.counts) if count]}
+
+    @classmethod
+    def from_state(cls, state):
+        histogram = cls(state['precision'])
+        for index, count in state['counts']:
+            histogram.counts[index] = count
+        histogram.count = state['count']
+        histogram.total = state['total']
+        histogram.max = state['max']
+        return histogram
+
+class ReservoirSample(object):
+    '''
+    A uniform random sample of at most `size` items out of everything added, see Algorithm R.
+    '''
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.items = []
+        self.seen = 0
+        self._random = random.Random(seed)
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            index = int(self._random.random() * self.seen)
+            if index < self.size:
+                self.items[index] = item
+
+    def merge(self, other):
+        '''
+        Keeps a uniform sample of everything added to either sample : every item kept
+        comes from `self` or `other` in proportion to the number of items each has seen.
+        '''
+        mine, theirs = list(self.items), list(other.items)
+        mine_seen, theirs_seen = self.seen, other.seen
+        items = []
+        while len(items) < self.size and (mine or theirs):
+            if theirs and (not mine or self._random.random() * (mine_seen + theirs_seen) >= mine_seen):
+                pool = theirs
+                theirs_seen -= 1
+            else:
+                pool = mine
+                mine_seen -= 1
+            items.append(pool.pop(int(self._random.random() * len(pool))))
+        self.items = items
+        self.seen += other.seen
+
+    def get_state(self):
+        return {'size' : self.size, 'seen' : self.seen, 'items' : self.items}
+
+    @classmethod
+    def from_state(cls, state, seed=0):
+        sample = cls(state['size'], seed)
+        sample.items = list(state['items'])
+        sample.seen = state['seen']
+        return sample
+
+class TopK(object):
+    '''
+    The `k` items with the largest weights seen so far, kept in a min-heap of at most `k` entries.
+
+    Adding an item that is not larger than the smallest one kept is a single comparison.
+    '''
+    def __init__(self, k):
+        self.k = k
+        self._heap = []
+        # ties are broken by insertion order, so items themselves are never compared
+        self._counter = 0
+
+    def add(self, weight, item):
+        heap = self._heap
+        if len(heap) < self.k:
+            self._counter += 1
+            heapq.heappush(heap, (weight, -self._counter, item))
+        elif weight > heap[0][0]:
+            self._counter += 1
+            heapq.heapreplace(heap, (weight, -self._counter, item))
+
+    def min_weight(self):
+        '''Returns the weight an item must exceed to be kept, or None while fewer than `k` items are kept'''
+        if len(self._heap) < self.k:
+            return None
+        return self._heap[0][0]
+
+    def items(self):
+        '''Returns (weight, item) pairs, largest first'''
+        return [(weight, item) for weight, order, item in sorted(self._heap, reverse=True)]
+
+    def merge(self, other):
+        for weight, item in other.items():
+            self.add(weight, item)
+
+    def get_state(self):
+        return {'k' : self.k, 'items' : [[weight, item] for weight, item in self.items()]}
+
+    @classmethod
+    def from_state(cls, state):
+        top = cls(state['k'])
+        for weight, item in state['items']:
+            top.add(weight, item)
+        return top
+
+class PrefixTrie(object):
+    '''
+    Bytes and key counts rolled up by key prefix, in at most about `max_nodes` nodes.
+
+    Keys are added as a list of path segments, e.g. ['user:', '*:', 'sessions'], and are
+    counted in the node of every prefix of that path. When the trie grows past `max_nodes`,
+    the subtrees holding the fewest bytes are dropped. Their bytes stay counted in their
+    ancestors, so the totals of the prefixes that are kept remain exact up to that point.
+    '''
+    def __init__(self, max_nodes=10000):
+        self.max_nodes = max_nodes
+        # a node is [bytes, keys, children]
+        self.root = [0, 0, {}]
+        self.nodes = 0
+        # subtrees holding at most this many bytes have been pruned at least once
+        self.pruned_below = 0
+
+    def add(self, path, weight, count=1):
+        node = self.root
+        node[0] += weight
+        node[1] += count
+        for segment in path:
+            children = node[2]
+            child = children.get(segment)
+            if child is None:
+                child = children[segment] = [0, 0, {}]
+                self.nodes += 1
+            child[0] += weight
+            child[1] += count
+            node = child
+        if self.nodes > self.max_nodes:
+            self.prune()
+
+    def prune(self):
+        '''Drops the smallest subtrees until at most half of `max_nodes` nodes are left'''
+        weights = []
+        stack = [self.root]
+        while stack:
+            for child in stack.pop()[2].values():
+                weights.append(child[0])
+                stack.append(child)
+        weights.sort()
+        keep = self.max_nodes // 2
+        if len(weights) <= keep:
+            return
+        # a child never holds more bytes than its parent, so whole subtrees fall below the threshold
+        threshold = weights[len(weights) - keep - 1]
+        self.pruned_below = max(self.pruned_below, threshold)
+        self.nodes = 0
+        stack = [self.root]
+        while stack:
+            children = stack.pop()[2]
+            for segment, child in list(children.items()):
+                if child[0] <= threshold:
+                    del children[segment]
+                else:
+                    self.nodes += 1
+                    stack.append(child)
+
+    def prefixes(self):
+        '''Yields (prefix, bytes, keys) for every node, parents before their children'''
+        stack = [(None, self.root)]
+        while stack:
+            prefix, node = stack.pop()
+            if node is not self.root:
+                yield prefix, node[0], node[1]
+            for segment, child in node[2].items():
+                stack.append((segment if prefix is None else prefix + segment, child))
+
+    def merge(self, other):
+        stack = [(self.root, other.root)]
+        while stack:
+            node, theirs = stack.pop()
+            node[0] += theirs[0]
+            node[1] += theirs[1]
+            children = node[2]
+            for segment, their_child in theirs[2].items():
+                child = children.get(segment)
+                if child is None:
+                    child = children[segment] = [0, 0, {}]
+                    self.nodes += 1
+                stack.append((child, their_child))
+        self.pruned_below = max(self.pruned_below, other.pruned_below)
+        if self.nodes > self.max_nodes:
+            self.prune()
+
+    def get_state(self):
+        def node_state(node):
+            return [node[0], node[1], dict((state_text(segment), node_state(child)) for segment, child in node[2].items())]
+        return {'max_nodes' : self.max_nodes, 'pruned_below' : self.pruned_below, 'root' : node_state(self.root)}
+
+    @classmethod
+    def from_state(cls, state):
+        trie = cls(state['max_nodes'])
+        def load_node(node_state):
+            nbytes, keys, children = node_state
+            trie.nodes += len(children)
+            return [nbytes, keys, dict((state_bytes(segment), load_node(child)) for segment, child in children.items())]
+        trie.root = load_node(state['root'])
+        trie.pruned_below = state['pruned_below']
+        return trie
+
+class SpaceSaving(object):
+    '''
+    Approximate heaviest items of a stream, see the Space-Saving algorithm of Metwally et al.
+
+    At most `capacity` items are tracked. An untracked item replaces the lightest tracked one
+    and inherits its weight, which is remembered as the error of the new item. An item whose
+    true weight is more than total / capacity is always tracked, and the reported weight of
+    an item is never more than `error` above its true weight.
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # item : [weight, error]
+        self.counters = {}
+        # (weight, item) of every tracked item. Weights only grow, so an entry is stale
+        # when it does not match the counter any more and is fixed up lazily
+        self._heap = []
+
+    def add(self, item, weight=1):
+        counters = self.counters
+        counter = counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+            return
+        if len(counters) < self.capacity:
+            counters[item] = [weight, 0]
+            heapq.heappush(self._heap, (weight, item))
+            return
+        heap = self._heap
+        while True:
+            lightest, evicted = heap[0]
+            current = counters[evicted][0]
+            if current == lightest:
+                break
+            heapq.heapreplace(heap, (current, evicted))
+        del counters[evicted]
+        counters[item] = [lightest + weight, lightest]
+        heapq.heapreplace(heap, (lightest + weight, item))
+
+    def items(self):
+        '''Returns (item, weight, error) tuples, heaviest first'''
+        return sorted(((item, weight, error) for item, (weight, error) in self.counters.items()),
+                      key=lambda entry: entry[1], reverse=True)
+
+    def min_weight(self):
+        '''Returns the largest weight an untracked item can have'''
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(weight for weight, error in self.counters.values())
+
+    def merge(self, other):
+        '''
+        Combines two sketches, see Agarwal et al., Mergeable Summaries. An item missing from
+        one of the sketches is counted with the weight it can at most have had there,
+        then the `capacity` heaviest items are kept.
+        '''
+        mine_min, theirs_min = self.min_weight(), other.min_weight()
+        counters = {}
+        for item in set(self.counters) | set(other.counters):
+            weight, error = self.counters.get(item, (mine_min, mine_min))
+            their_weight, their_error = other.counters.get(item, (theirs_min, theirs_min))
+            counters[item] = [weight + their_weight, error + their_error]
+        kept = sorted(counters, key=lambda item: counters[item][0], reverse=True)[:self.capacity]
+        self.counters = dict((item, counters[item]) for item in kept)
+        self._heap = [(weight, item) for item, (weight, error) in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def get_state(self):
+        return {'capacity' : self.capacity,
+                'counters' : [[state_text(item), weight, error] for item, weight, error in self.items()]}
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state['capacity'])
+        for item, weight, error in state['counters']:
+            sketch.counters[state_bytes(item)] = [weight, error]
+        sketch._heap = [(weight, item) for item, (weight, error) in sketch.counters.items()]
+        heapq.heapify(sketch._heap)
+        return sketch
@@ -0,0 +1,141 @@
+'''
+Memory records written to a SQLite database, for ad hoc queries such as
+
+    select prefix, sum(bytes) from keys where expiry is null group by prefix
+
+Rows are inserted with executemany in batches, inside one transaction per database,
+with journaling and fsyncs turned off. Indexes and summary views are created once
+all rows are loaded.
+'''
+import calendar
+import sqlite3
+
+from rdbtools.memprofiler import NamespaceAggregator, DEFAULT_DELIMITERS
+
+DEFAULT_BATCH_SIZE = 10000
+
+# The database is rebuilt from the rdb file whenever needed, so durability is not worth paying for
+PRAGMAS = (
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+)
+
+SCHEMA = (
+    "DROP VIEW IF EXISTS memory_by_database",
+    "DROP VIEW IF EXISTS memory_by_type",
+    "DROP VIEW IF EXISTS memory_by_prefix",
+    "DROP VIEW IF EXISTS memory_by_namespace",
+    "DROP TABLE IF EXISTS keys",
+    """CREATE TABLE keys (
+        database INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        key,
+        prefix TEXT,
+        namespace TEXT,
+        bytes INTEGER NOT NULL,
+        encoding TEXT NOT NULL,
+        num_elements INTEGER NOT NULL,
+        len_largest_element INTEGER NOT NULL,
+        expiry INTEGER
+    )""",
+)
+
+INDEXES = (
+    "CREATE INDEX keys_prefix ON keys (prefix)",
+    "CREATE INDEX keys_namespace ON keys (namespace)",
+    "CREATE INDEX keys_type ON keys (type, encoding)",
+    "CREATE INDEX keys_bytes ON keys (bytes)",
+    "CREATE INDEX keys_expiry ON keys (expiry)",
+)
+
+VIEWS = (
+    """CREATE VIEW memory_by_database AS
+        SELECT database, COUNT(*) AS keys, SUM(bytes) AS bytes,
+               SUM(expiry IS NULL) AS keys_without_expiry, SUM(CASE WHEN expiry IS NULL THEN bytes ELSE 0 END) AS bytes_without_expiry
+        FROM keys GROUP BY database""",
+    """CREATE VIEW memory_by_type AS
+        SELECT type, encoding, COUNT(*) AS keys, SUM(bytes) AS bytes, AVG(num_elements) AS avg_elements,
+               MAX(len_largest_element) AS len_largest_element
+        FROM keys GROUP BY type, encoding""",
+    """CREATE VIEW memory_by_prefix AS
+        SELECT prefix, COUNT(*) AS keys, SUM(bytes) AS bytes,
+               SUM(expiry IS NULL) AS keys_without_expiry, SUM(CASE WHEN expiry IS NULL THEN bytes ELSE 0 END) AS bytes_without_expiry
+        FROM keys GROUP BY prefix""",
+    """CREATE VIEW memory_by_namespace AS
+        SELECT namespace, COUNT(*) AS keys, SUM(bytes) AS bytes,
+               SUM(expiry IS NULL) AS keys_without_expiry, SUM(CASE WHEN expiry IS NULL THEN bytes ELSE 0 END) AS bytes_without_expiry
+        FROM keys GROUP BY namespace""",
+)
+
+def _text(value):
+    '''Keys are stored as text when they are valid utf-8, and as blobs otherwise'''
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return sqlite3.Binary(value)
+    return value
+
+class SqliteWriter():
+    '''
+    A reporter for MemoryCallback that stores every record in the table `keys` of the SQLite
+    database `filename`. Any previous table and views of the same names are replaced.
+
+    `prefix` is the part of the key before the first delimiter, and `namespace` is the key
+    with id-like parts replaced by *, see NamespaceAggregator. `expiry` is a unix timestamp.
+    '''
+    def __init__(self, filename, min_bytes = 0, min_elements = 0, delimiters = DEFAULT_DELIMITERS,
+                 batch_size = DEFAULT_BATCH_SIZE):
+        self._min_bytes = min_bytes
+        self._min_elements = min_elements
+        self._batch_size = batch_size
+        self._namespaces = NamespaceAggregator(delimiters = delimiters)
+        self._rows = []
+        self.rows = 0
+        # transactions are managed here, not by the sqlite3 module
+        self._connection = sqlite3.connect(filename, isolation_level = None)
+        for statement in PRAGMAS + SCHEMA:
+            self._connection.execute(statement)
+        self._connection.execute("BEGIN")
+
+    def next_record(self, record):
+        if record.bytes < self._min_bytes or record.size < self._min_elements:
+            return
+        path = self._namespaces.namespace(record.key)
+        expiry = record.expiry
+        if expiry is not None:
+            expiry = calendar.timegm(expiry.utctimetuple())
+        self._rows.append((record.database, record.type, _text(record.key), _text(path[0]), _text(b"".join(path)),
+                           int(record.bytes), record.encoding, record.size, record.len_largest_element, expiry))
+        if len(self._rows) >= self._batch_size:
+            self._insert()
+
+    def _insert(self):
+        if not self._rows:
+            return
+        self._connection.executemany("INSERT INTO keys VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._rows)
+        self.rows += len(self._rows)
+        self._rows = []
+
+    def flush(self):
+        if self._connection is None:
+            return
+        self._insert()
+        self._connection.execute("COMMIT")
+        self._connection.execute("BEGIN")
+
+    def end_rdb(self):
+        self._insert()
+        for statement in INDEXES + VIEWS:
+            self._connection.execute(statement)
+        self._connection.execute("COMMIT")
+        self._connection.execute("ANALYZE")
+        self.close()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
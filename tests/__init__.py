@@ -0,0 +1,26 @@
+import unittest
+
+TEST_MODULES = [
+    'tests.output_tests',
+    'tests.callbacks_tests',
+    'tests.parser_tests',
+    'tests.memprofiler_tests',
+    'tests.allocator_tests',
+    'tests.sketches_tests',
+    'tests.report_tests',
+    'tests.records_tests',
+    'tests.sqlite_tests',
+    'tests.resp_tests',
+    'tests.live_tests',
+    'tests.replication_tests',
+    'tests.instrument_tests',
+    'tests.pipeline_tests',
+    'tests.cluster_tests',
+]
+
+def all_tests():
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for name in TEST_MODULES:
+        suite.addTests(loader.loadTestsFromName(name))
+    return suite
@@ -0,0 +1,52 @@
+import unittest
+
+from rdbtools import MemoryCallback
+from rdbtools.allocator import JemallocAllocator, LibcAllocator, get_allocator, sds_header_size, TABLE_SIZE
+from tests.fixtures import dump_path
+from tests.memprofiler_tests import memory_records
+
+class AllocatorTestCase(unittest.TestCase):
+    def test_jemalloc_size_classes(self):
+        allocator = JemallocAllocator()
+        for size, allocated in ((0, 8), (1, 8), (8, 8), (9, 16), (100, 112), (128, 128), (129, 160),
+                                (200, 224), (256, 256), (257, 320), (1000, 1024), (1025, 1280), (4097, 5120)):
+            self.assertEqual(allocator.allocated(size), allocated, size)
+
+    def test_libc_chunks(self):
+        allocator = LibcAllocator(8)
+        for size, allocated in ((0, 32), (1, 32), (24, 32), (25, 48), (40, 48), (41, 64)):
+            self.assertEqual(allocator.allocated(size), allocated, size)
+        self.assertEqual(LibcAllocator(4).allocated(1), 16)
+
+    def test_table_matches_the_size_classes(self):
+        for allocator in (JemallocAllocator(), LibcAllocator()):
+            for size in (0, 1, 17, 4095, TABLE_SIZE - 1):
+                self.assertEqual(allocator.allocated(size), allocator.size_class(size))
+            # past the table, sizes are computed and still rounded up
+            for size in (TABLE_SIZE, TABLE_SIZE + 1, 10 ** 6 + 3):
+                self.assertTrue(allocator.allocated(size) >= size)
+        # a jemalloc size class is its own size class
+        allocator = JemallocAllocator()
+        for size in (TABLE_SIZE + 1, 10 ** 6 + 3):
+            self.assertEqual(allocator.allocated(allocator.allocated(size)), allocator.allocated(size))
+
+    def test_get_allocator(self):
+        self.assertEqual(get_allocator('flat', 8), None)
+        self.assertEqual(get_allocator(None, 8), None)
+        self.assertTrue(isinstance(get_allocator('jemalloc', 8), JemallocAllocator))
+        allocator = LibcAllocator()
+        self.assertTrue(get_allocator(allocator, 8) is allocator)
+        self.assertRaises(Exception, get_allocator, 'tcmalloc', 8)
+
+    def test_sds_headers(self):
+        self.assertEqual([sds_header_size(n) for n in (0, 255, 256, 65535, 65536, 1 << 32)], [3, 3, 5, 5, 9, 17])
+
+    def test_memory_of_every_key_is_rounded(self):
+        flat = dict((r.key, r.bytes) for r in memory_records(dump_path('keys_of_all_types.rdb')))
+        jemalloc = dict((r.key, r.bytes) for r in memory_records(dump_path('keys_of_all_types.rdb'), allocator='jemalloc'))
+        self.assertEqual(sorted(flat), sorted(jemalloc))
+        # a 3 byte string and its 4 bytes of sds header and terminator fit in an 8 byte block
+        callback = MemoryCallback(None, 64, allocator='jemalloc')
+        self.assertEqual(callback.sizeof_string(b'bye'), 8)
+        self.assertEqual(callback.sizeof_string(b'x' * 100), 112)
+        self.assertEqual(MemoryCallback(None, 64).sizeof_string(b'bye'), 3 + 8 + 1 + 8)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import unittest
+
+from rdbtools import RdbParser, JSONCallback, JSONLinesCallback, DiffCallback, ProtocolCallback, JDJSONCallback, FanOutCallback
+from rdbtools.callbacks import encode_key, encode_value, KeyEncoder, ChunkEncoder
+from rdbtools.parser import union_filters
+from tests.fixtures import dump_path, run_callback, string_dump
+
+class EncodingTestCase(unittest.TestCase):
+    def test_printable_ascii_is_quoted_as_is(self):
+        self.assertEqual(encode_key(b'user:1:name'), b'"user:1:name"')
+        self.assertEqual(encode_value(b'hello world'), b'"hello world"')
+
+    def test_numbers(self):
+        self.assertEqual(encode_key(42), b'"42"')
+        self.assertEqual(encode_value(42), b'42')
+        self.assertEqual(encode_value(1.5), b'1.5')
+
+    def test_escapes(self):
+        self.assertEqual(encode_value(b'a"b\\c\n\t'), b'"a\\"b\\\\c\\n\\t"')
+        self.assertEqual(encode_value(b'\x01'), b'"\\u0001"')
+
+    def test_utf8_is_escaped_as_unicode(self):
+        self.assertEqual(encode_value(u'h\xe9llo 中'.encode('utf-8')), b'"h\\u00e9llo \\u4e2d"')
+        self.assertEqual(encode_value(u'\U0001f600'.encode('utf-8')), b'"\\ud83d\\ude00"')
+
+    def test_invalid_utf8_is_escaped_byte_by_byte(self):
+        self.assertEqual(encode_value(b'\x00\x01\xfe\xff'), b'"\\u0000\\u0001\\u00fe\\u00ff"')
+
+def encode_chunks(value, size):
+    encoder = ChunkEncoder()
+    chunks = [encoder.encode(value[start:start + size]) for start in range(0, len(value), size)]
+    return b''.join(chunks) + encoder.end()
+
+CHUNKED_VALUES = [b'plain "quoted" \\ text\n', u'h\xe9llo 中文 \U0001f600'.encode('utf-8'),
+                  b'\xff\xfe binary', b'ascii then \xff', u'中'.encode('utf-8') + b' then \xfe',
+                  u'中文'.encode('utf-8')[:-1], b'\xe4\x41 invalid continuation', u'\xe9'.encode('utf-8') * 40]
+
+class ChunkEncoderTestCase(unittest.TestCase):
+    def test_same_output_as_encode_value(self):
+        for value in CHUNKED_VALUES:
+            for size in range(1, len(value) + 1):
+                self.assertEqual(encode_chunks(value, size), encode_value(value)[1:-1], (value, size))
+
+    def test_sequence_across_chunks(self):
+        value = b'ab' + u'中'.encode('utf-8') + b'cd'
+        encoder = ChunkEncoder()
+        # the sequence of 3 bytes is split after its first byte
+        self.assertEqual(encoder.encode(value[:3]), b'ab')
+        self.assertEqual(encoder.encode(value[3:]) + encoder.end(), b'\\u4e2dcd')
+
+    def test_binary_values_are_not_held(self):
+        encoder = ChunkEncoder()
+        self.assertEqual(encoder.encode(b'\xe4\xb8'), b'')
+        self.assertEqual(encoder.encode(b'\xff'), b'\\u00e4\\u00b8\\u00ff')
+        self.assertEqual(encoder.encode(b'\xe4'), b'\\u00e4')
+        self.assertEqual(encoder.end(), b'')
+
+    def test_callback_output_does_not_depend_on_the_chunk_size(self):
+        values = [(b'value:%d' % index, value * 20) for index, value in enumerate(CHUNKED_VALUES)]
+        dump = string_dump([(0, values)])
+        for factory in (JSONCallback, JSONLinesCallback, DiffCallback):
+            expected = run_callback(factory, dump)
+            for size in (32, 33, 100, 1000):
+                self.assertEqual(run_callback(factory, dump, string_chunk_size=size), expected, (factory, size))
+
+class KeyEncoderTestCase(unittest.TestCase):
+    def test_same_output_as_encode_key(self):
+        encoder = KeyEncoder()
+        for key in (b'plain', b'quo"te', u'\xe9'.encode('utf-8'), b'\xff', 7, b'x' * 1000):
+            self.assertEqual(encoder(key), encode_key(key))
+            self.assertEqual(encoder(key), encode_key(key))
+
+    def test_cache_is_bounded(self):
+        encoder = KeyEncoder(size=10)
+        for i in range(25):
+            encoder(b'key:%d' % i)
+            self.assertTrue(len(encoder._cache) <= 10)
+
+    def test_callbacks_free_their_cache_at_the_end_of_the_dump(self):
+        callback = JSONCallback(io.BytesIO())
+        other = JSONCallback(io.BytesIO())
+        self.assertFalse(callback._encode_key is other._encode_key)
+        parser = RdbParser(callback)
+        parser.parse(dump_path('bulk_keys.rdb'))
+        self.assertEqual(callback._encode_key._cache, {})
+        self.assertEqual(other._encode_key._cache, {})
+
+class JSONCallbackTestCase(unittest.TestCase):
+    def test_output_is_valid_json(self):
+        databases = json.loads(run_callback(JSONCallback, dump_path('keys_of_all_types.rdb')).decode('ascii'))
+        self.assertEqual(len(databases), 2)
+        keys = databases[0]
+        self.assertEqual(keys['str:plain'], 'hello "world"\n\t')
+        self.assertEqual(keys['str:int16'], 12345)
+        self.assertEqual(keys['str:utf8'], u'h\xe9llo 中文')
+        self.assertEqual(keys['list:linked'], ['a', 7, 'ccc'])
+        self.assertEqual(keys['hash:ht'], {'f1' : 'v1', 'f2' : 100})
+        self.assertEqual(keys['zset:skip'], {'z1' : 1.5, 'z2' : 3})
+        self.assertEqual(sorted(databases[1]), ['user:1:name', 'user:1:scores', 'user:2:name'])
+
+class JSONLinesCallbackTestCase(unittest.TestCase):
+    def test_one_object_per_key(self):
+        lines = run_callback(JSONLinesCallback, dump_path('keys_of_all_types.rdb')).decode('ascii').splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(len(records), 24)
+        by_key = dict((r['key'], r) for r in records)
+        self.assertEqual(by_key['str:exp']['value'], 'bye')
+        self.assertTrue(by_key['str:exp']['ttl'] > 0)
+        self.assertEqual(by_key['set:intset']['value'], [1, 2, 3, 40000])
+        self.assertEqual(by_key['hash:zip'], {'db' : 0, 'type' : 'hash', 'key' : 'hash:zip', 'ttl' : None,
+                                             'value' : {'hf1' : 'hv1', 'hf2' : 2}})
+        self.assertEqual(by_key['user:2:name']['db'], 2)
+
+    def test_same_values_as_json(self):
+        databases = json.loads(run_callback(JSONCallback, dump_path('bulk_keys.rdb')).decode('ascii'))
+        lines = run_callback(JSONLinesCallback, dump_path('bulk_keys.rdb')).decode('ascii').splitlines()
+        values = {}
+        for line in lines:
+            record = json.loads(line)
+            values[(record['db'], record['key'])] = record['value']
+        expected = {}
+        for db, keys in zip((0, 2), databases):
+            for key, value in keys.items():
+                expected[(db, key)] = value
+        self.assertEqual(values, expected)
+
+def read_commands(data):
+    '''The commands of a protocol stream, as lists of byte strings'''
+    stream = io.BytesIO(data)
+    commands = []
+    line = stream.readline()
+    while line:
+        args = []
+        for index in range(int(line[1:-2])):
+            length = int(stream.readline()[1:-2])
+            args.append(stream.read(length + 2)[:-2])
+        commands.append(args)
+        line = stream.readline()
+    return commands
+
+BINARY_DUMP = string_dump([(0, [(b'\xff\x00k', b'\x00\xfe\r\n'), (b'caf\xc3\xa9', b'x')]), (3, [(b'\r\n', b'\xff' * 200)])])
+
+class BinaryTestCase(unittest.TestCase):
+    def test_protocol_keeps_the_bytes(self):
+        self.assertEqual(read_commands(run_callback(ProtocolCallback, BINARY_DUMP)),
+                         [[b'SELECT', b'0'], [b'SET', b'\xff\x00k', b'\x00\xfe\r\n'], [b'SET', b'caf\xc3\xa9', b'x'],
+                          [b'SELECT', b'3'], [b'SET', b'\r\n', b'\xff' * 200]])
+        # streamed strings give the same bytes
+        self.assertEqual(run_callback(ProtocolCallback, BINARY_DUMP, string_chunk_size=7), run_callback(ProtocolCallback, BINARY_DUMP))
+
+    def test_protocol_has_every_value(self):
+        commands = read_commands(run_callback(ProtocolCallback, dump_path('keys_of_all_types.rdb')))
+        values = dict((c[1], c[2]) for c in commands if c[0] == b'SET')
+        self.assertEqual(values[b'str:plain'], b'hello "world"\n\t')
+        self.assertEqual(values[b'str:int16'], b'12345')
+        self.assertEqual(values[b'str:utf8'], u'h\xe9llo 中文'.encode('utf-8'))
+        self.assertEqual([c[2:] for c in commands if c[0] == b'RPUSH' and c[1] == b'list:linked'], [[b'a'], [b'7'], [b'ccc']])
+        records = [json.loads(line) for line in run_callback(JSONLinesCallback, dump_path('keys_of_all_types.rdb')).decode('ascii').splitlines()]
+        self.assertEqual(sorted(c[1] for c in commands if c[0] == b'EXPIREAT'),
+                         sorted(r['key'].encode('ascii') for r in records if r['ttl'] is not None))
+
+    def test_json_and_diff_escape_the_bytes(self):
+        databases = json.loads(run_callback(JSONCallback, BINARY_DUMP).decode('ascii'))
+        self.assertEqual(databases, [{u'\xff\x00k' : u'\x00\xfe\r\n', u'caf\xe9' : u'x'}, {u'\r\n' : u'\xff' * 200}])
+        lines = run_callback(DiffCallback, BINARY_DUMP).split(b'\r\n')
+        self.assertEqual(lines[:2], [b'db=0 "\\u00ff\\u0000k" -> "\\u0000\\u00fe\\r\\n"', b'db=0 "caf\\u00e9" -> "x"'])
+
+class FanOutCallbackTestCase(unittest.TestCase):
+    def test_every_output_gets_what_its_filters_match(self):
+        outputs = [(JSONCallback, {'types' : ['hash']}),
+                   (DiffCallback, {'keys' : 'user:.*'}),
+                   (JSONLinesCallback, {'dbs' : [2], 'types' : ['string', 'sortedset']}),
+                   (ProtocolCallback, None)]
+        streams = [io.BytesIO() for o in outputs]
+        fanout = FanOutCallback([(factory(out), filters) for (factory, filters), out in zip(outputs, streams)])
+        union = union_filters([filters for factory, filters in outputs])
+        RdbParser(fanout, filters=union).parse(dump_path('keys_of_all_types.rdb'))
+        for (factory, filters), out in zip(outputs, streams):
+            self.assertEqual(out.getvalue(), run_callback(factory, dump_path('keys_of_all_types.rdb'), filters=filters))
+
+    def test_streamed_strings_reach_callbacks_that_take_them_whole(self):
+        # JDJSONCallback has no set_begin, the fan out joins the chunks for it
+        dump = string_dump([(0, [(b'big', b'x' * 5000), (b'small', b'y')])])
+        json_out, jd_out = io.BytesIO(), io.BytesIO()
+        RdbParser(FanOutCallback([JSONCallback(json_out), JDJSONCallback(jd_out)]), string_chunk_size=100).parse_fd(io.BytesIO(dump))
+        self.assertEqual(json_out.getvalue(), run_callback(JSONCallback, dump))
+        self.assertEqual(jd_out.getvalue(), run_callback(JDJSONCallback, dump))
+
+class UnionFiltersTestCase(unittest.TestCase):
+    def test_union(self):
+        self.assertEqual(union_filters([{'dbs' : [0]}, {'dbs' : 2}]), {'dbs' : [0, 2]})
+        self.assertEqual(union_filters([{'keys' : 'a.*'}, {'keys' : 'b'}]), {'keys' : '(?:a.*)|(?:b)'})
+        self.assertEqual(union_filters([{'types' : ['hash']}, {'types' : 'set'}]), {'types' : ['hash', 'set']})
+
+    def test_an_unfiltered_axis_lets_everything_through(self):
+        self.assertEqual(union_filters([{'dbs' : [0], 'keys' : 'a'}, {'types' : ['set']}]), {})
+        self.assertEqual(union_filters([{'dbs' : [0]}, None]), {})
@@ -0,0 +1,85 @@
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+from rdbtools.cluster import run_nodes, node_names, expand_paths
+
+def node_size(path, node, factor):
+    '''A node function, that dies in the ways the name of its node says'''
+    if 'kill' in node:
+        os.kill(os.getpid(), signal.SIGKILL)
+    elif 'exit' in node:
+        os._exit(3)
+    elif 'fail' in node:
+        raise ValueError('bad node')
+    elif 'slow' in node:
+        time.sleep(60)
+    return os.path.getsize(path) * factor
+
+class RunNodesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # fail instead of hanging when a dead worker is not noticed
+        signal.alarm(60)
+
+    def tearDown(self):
+        signal.alarm(0)
+        shutil.rmtree(self.directory)
+
+    def dumps(self, *names):
+        paths = []
+        for index, name in enumerate(names):
+            path = os.path.join(self.directory, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * (index + 1))
+            paths.append(path)
+        return paths
+
+    def results(self, paths, processes):
+        return dict((r.node, r) for r in run_nodes(node_size, paths, (10,), processes))
+
+    def test_every_node_has_a_result(self):
+        paths = self.dumps('a.rdb', 'b.rdb', 'fail.rdb', 'c.rdb')
+        for processes in (1, 2, 8):
+            results = self.results(paths, processes)
+            self.assertEqual(sorted(results), ['a.rdb', 'b.rdb', 'c.rdb', 'fail.rdb'])
+            self.assertEqual([results[name].result for name in ('a.rdb', 'b.rdb', 'c.rdb')], [10, 20, 40])
+            self.assertEqual(results['a.rdb'].file_bytes, 1)
+            self.assertEqual((results['fail.rdb'].result, results['fail.rdb'].error), (None, 'ValueError : bad node'))
+
+    def test_dead_workers_are_reported(self):
+        paths = self.dumps('a.rdb', 'kill.rdb', 'b.rdb', 'exit.rdb', 'c.rdb', 'd.rdb')
+        results = self.results(paths, 2)
+        self.assertEqual(len(results), 6)
+        self.assertEqual([results[name].result for name in ('a.rdb', 'b.rdb', 'c.rdb', 'd.rdb')], [10, 30, 50, 60])
+        self.assertEqual(results['kill.rdb'].error, 'WorkerDied : the worker process was killed by signal %d' % signal.SIGKILL)
+        self.assertEqual(results['exit.rdb'].error, 'WorkerDied : the worker process exited with code 3')
+        self.assertEqual((results['kill.rdb'].result, results['kill.rdb'].file_bytes), (None, None))
+
+    def test_workers_are_stopped_when_the_results_are_not_all_read(self):
+        paths = self.dumps('a.rdb', 'slow1.rdb', 'slow2.rdb')
+        start = time.time()
+        results = run_nodes(node_size, paths, (1,), 3)
+        self.assertEqual(next(results).node, 'a.rdb')
+        results.close()
+        self.assertTrue(time.time() - start < 30)
+
+class PathsTestCase(unittest.TestCase):
+    def test_node_names(self):
+        self.assertEqual(node_names(['/a/dump-7000.rdb', '/b/dump-7001.rdb']), ['dump-7000.rdb', 'dump-7001.rdb'])
+        self.assertEqual(node_names(['/x/node1/dump.rdb', '/x/node2/dump.rdb']), [os.path.join('node1', 'dump.rdb'), os.path.join('node2', 'dump.rdb')])
+
+    def test_expand_paths(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ('b.rdb', 'a.rdb', 'c.txt'):
+                open(os.path.join(directory, name), 'w').close()
+            pattern = os.path.join(directory, '*.rdb')
+            self.assertEqual(expand_paths([pattern, os.path.join(directory, 'a.rdb')]),
+                             [os.path.join(directory, 'a.rdb'), os.path.join(directory, 'b.rdb')])
+            self.assertRaises(Exception, expand_paths, [os.path.join(directory, '*.none')])
+        finally:
+            shutil.rmtree(directory)
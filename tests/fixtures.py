@@ -0,0 +1,47 @@
+import io
+import os
+import struct
+
+DUMPS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dumps')
+
+def dump_path(name):
+    return os.path.join(DUMPS, name)
+
+def read_dump(name):
+    with open(dump_path(name), 'rb') as f:
+        return f.read()
+
+def encode_length(n):
+    if n < 64:
+        return struct.pack('B', n)
+    elif n < 16384:
+        return struct.pack('BB', 0x40 | (n >> 8), n & 0xFF)
+    return b'\x80' + struct.pack('>I', n)
+
+def encode_string(s):
+    return encode_length(len(s)) + s
+
+def string_dump(databases):
+    '''
+    A version 6 dump of string keys, for the cases the fixture files do not cover.
+    `databases` is a list of (db number, [(key, value), ...]), keys and values are byte strings.
+    '''
+    out = [b'REDIS0006']
+    for db_number, pairs in databases:
+        out.append(b'\xfe' + encode_length(db_number))
+        for key, value in pairs:
+            out.append(b'\x00' + encode_string(key) + encode_string(value))
+    out.append(b'\xff' + b'\x00' * 8)
+    return b''.join(out)
+
+def run_callback(factory, source, **kwargs):
+    '''The output of the callback made by `factory` over the dump `source`, a file name or bytes'''
+    from rdbtools import RdbParser
+    out = io.BytesIO()
+    parser = RdbParser(factory(out), **kwargs)
+    # file names are byte strings too on python 2
+    if isinstance(source, bytes) and source.startswith(b'REDIS'):
+        parser.parse_fd(io.BytesIO(source))
+    else:
+        parser.parse(source)
+    return out.getvalue()
@@ -0,0 +1,100 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from rdbtools import RdbParser, JSONCallback
+from rdbtools.instrument import InstrumentedParser, KeyMemoryProfile, tracemalloc
+from tests.fixtures import dump_path, read_dump, run_callback, string_dump
+from tests.parser_tests import Recorder, ReadOnly
+from tests.report_tests import ROOT
+
+def instrumented(source, threshold, callback = None, top = 20):
+    '''The profile and the output of an InstrumentedParser over `source`, a file name or a stream'''
+    out = io.BytesIO()
+    profile = KeyMemoryProfile(threshold, top)
+    parser = InstrumentedParser(callback if callback is not None else JSONCallback(out), profile=profile)
+    if isinstance(source, str):
+        parser.parse(source)
+    else:
+        parser.parse_fd(source)
+    return profile, out.getvalue()
+
+def serialized_sizes(path):
+    return dict((entry.key, entry.raw_size) for entry in RdbParser.iter_keys(path))
+
+class InstrumentedParserTestCase(unittest.TestCase):
+    def test_output_is_unchanged(self):
+        for name in ('keys_of_all_types.rdb', 'bulk_keys.rdb'):
+            expected = run_callback(JSONCallback, dump_path(name))
+            for threshold in (0, 150, 1 << 30):
+                self.assertEqual(instrumented(dump_path(name), threshold)[1], expected, (name, threshold))
+                self.assertEqual(instrumented(ReadOnly(read_dump(name)), threshold)[1], expected, (name, threshold))
+
+    def test_totals(self):
+        sizes = serialized_sizes(dump_path('bulk_keys.rdb'))
+        # a seekable file sizes the values by skipping them, a stream by counting what is read
+        for source in (dump_path('bulk_keys.rdb'), ReadOnly(read_dump('bulk_keys.rdb'))):
+            profile = instrumented(source, 150, top=1000)[0]
+            self.assertEqual(profile.keys, len(sizes))
+            self.assertEqual(profile.serialized, sum(sizes.values()))
+            self.assertEqual(profile.traced, len([size for size in sizes.values() if size >= 150]))
+            self.assertEqual(sorted((record.key, record.serialized) for weight, record in profile.top.items()),
+                             sorted((key, size) for key, size in sizes.items() if size >= 150))
+            self.assertEqual(sum(stats[0] for stats in profile.encodings.values()), profile.traced)
+
+    def test_decoded_sizes(self):
+        dump = string_dump([(0, [(b'small', b'x' * 10), (b'big', b'y' * 5000)])])
+        profile = instrumented(io.BytesIO(dump), 1000)[0]
+        self.assertEqual((profile.keys, profile.traced, profile.decoded), (2, 1, 5010))
+        record = profile.top.items()[0][1]
+        self.assertEqual((record.database, record.type, record.key, record.encoding, record.decoded),
+                         (0, 'string', b'big', 'string', 5000))
+        # integers and scores count for 8 bytes, only the values the callback takes are counted
+        profile = instrumented(dump_path('keys_of_all_types.rdb'), 0, callback=Recorder())[0]
+        intset = [record for weight, record in profile.top.items() if record.key == b'set:intset'][0]
+        self.assertEqual(intset.decoded, 4 * 8)
+
+    def test_peaks(self):
+        dump = string_dump([(0, [(b'small', b'x' * 10), (b'big', b'y' * 100000)])])
+        profile = instrumented(io.BytesIO(dump), 1000, callback=Recorder())[0]
+        peak = profile.top.items()[0][1].peak
+        if tracemalloc is None:
+            self.assertEqual((peak, profile.max_peak), (None, None))
+        else:
+            # the whole value is given to the callback, which keeps it
+            self.assertTrue(peak >= 100000, peak)
+            self.assertEqual(profile.max_peak, peak)
+            self.assertFalse(tracemalloc.is_tracing())
+
+    def test_report(self):
+        profile = instrumented(dump_path('bulk_keys.rdb'), 150, top=3)[0]
+        out = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+        profile.report(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'keys : 324, traced : %d of at least 150 serialized bytes' % profile.traced)
+        self.assertEqual(lines[5], 'encoding,keys,serialized,decoded,max_peak')
+        ranks = lines[lines.index('rank,database,type,key,encoding,serialized,decoded,peak') + 1:]
+        self.assertEqual([line.split(',')[0] for line in ranks], ['1', '2', '3'])
+
+class InstrumentOptionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_report_file(self):
+        path = dump_path('keys_of_all_types.rdb')
+        report = os.path.join(self.directory, 'instrument.txt')
+        expected = subprocess.check_output([sys.executable, '-m', 'rdbtools.cli.rdb', '-c', 'json', path], cwd=ROOT)
+        output = subprocess.check_output([sys.executable, '-m', 'rdbtools.cli.rdb', '-c', 'json', '--instrument', '100',
+                                          '--instrument-top', '2', '--instrument-file', report, path], cwd=ROOT)
+        self.assertEqual(output, expected)
+        with open(report) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines[0].startswith('keys : 24, traced : '), lines[0])
+        self.assertEqual(len(lines) - lines.index('rank,database,type,key,encoding,serialized,decoded,peak') - 1, 2)
@@ -0,0 +1,199 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import json
+import unittest
+
+from rdbtools import RdbParser, MemoryCallback
+from rdbtools import live
+from rdbtools.live import sample_memory, sample_size, RateLimiter, SAMPLE_SCAN, SAMPLE_RANDOMKEY
+from rdbtools.resp import RespConnection
+from tests.fixtures import dump_path
+from tests.memprofiler_tests import Lines
+from tests.report_tests import ROOT
+from tests.standin import StandinServer
+
+def run(module, *args):
+    return subprocess.check_output([sys.executable, '-m', module] + list(args), cwd=ROOT).decode('utf-8')
+
+def csv_rows(text, db = None):
+    '''The rows of a memory csv, of database `db` only when it is given'''
+    lines = text.splitlines()
+    assert lines[0] == 'database,type,key,size_in_bytes,encoding,num_elements,len_largest_element'
+    return sorted(line for line in lines[1:] if db is None or line.startswith('%d,' % db))
+
+class MemoryForKeysTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_match_is_the_same_as_the_memory_command(self):
+        path = dump_path('bulk_keys.rdb')
+        expected = run('rdbtools.cli.rdb', '-c', 'memory', path)
+        with StandinServer(path) as server:
+            for db in (0, 2):
+                output = os.path.join(self.directory, 'db%d.csv' % db)
+                run('rdbtools.cli.redis_memory_for_key', '-p', str(server.port), '-d', str(db),
+                    '--match', '*', '--window', '7', '-f', output)
+                with open(output) as f:
+                    rows = csv_rows(f.read())
+                self.assertEqual(rows, csv_rows(expected, db))
+                self.assertTrue(len(rows) > 7)
+            dumped = [args[1] for args in server.commands if args[0] == b'DUMP']
+            self.assertEqual(sorted(dumped), sorted(server.keys(0) + server.keys(2)))
+
+    def test_keys_and_patterns(self):
+        path = dump_path('keys_of_all_types.rdb')
+        keys_file = os.path.join(self.directory, 'keys.txt')
+        with open(keys_file, 'wb') as f:
+            f.write(b'hash:zip\r\nmissing\n\nlist:zip\n')
+        with StandinServer(path) as server:
+            process = subprocess.Popen([sys.executable, '-m', 'rdbtools.cli.redis_memory_for_key', '-p', str(server.port),
+                                        '--keys-file', keys_file, '--match', 'set:*', '-w', '2', 'str:exp'],
+                                       cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = process.communicate()
+        self.assertEqual(process.returncode, 0)
+        expected = [row for row in csv_rows(run('rdbtools.cli.rdb', '-c', 'memory', path), 0)
+                    if row.split(',')[2] in ('"str:exp"', '"hash:zip"', '"list:zip"', '"set:ht"', '"set:intset"', '"set:intset16"')]
+        self.assertEqual(csv_rows(out.decode('utf-8')), expected)
+        self.assertEqual(err.decode('utf-8'), 'Key "missing" does not exist\n')
+
+    def test_single_key(self):
+        with StandinServer(dump_path('keys_of_all_types.rdb')) as server:
+            lines = run('rdbtools.cli.redis_memory_for_key', '-p', str(server.port), 'zset:skip').splitlines()
+        self.assertEqual(lines[0].split(), ['Key', '"zset:skip"'])
+        self.assertEqual(float(lines[1].split()[1]), 523)
+        self.assertEqual(lines[3].split(), ['Encoding', 'skiplist'])
+
+    def test_newer_servers(self):
+        # servers from 3.2 on write DUMP payloads of rdb version 7 and later
+        path = dump_path('keys_of_all_types.rdb')
+        output = os.path.join(self.directory, 'db0.csv')
+        with StandinServer(path, redis_version='7.2.4', dump_version=11) as server:
+            run('rdbtools.cli.redis_memory_for_key', '-p', str(server.port), '--match', '*', '-f', output)
+            lines = run('rdbtools.cli.redis_memory_for_key', '-p', str(server.port), 'zset:skip').splitlines()
+        with open(output) as f:
+            self.assertEqual(csv_rows(f.read()), csv_rows(run('rdbtools.cli.rdb', '-c', 'memory', path), 0))
+        self.assertEqual(float(lines[1].split()[1]), 523)
+
+class Totals(object):
+    def __init__(self):
+        self.bytes = 0
+        self.types = {}
+
+    def next_record(self, record):
+        self.bytes += record.bytes
+        self.types[record.type] = self.types.get(record.type, 0) + 1
+
+def totals(path, db):
+    totals = Totals()
+    RdbParser(MemoryCallback(totals, 64), filters={'dbs' : [db]}).parse(path)
+    return totals
+
+def sampled_commands(server):
+    '''The number of commands the sampling sent to `server`'''
+    return len([args for args in server.commands if args[0] in (b'SCAN', b'RANDOMKEY', b'DUMP', b'PTTL')])
+
+class RecordingLimiter(object):
+    '''A RateLimiter that checks every command was acquired before it was sent to `server`'''
+    def __init__(self, server):
+        self.server = server
+        self.acquired = 0
+
+    def acquire(self, ops):
+        # the replies to the commands sent so far have been read, so the server has them all
+        assert self.acquired >= sampled_commands(self.server), (self.acquired, sampled_commands(self.server))
+        self.acquired += ops
+
+class SampleMemoryTestCase(unittest.TestCase):
+    def test_scanning_every_key_is_exact(self):
+        expected = totals(dump_path('bulk_keys.rdb'), 2)
+        with StandinServer(dump_path('bulk_keys.rdb')) as server:
+            with RespConnection(port=server.port, db=2) as redis:
+                result = sample_memory(redis, samples=10000, method=SAMPLE_SCAN, max_ops=0, window=9, db=2)
+        self.assertEqual(result['samples'], 303)
+        self.assertEqual(result['dbsize'], 303)
+        self.assertEqual(result['scale'], 1.0)
+        estimate = result['estimates']['bytes']
+        self.assertAlmostEqual(estimate['estimate'], expected.bytes)
+        # the whole database was read, there is nothing left to estimate
+        self.assertAlmostEqual(estimate['low'], estimate['high'])
+        self.assertEqual(dict((t, e['keys']['estimate']) for t, e in result['estimates']['types'].items()), expected.types)
+
+    def test_random_sample_interval_holds_the_total(self):
+        expected = totals(dump_path('bulk_keys.rdb'), 2)
+        with StandinServer(dump_path('bulk_keys.rdb')) as server:
+            with RespConnection(port=server.port, db=2) as redis:
+                result = sample_memory(redis, samples=200, method=SAMPLE_RANDOMKEY, max_ops=0, db=2)
+        self.assertEqual(result['samples'], 200)
+        estimate = result['estimates']['bytes']
+        self.assertTrue(estimate['low'] <= expected.bytes <= estimate['high'], (estimate, expected.bytes))
+        self.assertEqual(sum(result['stats'].aggregates['type_count'].values()), 200)
+        self.assertEqual(list(result['stats'].aggregates['database_memory']), [2])
+
+    def test_command(self):
+        with StandinServer(dump_path('bulk_keys.rdb')) as server:
+            result = json.loads(run('rdbtools.cli.redis_sample_profiler', '-p', str(server.port), '-d', '2', '--samples', '50',
+                                    '--max-ops', '0', '--method', 'scan'))
+        self.assertEqual((result['samples'], result['method']), (50, 'scan'))
+        self.assertTrue(result['estimates']['bytes']['estimate'] > 0)
+        self.assertTrue('string_memory' in result['histograms'])
+
+    def test_newer_servers(self):
+        expected = totals(dump_path('bulk_keys.rdb'), 2)
+        with StandinServer(dump_path('bulk_keys.rdb'), redis_version='7.2.4', dump_version=11) as server:
+            with RespConnection(port=server.port, db=2) as redis:
+                result = sample_memory(redis, samples=10000, method=SAMPLE_SCAN, max_ops=0, db=2)
+        self.assertEqual(result['samples'], 303)
+        self.assertAlmostEqual(result['estimates']['bytes']['estimate'], expected.bytes)
+
+    def test_keys_that_cannot_be_parsed_are_skipped(self):
+        stderr = sys.stderr
+        with StandinServer(dump_path('bulk_keys.rdb')) as server:
+            broken = server.keys(2)[5]
+            # an object type no version of redis has
+            server.databases[2][broken] = (b'\x63' + server.databases[2][broken][0][1:], -1)
+            sys.stderr = Lines()
+            try:
+                with RespConnection(port=server.port, db=2) as redis:
+                    result = sample_memory(redis, samples=10000, method=SAMPLE_SCAN, max_ops=0, window=9, db=2)
+            finally:
+                lines, sys.stderr = sys.stderr.lines, stderr
+        self.assertEqual(result['samples'], 302)
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith('Could not parse key "%s" : ' % broken.decode('ascii')), lines[0])
+
+    def test_every_command_is_within_the_budget(self):
+        for method, samples in ((SAMPLE_SCAN, 50), (SAMPLE_SCAN, 1000), (SAMPLE_RANDOMKEY, 50)):
+            with StandinServer(dump_path('bulk_keys.rdb')) as server:
+                limiter = RecordingLimiter(server)
+                with RespConnection(port=server.port, db=2) as redis:
+                    live.RateLimiter = lambda max_ops: limiter
+                    try:
+                        sample_memory(redis, samples=samples, method=method, window=7, db=2)
+                    finally:
+                        live.RateLimiter = RateLimiter
+                self.assertEqual(limiter.acquired, sampled_commands(server), (method, samples))
+                self.assertTrue(limiter.acquired >= 2 * min(samples, 303), (method, samples))
+
+    def test_sample_size(self):
+        self.assertEqual(sample_size(10 ** 9), 9604)
+        self.assertEqual(sample_size(100), 99)
+        self.assertEqual(sample_size(0), 0)
+        self.assertTrue(sample_size(10000) < 9604)
+
+    def test_rate_limiter(self):
+        now = [0.0]
+        sleeps = []
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+        limiter = RateLimiter(100, clock=lambda: now[0], sleep=sleep)
+        for i in range(5):
+            limiter.acquire(10)
+        # 10 operations take a tenth of a second at 100 per second
+        self.assertEqual([round(s, 6) for s in sleeps], [0.1] * 4)
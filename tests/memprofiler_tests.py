@@ -0,0 +1,216 @@
+import io
+import json
+import unittest
+
+from rdbtools import RdbParser, MemoryCallback, PrintAllKeys, TopKeysReport, NamespaceAggregator, StatsAggregator, BoundedStatsAggregator, \
+    merge_states
+from rdbtools.memprofiler import SKIPLIST_MODEL_EXPECTED, SKIPLIST_MODEL_SIMULATED, load_state
+from tests.fixtures import dump_path, string_dump
+
+class Records(object):
+    '''A stream that keeps the records MemoryCallback gives it'''
+    def __init__(self):
+        self.records = []
+
+    def next_record(self, record):
+        self.records.append(record)
+
+class Lines(object):
+    '''A text stream that keeps the lines written to it'''
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.extend(text.splitlines())
+
+    def flush(self):
+        pass
+
+def memory_records(path, **kwargs):
+    stream = Records()
+    RdbParser(MemoryCallback(stream, 64, **kwargs)).parse(path)
+    return stream.records
+
+def by_key(records):
+    return dict((r.key, r) for r in records)
+
+class MemoryCallbackTestCase(unittest.TestCase):
+    def test_every_key_has_a_record(self):
+        records = memory_records(dump_path('keys_of_all_types.rdb'))
+        self.assertEqual(len(records), 24)
+        keys = by_key(records)
+        self.assertEqual(keys[b'list:zip'].encoding, 'ziplist')
+        self.assertEqual(keys[b'list:zip'].size, 8)
+        self.assertEqual(keys[b'set:intset'].encoding, 'intset')
+        self.assertEqual(keys[b'hash:ht'].type, 'hash')
+        self.assertEqual(keys[b'user:2:name'].database, 2)
+        self.assertTrue(all(r.bytes > 0 for r in records))
+
+class PrintAllKeysTestCase(unittest.TestCase):
+    def print_all_keys(self, **kwargs):
+        out = io.BytesIO()
+        reporter = PrintAllKeys(out, **kwargs)
+        RdbParser(MemoryCallback(reporter, 64)).parse(dump_path('keys_of_all_types.rdb'))
+        reporter.flush()
+        lines = out.getvalue().decode('ascii').splitlines()
+        self.assertEqual(lines[0], 'database,type,key,size_in_bytes,encoding,num_elements,len_largest_element')
+        return [line.split(',') for line in lines[1:]]
+
+    def test_a_row_per_key(self):
+        rows = self.print_all_keys()
+        records = memory_records(dump_path('keys_of_all_types.rdb'))
+        self.assertEqual([row[2] for row in rows], ['"%s"' % r.key.decode('ascii') for r in records])
+        self.assertEqual([int(row[3]) for row in rows], [int(r.bytes) for r in records])
+
+    def test_thresholds(self):
+        records = memory_records(dump_path('keys_of_all_types.rdb'))
+        rows = self.print_all_keys(min_bytes=150, min_elements=3)
+        expected = ['"%s"' % r.key.decode('ascii') for r in records if r.bytes >= 150 and r.size >= 3]
+        self.assertTrue(0 < len(expected) < len(records))
+        self.assertEqual([row[2] for row in rows], expected)
+
+class SkiplistModelTestCase(unittest.TestCase):
+    def sorted_set_bytes(self, records):
+        return sum(r.bytes for r in records if r.encoding == 'skiplist')
+
+    def test_expected_model_does_not_depend_on_the_seed(self):
+        first = memory_records(dump_path('bulk_keys.rdb'), seed=1)
+        second = memory_records(dump_path('bulk_keys.rdb'), seed=2)
+        self.assertEqual(first, second)
+
+    def test_simulated_model_is_reproducible(self):
+        first = memory_records(dump_path('bulk_keys.rdb'), skiplist_model=SKIPLIST_MODEL_SIMULATED, seed=3)
+        second = memory_records(dump_path('bulk_keys.rdb'), skiplist_model=SKIPLIST_MODEL_SIMULATED, seed=3)
+        self.assertEqual(first, second)
+
+    def test_expected_model_is_the_mean_of_the_simulated_one(self):
+        expected = self.sorted_set_bytes(memory_records(dump_path('bulk_keys.rdb')))
+        simulated = [self.sorted_set_bytes(memory_records(dump_path('bulk_keys.rdb'), skiplist_model=SKIPLIST_MODEL_SIMULATED, seed=seed))
+                     for seed in range(10)]
+        mean = float(sum(simulated)) / len(simulated)
+        self.assertTrue(abs(mean - expected) < 0.01 * expected, (mean, expected))
+        # the other types do not depend on the model
+        other = [r for r in memory_records(dump_path('bulk_keys.rdb')) if r.encoding != 'skiplist']
+        self.assertEqual(other, [r for r in memory_records(dump_path('bulk_keys.rdb'), skiplist_model=SKIPLIST_MODEL_SIMULATED)
+                                 if r.encoding != 'skiplist'])
+
+    def test_expected_node_size(self):
+        for allocator in ('flat', 'jemalloc', 'libc'):
+            callback = MemoryCallback(Records(), 64, seed=5, allocator=allocator)
+            n = 50000
+            mean = sum(callback.skiplist_node_size(callback.zset_random_level()) for i in range(n)) / float(n)
+            expected = callback.expected_skiplist_node_size()
+            self.assertTrue(abs(mean - expected) < 0.01 * expected, (allocator, mean, expected))
+
+    def test_invalid_model(self):
+        self.assertRaises(Exception, MemoryCallback, Records(), 64, skiplist_model='exact')
+
+class IntegerSizeTestCase(unittest.TestCase):
+    def test_integers_and_their_strings_have_the_same_size(self):
+        callback = MemoryCallback(Records(), 64)
+        for value in (0, 9999, 10000, -1, 1 << 40, (1 << 63) - 1):
+            self.assertEqual(callback.sizeof_string(value), callback.sizeof_string(str(value).encode('ascii')), value)
+        self.assertEqual(callback.sizeof_string(5), 0)
+        self.assertEqual(callback.sizeof_string(10000), 8)
+        self.assertEqual(callback.sizeof_string(b'01'), callback.sizeof_raw_string(2))
+
+class TopKeysReportTestCase(unittest.TestCase):
+    def test_rankings(self):
+        records = memory_records(dump_path('bulk_keys.rdb'))
+        report = TopKeysReport(None, k=5)
+        for record in records:
+            report.next_record(record)
+        rankings = report.get_report()
+        self.assertEqual([r['bytes'] for r in rankings['all']['bytes']], sorted((r.bytes for r in records), reverse=True)[:5])
+        self.assertEqual([r['num_elements'] for r in rankings['type:hash']['elements']],
+                         sorted((r.size for r in records if r.type == 'hash'), reverse=True)[:5])
+        self.assertEqual(sorted(rankings), ['all', 'db:0', 'db:2', 'type:hash', 'type:list', 'type:set', 'type:sortedset', 'type:string'])
+        self.assertEqual(len(report.get_report(max_rows=2)['all']['bytes']), 2)
+
+    def test_csv_is_written_at_the_end_of_the_dump(self):
+        out = io.BytesIO()
+        report = TopKeysReport(out, k=3)
+        RdbParser(MemoryCallback(report, 64)).parse(dump_path('keys_of_all_types.rdb'))
+        lines = out.getvalue().decode('ascii').splitlines()
+        self.assertEqual(lines[0], 'scope,rank_by,rank,database,type,key,size_in_bytes,encoding,num_elements,len_largest_element')
+        self.assertEqual(lines[1], 'all,bytes,1,2,sortedset,"user:1:scores",655,skiplist,3,2')
+        # 3 rankings of at most 3 keys for everything, 5 types and 2 databases, there are only 2 lists
+        self.assertEqual(len(lines) - 1, 3 * 3 * (1 + 5 + 2) - 3)
+
+    def test_alerts(self):
+        records = memory_records(dump_path('keys_of_all_types.rdb'))
+        alerts = Lines()
+        report = TopKeysReport(None, k=3, alert_bytes=300, alert_elements=8, alerts=alerts)
+        for record in records:
+            report.next_record(record)
+        big = [r.key.decode('ascii') for r in records if r.bytes >= 300 or r.size >= 8]
+        self.assertTrue(0 < len(big) < len(records))
+        self.assertEqual([line.split(' key=')[1].split()[0] for line in alerts.lines], ['"%s"' % key for key in big])
+
+class NamespaceAggregatorTestCase(unittest.TestCase):
+    def test_ids_are_replaced(self):
+        namespaces = NamespaceAggregator()
+        self.assertEqual(namespaces.namespace(b'user:42:sessions'), [b'user:', b'*:', b'sessions'])
+        self.assertEqual(namespaces.namespace(b'cache:0f3a9c2e-77b1:page'), [b'cache:', b'*:', b'page'])
+        self.assertEqual(namespaces.namespace(b'cache:deadbeef:x'), [b'cache:', b'deadbeef:', b'x'])
+        self.assertEqual(namespaces.namespace(b'plain'), [b'plain'])
+        self.assertEqual(NamespaceAggregator(delimiters=':/').namespace(b'a/1:b'), [b'a/', b'*:', b'b'])
+
+    def test_prefixes_and_groups(self):
+        records = memory_records(dump_path('keys_of_all_types.rdb'))
+        namespaces = NamespaceAggregator(key_groupings=['user:', 'str:'])
+        for record in records:
+            namespaces.next_record(record)
+        report = namespaces.get_namespaces()
+        prefixes = dict((p['prefix'], (p['bytes'], p['keys'])) for p in report['prefixes'])
+        users = [r for r in records if r.key.startswith(b'user:')]
+        self.assertEqual(prefixes['user:'], (sum(r.bytes for r in users), 3))
+        self.assertEqual(prefixes['user:*:'][1], 3)
+        self.assertEqual(prefixes['user:*:name'][1], 2)
+        self.assertEqual(report['groups']['user:'], {'bytes' : sum(r.bytes for r in users), 'keys' : 3})
+        self.assertEqual(report['groups']['str:']['keys'], 11)
+        self.assertEqual(report['groups']['other']['keys'], len(records) - 14)
+        # there are fewer namespaces than heavy hitters, so they are all exact
+        self.assertEqual(dict((h['namespace'], h['bytes']) for h in report['heavy_hitters'] if h['namespace'].startswith('user:')),
+                         {'user:*:name' : users[0].bytes + users[1].bytes, 'user:*:scores' : users[2].bytes})
+        self.assertEqual(sum(h['error'] for h in report['heavy_hitters']), 0)
+
+class StateTestCase(unittest.TestCase):
+    dumps = [dump_path('keys_of_all_types.rdb'), dump_path('bulk_keys.rdb'),
+             io.BytesIO(string_dump([(0, [(b'user:1:name', b'a'), (b'\xff\xfe:1', b'b' * 100), (b'caf\xc3\xa9:2', b'c')])]))]
+
+    def profile(self, factory):
+        aggregators = []
+        for dump in self.dumps:
+            stats = factory()
+            parser = RdbParser(MemoryCallback(stats, 64))
+            if hasattr(dump, 'seek'):
+                dump.seek(0)
+                parser.parse_fd(dump)
+            else:
+                parser.parse(dump)
+            aggregators.append(stats)
+        return aggregators
+
+    def check_round_trip(self, factory):
+        live = self.profile(factory)
+        states = [json.loads(json.dumps(stats.get_state())) for stats in self.profile(factory)]
+        for stats in live[1:]:
+            live[0].merge(stats)
+        self.assertEqual(merge_states(states).get_report(), live[0].get_report())
+        # a loaded state merges into a live aggregator too
+        mixed = self.profile(factory)[0]
+        for state in states[1:]:
+            mixed.merge(load_state(state))
+        self.assertEqual(mixed.get_report(), live[0].get_report())
+
+    def test_exact_aggregator(self):
+        self.check_round_trip(StatsAggregator)
+
+    def test_bounded_aggregator(self):
+        self.check_round_trip(lambda: BoundedStatsAggregator(scatter_samples=20, top_keys=TopKeysReport(None, k=5)))
+
+    def test_binary_keys_are_kept(self):
+        stats = merge_states([json.loads(json.dumps(stats.get_state())) for stats in self.profile(StatsAggregator)])
+        self.assertTrue(b'\xff\xfe:*' in dict((item, weight) for item, weight, error in stats.namespaces.heavy_hitters.items()))
+        self.assertTrue(b'caf\xc3\xa9:' in stats.namespaces.prefixes.root[2])
@@ -0,0 +1,186 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from rdbtools import JSONCallback, DiffCallback
+from rdbtools.output import OutputSink, CompressedFile, open_output, new_compressor, codec_for_filename, CODECS
+from tests.fixtures import dump_path, run_callback
+
+class RecordingStream(object):
+    '''A binary stream that keeps every write and flush it is given, in order'''
+    def __init__(self):
+        self.calls = []
+
+    def write(self, data):
+        self.calls.append(('write', bytes(data)))
+
+    def writelines(self, fragments):
+        self.calls.append(('writelines', b''.join(fragments)))
+
+    def flush(self):
+        self.calls.append(('flush', None))
+
+    def written(self):
+        return b''.join(data for call, data in self.calls if data)
+
+class OutputSinkTestCase(unittest.TestCase):
+    def test_small_writes_are_held_until_flush(self):
+        stream = RecordingStream()
+        sink = OutputSink(stream, buffer_size=16)
+        sink.write(b'abc')
+        sink.write(b'def')
+        self.assertEqual(stream.calls, [])
+        sink.flush()
+        self.assertEqual(stream.calls, [('write', b'abcdef'), ('flush', None)])
+        self.assertEqual(sink.fragments, 2)
+        self.assertEqual(sink.write_calls, 1)
+
+    def test_buffer_is_written_once_full(self):
+        stream = RecordingStream()
+        sink = OutputSink(stream, buffer_size=8)
+        for i in range(3):
+            sink.write(b'abc')
+        # the third write reaches the buffer size, the whole buffer goes out in one chunk
+        self.assertEqual(stream.calls, [('write', b'abcabcabc')])
+        sink.write(b'd')
+        self.assertEqual(len(stream.calls), 1)
+        sink.flush()
+        self.assertEqual(stream.written(), b'abcabcabcd')
+
+    def test_flush_without_data_only_flushes_the_stream(self):
+        stream = RecordingStream()
+        OutputSink(stream).flush()
+        self.assertEqual(stream.calls, [('flush', None)])
+
+    def test_large_writev_bypasses_the_buffer(self):
+        stream = RecordingStream()
+        sink = OutputSink(stream, buffer_size=8)
+        sink.write(b'ab')
+        sink.writev([b'0123', b'4567', b'89'])
+        # what was buffered goes first, then the fragments in a single call
+        self.assertEqual(stream.calls, [('write', b'ab'), ('writelines', b'0123456789')])
+
+    def test_small_writev_is_buffered(self):
+        stream = RecordingStream()
+        sink = OutputSink(stream, buffer_size=64)
+        sink.writev([b'a', u'b', b'c'])
+        self.assertEqual(stream.calls, [])
+        sink.flush()
+        self.assertEqual(stream.written(), b'abc')
+        self.assertEqual(sink.fragments, 3)
+
+    def test_writev_to_a_real_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            fragments = [b'%d,' % i for i in range(3000)]
+            with open(path, 'wb') as f:
+                sink = OutputSink(f, buffer_size=1024)
+                sink.write(b'[')
+                sink.writev(fragments)
+                sink.write(b']')
+                sink.flush()
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'[' + b''.join(fragments) + b']')
+        finally:
+            os.remove(path)
+
+    def test_text_stream(self):
+        out = io.StringIO()
+        sink = OutputSink(out)
+        sink.write(u'h\xe9'.encode('utf-8'))
+        sink.write(b'llo')
+        sink.flush()
+        self.assertEqual(out.getvalue(), u'h\xe9llo')
+
+    def test_wrap_keeps_a_sink(self):
+        sink = OutputSink(io.BytesIO())
+        self.assertTrue(OutputSink.wrap(sink) is sink)
+        self.assertTrue(isinstance(OutputSink.wrap(io.BytesIO()), OutputSink))
+
+    def test_callbacks_output_does_not_depend_on_the_buffer_size(self):
+        for factory in (JSONCallback, DiffCallback):
+            expected = run_callback(factory, dump_path('bulk_keys.rdb'))
+            self.assertTrue(len(expected) > 1000)
+            output = run_callback(lambda out: factory(OutputSink(out, buffer_size=7)), dump_path('bulk_keys.rdb'))
+            self.assertEqual(output, expected)
+
+
+def decompress(codec, data):
+    if codec == 'gzip':
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if codec == 'bz2':
+        import bz2
+        return bz2.decompress(data)
+    if codec == 'xz':
+        import lzma
+        return lzma.decompress(data)
+    try:
+        from compression import zstd
+        return zstd.decompress(data)
+    except ImportError:
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+
+def supported(codec):
+    try:
+        new_compressor(codec)
+        return True
+    except Exception:
+        return False
+
+class CompressedFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        data = b''.join(b'db=0 "key:%d" -> "value %d"\r\n' % (i, i * i) for i in range(20000))
+        for codec in sorted(CODECS):
+            if not supported(codec):
+                continue
+            out = io.BytesIO()
+            f = CompressedFile(out, codec, buffers=2)
+            for start in range(0, len(data), 4096):
+                f.write(data[start:start + 4096])
+            f.flush()
+            f.close()
+            self.assertEqual(decompress(codec, out.getvalue()), data, codec)
+
+    def test_open_output_picks_the_codec_from_the_extension(self):
+        self.assertEqual(codec_for_filename('dump.JSON.GZ'), 'gzip')
+        self.assertEqual(codec_for_filename('dump.zst'), 'zstd')
+        self.assertEqual(codec_for_filename('dump.json'), None)
+        path = os.path.join(self.directory, 'out.json.gz')
+        f = open_output(path, 'auto')
+        sink = OutputSink(f)
+        sink.write(b'[1,2,3]')
+        sink.flush()
+        f.close()
+        with gzip.open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'[1,2,3]')
+
+    def test_unsupported_codec_does_not_create_the_file(self):
+        path = os.path.join(self.directory, 'out.snappy')
+        self.assertRaises(Exception, open_output, path, 'snappy')
+        self.assertFalse(os.path.exists(path))
+        def missing(level):
+            raise ImportError('missing')
+        CODECS['missing'] = (missing, 1, ('.missing', ))
+        try:
+            path = os.path.join(self.directory, 'out.missing')
+            self.assertRaises(Exception, open_output, path, 'auto')
+            self.assertFalse(os.path.exists(path))
+        finally:
+            del CODECS['missing']
+
+    def test_write_after_close(self):
+        f = CompressedFile(io.BytesIO())
+        f.close()
+        self.assertRaises(ValueError, f.write, b'x')
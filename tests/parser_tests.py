@@ -0,0 +1,308 @@
+import datetime
+import io
+import random
+import struct
+import unittest
+
+from rdbtools import RdbParser, RdbCallback
+from rdbtools.parser import is_noop_method, method_reads_argument, string_to_long, EventRecorder, CALLBACK_EVENTS, \
+    REDIS_RDB_TYPE_HASH, REDIS_RDB_TYPE_HASH_ZIPMAP, REDIS_RDB_TYPE_HASH_ZIPLIST
+from tests.fixtures import dump_path, read_dump, encode_length, encode_string, string_dump
+
+class Recorder(RdbCallback):
+    '''Records every event, with the info dictionary left out'''
+    def __init__(self):
+        self.events = []
+
+    def set(self, key, value, expiry, info):
+        self.events.append(('set', key, value, expiry))
+
+    def start_hash(self, key, length, expiry, info):
+        self.events.append(('start_hash', key, length, expiry))
+
+    def hset(self, key, field, value):
+        self.events.append(('hset', key, field, value))
+
+    def end_hash(self, key):
+        self.events.append(('end_hash', key))
+
+    def start_set(self, key, cardinality, expiry, info):
+        self.events.append(('start_set', key, cardinality, expiry))
+
+    def sadd(self, key, member):
+        self.events.append(('sadd', key, member))
+
+    def end_set(self, key):
+        self.events.append(('end_set', key))
+
+    def start_list(self, key, length, expiry, info):
+        self.events.append(('start_list', key, length, expiry))
+
+    def rpush(self, key, value):
+        self.events.append(('rpush', key, value))
+
+    def end_list(self, key):
+        self.events.append(('end_list', key))
+
+    def start_sorted_set(self, key, length, expiry, info):
+        self.events.append(('start_sorted_set', key, length, expiry))
+
+    def zadd(self, key, score, member):
+        self.events.append(('zadd', key, score, member))
+
+    def end_sorted_set(self, key):
+        self.events.append(('end_sorted_set', key))
+
+    def start_database(self, db_number):
+        self.events.append(('start_database', db_number))
+
+    def end_database(self, db_number):
+        self.events.append(('end_database', db_number))
+
+def parse_events(path = dump_path('keys_of_all_types.rdb'), **kwargs):
+    recorder = Recorder()
+    RdbParser(recorder, **kwargs).parse(path)
+    return recorder.events
+
+class HashOnly(RdbCallback):
+    def __init__(self):
+        self.fields = []
+        self.infos = []
+
+    def start_hash(self, key, length, expiry, info):
+        self.infos.append(info)
+
+    def hset(self, key, field, value):
+        self.fields.append((key, field, value))
+
+class DispatchTestCase(unittest.TestCase):
+    def test_noop_methods(self):
+        class Callback(object):
+            def passes(self, key):
+                pass
+            def documented(self, key):
+                """Does nothing"""
+                pass
+            def returns(self, key):
+                return 5
+            def writes(self, key):
+                self.key = key
+        callback = Callback()
+        self.assertTrue(is_noop_method(callback.passes))
+        self.assertTrue(is_noop_method(callback.documented))
+        self.assertFalse(is_noop_method(callback.returns))
+        self.assertFalse(is_noop_method(callback.writes))
+        self.assertTrue(is_noop_method(RdbCallback.set))
+
+    def test_method_reads_argument(self):
+        class Callback(object):
+            def ignores(self, key, info):
+                return key
+            def reads(self, key, info):
+                return info['encoding']
+            def captures(self, key, info):
+                return lambda: info
+        callback = Callback()
+        self.assertFalse(method_reads_argument(callback.ignores, 'info'))
+        self.assertTrue(method_reads_argument(callback.reads, 'info'))
+        self.assertTrue(method_reads_argument(callback.captures, 'info'))
+        self.assertTrue(method_reads_argument(len, 'info'))
+
+    def test_types_without_methods_are_skipped(self):
+        callback = HashOnly()
+        parser = RdbParser(callback)
+        parser.parse(dump_path('keys_of_all_types.rdb'))
+        self.assertEqual(sorted(parser._readers), [REDIS_RDB_TYPE_HASH, REDIS_RDB_TYPE_HASH_ZIPMAP, REDIS_RDB_TYPE_HASH_ZIPLIST])
+        self.assertEqual(sorted(set(key for key, field, value in callback.fields)), [b'hash:ht', b'hash:zip', b'hash:zipmap'])
+        self.assertEqual([info['encoding'] for info in callback.infos], ['hashtable', 'zipmap', 'ziplist'])
+
+    def test_skipping_does_not_change_the_events(self):
+        events = [e for e in parse_events() if e[0] in ('start_hash', 'hset', 'end_hash')]
+        callback = HashOnly()
+        RdbParser(callback).parse(dump_path('keys_of_all_types.rdb'))
+        self.assertEqual([e[1:] for e in events if e[0] == 'hset'], callback.fields)
+
+class IntegerTestCase(unittest.TestCase):
+    def test_string_to_long(self):
+        for string, value in ((b'0', 0), (b'7', 7), (b'-7', -7), (b'12345678901', 12345678901),
+                              (b'9223372036854775807', (1 << 63) - 1), (b'-9223372036854775808', -(1 << 63))):
+            self.assertEqual(string_to_long(string), value, string)
+
+    def test_strings_redis_does_not_store_as_integers(self):
+        for string in (b'', b'-', b'-0', b'01', b'+1', b' 1', b'1 ', b'1\n', b'1.0', b'1e3', b'0x10', b'abc',
+                       b'9223372036854775808', b'-9223372036854775809', b'1' * 21):
+            self.assertEqual(string_to_long(string), None, string)
+
+    def test_integer_encoded_values_are_given_as_integers(self):
+        events = parse_events()
+        values = dict((e[1], e[2]) for e in events if e[0] == 'set')
+        self.assertEqual(values[b'str:int8'], 42)
+        self.assertEqual(values[b'str:neg'], -5)
+        self.assertEqual(values[b'str:int32'], 1234567)
+        # long integers are stored as strings
+        self.assertEqual(values[b'str:numstr'], b'99999999999')
+        self.assertEqual([e[2] for e in events if e[0] == 'rpush' and e[1] == b'list:zip'],
+                         [b'a', 5, 300, -100, 70000, 1 << 40, b'x' * 70, 100000000])
+        self.assertEqual([e[2] for e in events if e[0] == 'sadd' and e[1] == b'set:intset'], [1, 2, 3, 40000])
+
+def long_strings_dump():
+    '''Strings longer than the chunk size, one of them expiring, around a hash'''
+    return b''.join([b'REDIS0006', b'\xfe\x00',
+                     b'\x00' + encode_string(b'keep:1') + encode_string(b''.join(b'%05d' % i for i in range(2000))),
+                     b'\xfc' + struct.pack('<Q', 1500000000000) + b'\x00' + encode_string(b'keep:exp') + encode_string(b'e' * 3000),
+                     b'\x04' + encode_string(b'hash') + b'\x01' + encode_string(b'f') + encode_string(b'v' * 500),
+                     b'\x00' + encode_string(b'drop:1') + encode_string(b'd' * 7000),
+                     b'\x00' + encode_string(b'keep:short') + encode_string(b'short'),
+                     b'\xfe\x02', b'\x00' + encode_string(b'keep:2') + encode_string(b'x' * 100000),
+                     b'\xff', b'\x00' * 8])
+
+def parse_recorded(data, events = CALLBACK_EVENTS, **kwargs):
+    recorder = EventRecorder(events)
+    RdbParser(recorder, **kwargs).parse_fd(io.BytesIO(data))
+    return recorder.events
+
+def feed_recorded(data, sizes, events = CALLBACK_EVENTS, **kwargs):
+    '''The events of feeding `data` in chunks of sizes drawn from `sizes`, and the largest size of the feed buffer'''
+    recorder = EventRecorder(events)
+    parser = RdbParser(recorder, **kwargs)
+    rnd = random.Random(len(data))
+    position = 0
+    largest = 0
+    while position < len(data):
+        size = rnd.choice(sizes)
+        parser.feed(data[position:position + size])
+        position += size
+        largest = max(largest, len(parser._feed_buffer))
+    parser.close()
+    return recorder.events, largest
+
+class FeedTestCase(unittest.TestCase):
+    def check_feed(self, data, sizes, **kwargs):
+        expected = parse_recorded(data, **kwargs)
+        self.assertEqual(feed_recorded(data, sizes, **kwargs)[0], expected)
+        return expected
+
+    def test_byte_by_byte(self):
+        for name in ('keys_of_all_types.rdb', 'bulk_keys.rdb'):
+            self.check_feed(read_dump(name), [1])
+        self.check_feed(long_strings_dump(), [1], string_chunk_size=1024)
+
+    def test_random_chunks(self):
+        for sizes in ([1, 2, 3, 5, 8], [100, 1000, 5000], [1 << 20]):
+            self.check_feed(read_dump('bulk_keys.rdb'), sizes)
+            self.check_feed(read_dump('keys_of_all_types.rdb'), sizes, filters={'types' : ['hash', 'set']})
+            events = self.check_feed(long_strings_dump(), sizes, string_chunk_size=1024)
+            self.assertTrue(('set_chunk', (b'keep:2', b'x' * 1024)) in events)
+            self.check_feed(long_strings_dump(), sizes, string_chunk_size=1000, filters={'keys' : 'keep:.*'})
+            # without set_begin the strings are given whole to set
+            self.check_feed(long_strings_dump(), sizes, events=['set', 'hset'], string_chunk_size=1024)
+
+    def test_long_strings_are_not_buffered_whole(self):
+        data = long_strings_dump()
+        for filters in (None, {'dbs' : [0]}):
+            events, largest = feed_recorded(data, [4096], string_chunk_size=1024, filters=filters)
+            # a chunk fed and a string chunk, the 100000 byte value never is in the buffer at once
+            self.assertTrue(largest < 4096 + 1024, largest)
+        events, largest = feed_recorded(data, [4096], events=['set'], string_chunk_size=1024)
+        self.assertTrue(largest > 90000, largest)
+
+    def test_truncated_string(self):
+        data = long_strings_dump()
+        parser = RdbParser(EventRecorder(), string_chunk_size=1024)
+        parser.feed(data[:len(data) - 5000])
+        self.assertRaises(Exception, parser.close)
+
+class ReadOnly(object):
+    '''A file that can only be read, like a socket'''
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, n):
+        return self._data.read(n)
+
+def values_from_events(events):
+    '''{(db, key) : (type, value, expiry)} built from the events of a Recorder'''
+    values = {}
+    db = None
+    for event in events:
+        name, args = event[0], event[1:]
+        if name == 'start_database':
+            db = args[0]
+        elif name == 'set':
+            values[(db, args[0])] = ('string', args[1], args[2])
+        elif name.startswith('start_'):
+            kind = {'start_list' : 'list', 'start_set' : 'set', 'start_sorted_set' : 'sortedset', 'start_hash' : 'hash'}[name]
+            values[(db, args[0])] = (kind, [] if kind == 'list' else set() if kind == 'set' else {}, args[2])
+        elif name == 'rpush':
+            values[(db, args[0])][1].append(args[1])
+        elif name == 'sadd':
+            values[(db, args[0])][1].add(args[1])
+        elif name == 'zadd':
+            values[(db, args[0])][1][args[2]] = args[1]
+        elif name == 'hset':
+            values[(db, args[0])][1][args[1]] = args[2]
+    return values
+
+class IterKeysTestCase(unittest.TestCase):
+    def entries(self, source, filters = None):
+        return dict(((entry.db, entry.key), (entry.type, entry.value(), entry.expiry))
+                    for entry in RdbParser.iter_keys(source, filters))
+
+    def test_same_values_as_parse(self):
+        for name in ('keys_of_all_types.rdb', 'bulk_keys.rdb'):
+            expected = values_from_events(parse_events(dump_path(name)))
+            self.assertEqual(self.entries(dump_path(name)), expected)
+            self.assertEqual(self.entries(ReadOnly(read_dump(name))), expected)
+
+    def test_filters(self):
+        filters = {'dbs' : [0], 'types' : ['hash', 'sortedset'], 'keys' : '.*:(zip|skip|ht)$'}
+        expected = values_from_events(parse_events(dump_path('keys_of_all_types.rdb'), filters=filters))
+        self.assertEqual(sorted(key for db, key in expected), [b'hash:ht', b'hash:zip', b'zset:skip', b'zset:zip'])
+        self.assertEqual(self.entries(dump_path('keys_of_all_types.rdb'), filters), expected)
+
+    def test_entries(self):
+        entries = dict((entry.key, entry) for entry in RdbParser.iter_keys(ReadOnly(read_dump('keys_of_all_types.rdb'))))
+        self.assertEqual((entries[b'list:zip'].type, entries[b'list:zip'].encoding), ('list', 'ziplist'))
+        self.assertEqual(entries[b'str:plain'].raw_size, len(entries[b'str:plain'].raw_value()))
+        self.assertEqual(list(entries[b'zset:skip'].iter_elements()), [(b'z1', 1.5), (b'z2', 3)])
+        # without a file to read them again from, values are kept and can be decoded after the iteration
+        self.assertEqual(entries[b'set:intset'].value(), set([1, 2, 3, 40000]))
+
+    def test_values_are_read_again_from_files(self):
+        entries = list(RdbParser.iter_keys(dump_path('keys_of_all_types.rdb')))
+        # the file is closed once the iteration ends
+        self.assertRaises(Exception, entries[0].value)
+
+def lzf_dump(key, compressed, length):
+    '''A dump of one string stored compressed with lzf'''
+    value = b'\xc3' + encode_length(len(compressed)) + encode_length(length) + compressed
+    return b'REDIS0006\xfe\x00\x00' + encode_string(key) + value + b'\xff' + b'\x00' * 8
+
+def parse_dump(data):
+    recorder = Recorder()
+    RdbParser(recorder).parse_fd(io.BytesIO(data))
+    return [e for e in recorder.events if e[0] == 'set']
+
+class BytesTestCase(unittest.TestCase):
+    def test_keys_and_values_are_bytes(self):
+        for name in ('keys_of_all_types.rdb', 'bulk_keys.rdb'):
+            for event in parse_events(dump_path(name)):
+                for arg in event[1:]:
+                    self.assertTrue(arg is None or isinstance(arg, (bytes, int, float, type(1 << 64), datetime.datetime)), event)
+                if len(event) > 1 and event[0] not in ('start_database', 'end_database'):
+                    self.assertTrue(isinstance(event[1], bytes), event)
+
+    def test_binary_strings(self):
+        pairs = [(b'\xff\x00key', b'\x00\xff\r\n'), (b'caf\xc3\xa9', b'\xe9t\xe9'), (b'\x80' * 100, b'\xfe' * 1000)]
+        self.assertEqual(parse_dump(string_dump([(0, pairs)])), [('set', key, value, None) for key, value in pairs])
+
+    def test_lzf_strings(self):
+        # a literal run, a back reference that overlaps what it copies, a literal run and a plain back reference
+        compressed = b'\x02abc' + b'\xe0\x30\x02' + b'\x01\xff\xfe' + b'\x20\x3c'
+        events = parse_dump(lzf_dump(b'\xfflzf', compressed, 65))
+        self.assertEqual(events, [('set', b'\xfflzf', b'abc' * 20 + b'\xff\xfe' + b'bca', None)])
+        self.assertTrue(isinstance(events[0][2], bytes))
+
+    def test_lzf_errors(self):
+        self.assertRaises(Exception, parse_dump, lzf_dump(b'bad', b'\x00a\x20\x05', 4))
+        self.assertRaises(Exception, parse_dump, lzf_dump(b'short', b'\x02abc', 4))
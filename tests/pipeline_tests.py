@@ -0,0 +1,53 @@
+import io
+import unittest
+
+from rdbtools import JSONCallback, JSONLinesCallback, DiffCallback, ProtocolCallback
+from rdbtools.pipeline import PipelineParser, PIPELINE_AVAILABLE
+from tests.fixtures import dump_path, read_dump, run_callback, string_dump
+from tests.parser_tests import long_strings_dump
+
+FACTORIES = (JSONCallback, JSONLinesCallback, DiffCallback, ProtocolCallback)
+
+def run_pipeline(factory, source, **kwargs):
+    '''The output of PipelineParser over `source`, a file name or the bytes of a dump'''
+    out = io.BytesIO()
+    parser = PipelineParser(factory, out, **kwargs)
+    if isinstance(source, bytes) and source.startswith(b'REDIS'):
+        parser.parse_fd(io.BytesIO(source))
+    else:
+        parser.parse(source)
+    return out.getvalue()
+
+@unittest.skipUnless(PIPELINE_AVAILABLE, 'the pipeline mode needs python 3.8 or later')
+class PipelineParserTestCase(unittest.TestCase):
+    def test_same_output_as_rdb_parser(self):
+        for name in ('keys_of_all_types.rdb', 'bulk_keys.rdb'):
+            for factory in FACTORIES:
+                expected = run_callback(factory, dump_path(name))
+                # small batches, so that every formatter gets batches after the first one
+                for formatters in (1, 2, 3):
+                    self.assertEqual(run_pipeline(factory, dump_path(name), formatters=formatters, batch_events=7), expected,
+                                     (name, factory, formatters))
+
+    def test_filters(self):
+        for filters in ({'dbs' : [2]}, {'types' : ['hash', 'sortedset']}, {'keys' : 'bulk:1.*'}):
+            for factory in FACTORIES:
+                self.assertEqual(run_pipeline(factory, dump_path('bulk_keys.rdb'), filters=filters, batch_events=5),
+                                 run_callback(factory, dump_path('bulk_keys.rdb'), filters=filters), (filters, factory))
+
+    def test_streamed_strings(self):
+        dump = long_strings_dump()
+        binary = string_dump([(0, [(b'\xff%d' % i, b'\xe4\xb8\xad\xff' * (i * 50)) for i in range(10)])])
+        for data in (dump, binary):
+            for factory in FACTORIES:
+                self.assertEqual(run_pipeline(factory, data, string_chunk_size=100, batch_events=3),
+                                 run_callback(factory, data, string_chunk_size=100), factory)
+
+    def test_small_rings(self):
+        # batches and outputs larger than the rings go through them in several parts
+        expected = run_callback(JSONCallback, dump_path('bulk_keys.rdb'))
+        self.assertEqual(run_pipeline(JSONCallback, dump_path('bulk_keys.rdb'), ring_size=256, batch_events=50), expected)
+
+    def test_corrupt_dump(self):
+        data = read_dump('bulk_keys.rdb')
+        self.assertRaises(Exception, run_pipeline, JSONCallback, data[:len(data) // 2], formatters=2)
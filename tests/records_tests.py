@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdbtools import RdbParser, MemoryCallback
+from rdbtools.records import RecordWriter, RecordFile
+from tests.fixtures import dump_path
+from tests.memprofiler_tests import memory_records
+
+class RecordFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'keys.rec')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, **kwargs):
+        with open(self.path, 'wb') as f:
+            writer = RecordWriter(f, **kwargs)
+            RdbParser(MemoryCallback(writer, 64)).parse(dump_path('bulk_keys.rdb'))
+        return writer
+
+    def expected(self, min_bytes = 0, min_elements = 0):
+        # the file has neither expiry nor fractions of bytes
+        return [r._replace(bytes=int(r.bytes), expiry=None) for r in memory_records(dump_path('bulk_keys.rdb'))
+                if r.bytes >= min_bytes and r.size >= min_elements]
+
+    def test_round_trip(self):
+        writer = self.write(block_rows=7)
+        expected = self.expected()
+        self.assertEqual(writer.rows, len(expected))
+        with RecordFile(self.path) as records:
+            self.assertEqual(len(records), len(expected))
+            self.assertEqual(list(records), expected)
+            for index in (0, 6, 7, 100, len(expected) - 1, -1, -len(expected)):
+                self.assertEqual(records[index], expected[index], index)
+            self.assertRaises(IndexError, records.__getitem__, len(expected))
+            self.assertEqual(list(records.column('bytes')), [r.bytes for r in expected])
+            self.assertEqual(list(records.column('database')), [r.database for r in expected])
+
+    def test_thresholds(self):
+        self.write(min_bytes=300, min_elements=2)
+        expected = self.expected(300, 2)
+        self.assertTrue(0 < len(expected) < len(self.expected()))
+        with RecordFile(self.path) as records:
+            self.assertEqual(list(records), expected)
+
+    def test_empty_dump(self):
+        with open(self.path, 'wb') as f:
+            writer = RecordWriter(f)
+            writer.end_rdb()
+        with RecordFile(self.path) as records:
+            self.assertEqual(len(records), 0)
+            self.assertEqual(list(records), [])
+
+    def test_not_a_record_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'REDIS0006' + b'\0' * 40)
+        self.assertRaises(Exception, RecordFile, self.path)
+        with open(self.path, 'wb') as f:
+            writer = RecordWriter(f)
+            RdbParser(MemoryCallback(writer, 64)).parse(dump_path('keys_of_all_types.rdb'))
+        with open(self.path, 'rb+') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        self.assertRaises(Exception, RecordFile, self.path)
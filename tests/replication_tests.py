@@ -0,0 +1,81 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdbtools import RdbParser, JSONCallback, DiffCallback
+from rdbtools.replication import ReplicationStream, parse_replica
+from rdbtools.resp import RespConnection
+from tests.fixtures import dump_path, read_dump, run_callback
+from tests.live_tests import run
+from tests.standin import StandinServer, FRAMING_LENGTH, FRAMING_EOF, FRAMING_SYNC
+
+FRAMINGS = (FRAMING_LENGTH, FRAMING_EOF, FRAMING_SYNC)
+
+class SmallReads(object):
+    '''A buffered file whose read1 returns at most `size` bytes at once'''
+    def __init__(self, data, size):
+        self._data = io.BytesIO(data)
+        self._size = size
+
+    def read1(self, n):
+        return self._data.read(min(n, self._size))
+
+class ReplicationStreamTestCase(unittest.TestCase):
+    def test_payload_ends_at_the_mark(self):
+        mark = b'0123456789abcdefghijklmnopqrstuvwxyzABCD'
+        # the payload holds the start of the mark, which must not end it
+        payload = b'REDIS0006' + mark[:39] + b'x' * 70000 + mark[:20]
+        for size in (1, 7, 65536):
+            tee = io.BytesIO()
+            stream = ReplicationStream(SmallReads(payload + mark + b'*1\r\n$4\r\nPING\r\n', size), eof_mark=mark, tee=tee)
+            self.assertEqual(io.BufferedReader(stream, 4096).read(), payload, size)
+            self.assertEqual(tee.getvalue(), payload)
+            self.assertEqual(stream.bytes_read, len(payload))
+
+    def test_length_framing(self):
+        stream = ReplicationStream(SmallReads(b'abcdef+PING\r\n', 2), length=6)
+        self.assertEqual(io.BufferedReader(stream).read(), b'abcdef')
+
+    def test_truncated_payload(self):
+        stream = ReplicationStream(SmallReads(b'abc', 2), length=6)
+        self.assertRaises(IOError, io.BufferedReader(stream).read)
+        stream = ReplicationStream(SmallReads(b'abc' * 100, 2), eof_mark=b'm' * 40)
+        self.assertRaises(IOError, io.BufferedReader(stream).read)
+
+class ParseReplicaTestCase(unittest.TestCase):
+    def test_same_output_as_the_file(self):
+        for name in ('keys_of_all_types.rdb', 'bulk_keys.rdb'):
+            expected = run_callback(JSONCallback, dump_path(name))
+            for framing in FRAMINGS:
+                with StandinServer(dump_path(name), framing) as server:
+                    out, tee = io.BytesIO(), io.BytesIO()
+                    with RespConnection(port=server.port) as redis:
+                        stream = parse_replica(RdbParser(JSONCallback(out)), redis, tee)
+                self.assertEqual(out.getvalue(), expected, (name, framing))
+                self.assertEqual(tee.getvalue(), read_dump(name), (name, framing))
+                self.assertEqual(stream.bytes_read, len(read_dump(name)))
+                commands = [args[0] for args in server.commands]
+                self.assertEqual(commands[-1], b'SYNC' if framing == FRAMING_SYNC else b'PSYNC')
+
+class ReplicaCommandTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replica_and_save(self):
+        path = dump_path('bulk_keys.rdb')
+        for framing in (FRAMING_EOF, FRAMING_SYNC):
+            save = os.path.join(self.directory, '%s.rdb' % framing)
+            # rdb appends to its output file
+            output = os.path.join(self.directory, '%s.txt' % framing)
+            with StandinServer(path, framing, password='secret') as server:
+                run('rdbtools.cli.rdb', '-c', 'diff', '-f', output, '--replica', '127.0.0.1:%d' % server.port,
+                    '--password', 'secret', '--save', save)
+            with open(output, 'rb') as f:
+                self.assertEqual(f.read(), run_callback(DiffCallback, path))
+            with open(save, 'rb') as f:
+                self.assertEqual(f.read(), read_dump('bulk_keys.rdb'))
@@ -0,0 +1,76 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from rdbtools import RdbParser, MemoryCallback, StatsAggregator, BoundedStatsAggregator, TopKeysReport
+from rdbtools.report import write_report, load_template
+from tests.fixtures import dump_path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def report_data(html):
+    '''The json of the report in `html`, the text written by write_report'''
+    head, tail = load_template()
+    html = html.decode('utf-8')
+    assert html.startswith(head) and html.endswith(tail)
+    return json.loads(html[len(head):len(html) - len(tail)])
+
+def profile(stats, path = dump_path('bulk_keys.rdb')):
+    RdbParser(MemoryCallback(stats, 64)).parse(path)
+    return stats
+
+class WriteReportTestCase(unittest.TestCase):
+    def test_data_is_in_the_template(self):
+        report = {'aggregates' : {'type_count' : {'hash' : 3}}, 'scatters' : {'list_memory_by_length' : [[1, 2]]}}
+        out = io.BytesIO()
+        write_report(report, out)
+        self.assertEqual(report_data(out.getvalue()), report)
+
+    def test_keys_cannot_end_the_script(self):
+        out = io.BytesIO()
+        write_report({'key' : '</script><script>alert(1)'}, out)
+        self.assertFalse(b'</script><script>alert' in out.getvalue())
+        self.assertEqual(report_data(out.getvalue()), {'key' : '</script><script>alert(1)'})
+
+class ReportSizeTestCase(unittest.TestCase):
+    def check_capped(self, report, max_points, max_rows):
+        for heading, points in report['scatters'].items():
+            self.assertTrue(0 < len(points) <= max_points, heading)
+        self.assertTrue(0 < len(report['namespaces']['prefixes']) <= max_rows)
+        self.assertTrue(0 < len(report['namespaces']['heavy_hitters']) <= max_rows)
+
+    def test_exact_report_is_capped(self):
+        stats = profile(StatsAggregator())
+        self.assertTrue(max(len(points) for points in stats.scatters.values()) > 5)
+        self.check_capped(stats.get_report(max_points=5, max_rows=3), 5, 3)
+
+    def test_bounded_report_is_capped(self):
+        report = profile(BoundedStatsAggregator(top_keys=TopKeysReport(None, 10))).get_report(max_points=5, max_rows=3)
+        self.check_capped(report, 5, 3)
+        for metrics in report['top_keys'].values():
+            for keys in metrics.values():
+                self.assertTrue(len(keys) <= 3)
+        self.assertEqual(report['aggregates'], profile(StatsAggregator()).aggregates)
+
+class RedisProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_html_report(self):
+        path = os.path.join(self.directory, 'report.html')
+        subprocess.check_call([sys.executable, '-m', 'rdbtools.cli.redis_profiler', '-f', path, '--max-points', '7',
+                               '--max-rows', '4', dump_path('bulk_keys.rdb')], cwd=ROOT)
+        with open(path, 'rb') as f:
+            report = report_data(f.read())
+        self.assertEqual(sorted(report), ['aggregates', 'histograms', 'namespaces', 'percentiles', 'scatters', 'top_keys'])
+        self.assertEqual(sum(report['aggregates']['type_count'].values()), 324)
+        self.assertTrue(all(len(points) <= 7 for points in report['scatters'].values()))
+        self.assertTrue(len(report['namespaces']['prefixes']) <= 4)
@@ -0,0 +1,73 @@
+import socket
+import threading
+import unittest
+
+from rdbtools.resp import RespConnection, RespError, encode_command
+
+class CannedServer(object):
+    '''
+    Accepts a single connection, and answers the first bytes it receives with `reply`,
+    then closes the connection.
+    '''
+    def __init__(self, reply):
+        self.reply = reply
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(1)
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self.serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def serve(self):
+        connection, address = self._sock.accept()
+        try:
+            connection.recv(65536)
+            connection.sendall(self.reply)
+        finally:
+            connection.close()
+            self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._thread.join()
+
+def replies(canned, commands):
+    with CannedServer(canned) as server:
+        with RespConnection(port=server.port) as redis:
+            return redis.pipeline(commands)
+
+class RespConnectionTestCase(unittest.TestCase):
+    def test_encode_command(self):
+        self.assertEqual(encode_command(['SCAN', b'0', 'COUNT', 10]), b'*4\r\n$4\r\nSCAN\r\n$1\r\n0\r\n$5\r\nCOUNT\r\n$2\r\n10\r\n')
+        self.assertEqual(encode_command([b'DUMP', b'\xff\r\n']), b'*2\r\n$4\r\nDUMP\r\n$3\r\n\xff\r\n\r\n')
+
+    def test_replies(self):
+        canned = b'+OK\r\n:-7\r\n$3\r\n\x00\r\n\r\n$-1\r\n*2\r\n$1\r\na\r\n*0\r\n*-1\r\n'
+        self.assertEqual(replies(canned, [('PING', )] * 6), [b'OK', -7, b'\x00\r\n', None, [b'a', []], None])
+
+    def test_error_replies(self):
+        # errors come back in their place in a pipeline, and the replies after them are still read
+        result = replies(b'$1\r\nx\r\n-ERR unknown command\r\n:1\r\n', [('GET', 'a'), ('NOPE', ), ('EXISTS', 'a')])
+        self.assertEqual(result[0], b'x')
+        self.assertTrue(isinstance(result[1], RespError))
+        self.assertEqual(str(result[1]), 'ERR unknown command')
+        self.assertEqual(result[2], 1)
+        # they are raised by execute
+        with CannedServer(b'-NOAUTH Authentication required.\r\n') as server:
+            with RespConnection(port=server.port) as redis:
+                self.assertRaises(RespError, redis.execute, 'DBSIZE')
+
+    def test_connection_dropped_mid_pipeline(self):
+        # after a whole reply, in the middle of a bulk string, and in the middle of a line
+        for canned in (b'$1\r\nx\r\n', b'$1\r\nx\r\n$10\r\nabc', b'$1\r\nx\r\n:12'):
+            self.assertRaises(IOError, replies, canned, [('GET', 'a'), ('GET', 'b')])
+
+    def test_invalid_reply(self):
+        self.assertRaises(IOError, replies, b'?what\r\n', [('PING', )])
+        with CannedServer(b'$1\r\nx\r\n') as server:
+            with RespConnection(port=server.port) as redis:
+                self.assertEqual(redis.pipeline([]), [])
+                self.assertEqual(redis.execute('GET', 'a'), b'x')
@@ -0,0 +1,224 @@
+import json
+import random
+import unittest
+
+from rdbtools import RdbParser, MemoryCallback, StatsAggregator, BoundedStatsAggregator
+from rdbtools.sketches import LogHistogram, ReservoirSample, TopK, PrefixTrie, SpaceSaving
+from tests.fixtures import dump_path
+
+def aggregate(stats, path = dump_path('bulk_keys.rdb')):
+    RdbParser(MemoryCallback(stats, 64)).parse(path)
+    return stats
+
+class LogHistogramTestCase(unittest.TestCase):
+    def test_buckets_hold_their_values(self):
+        histogram = LogHistogram(precision=3)
+        for value in list(range(100)) + [1000, 12345, 1 << 40, (1 << 64) - 1]:
+            low, high = histogram.bucket_bounds(histogram.bucket(value))
+            self.assertTrue(low <= value <= high, (value, low, high))
+            # a bucket is never wider than an eighth of its values
+            self.assertTrue(high - low <= max(low, 1) // 8, (value, low, high))
+
+    def test_quantiles(self):
+        rnd = random.Random(1)
+        values = [int(rnd.lognormvariate(8, 2)) for i in range(20000)]
+        histogram = LogHistogram()
+        for value in values:
+            histogram.add(value)
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertTrue(abs(histogram.quantile(q) - exact) <= 0.04 * exact, (q, histogram.quantile(q), exact))
+        self.assertEqual(histogram.max, values[-1])
+        self.assertTrue(histogram.quantile(1) <= values[-1])
+        self.assertEqual(histogram.count, len(values))
+        self.assertEqual(histogram.total, sum(values))
+        self.assertEqual(LogHistogram().quantile(0.5), None)
+
+    def test_merge_is_the_same_as_adding_everything(self):
+        first, second, both = LogHistogram(), LogHistogram(), LogHistogram()
+        for value in range(0, 100000, 37):
+            (first if value % 2 else second).add(value)
+            both.add(value)
+        first.merge(second)
+        self.assertEqual(list(first.buckets()), list(both.buckets()))
+        self.assertEqual((first.count, first.total, first.max), (both.count, both.total, both.max))
+        self.assertRaises(Exception, first.merge, LogHistogram(precision=2))
+
+class ReservoirSampleTestCase(unittest.TestCase):
+    def test_sample_is_bounded_and_uniform(self):
+        hits = [0] * 10
+        for seed in range(300):
+            sample = ReservoirSample(5, seed)
+            for item in range(1000):
+                sample.add(item)
+            self.assertEqual(len(sample.items), 5)
+            self.assertEqual(sample.seen, 1000)
+            for item in sample.items:
+                hits[item // 100] += 1
+        # 1500 items kept, about 150 in every tenth of the stream
+        self.assertTrue(min(hits) > 100 and max(hits) < 200, hits)
+
+    def test_merge_keeps_items_in_proportion(self):
+        from_big = 0
+        for seed in range(200):
+            big, small = ReservoirSample(10, seed), ReservoirSample(10, seed + 1000)
+            for item in range(900):
+                big.add(('big', item))
+            for item in range(100):
+                small.add(('small', item))
+            big.merge(small)
+            self.assertEqual(len(big.items), 10)
+            self.assertEqual(big.seen, 1000)
+            from_big += len([item for item in big.items if item[0] == 'big'])
+        self.assertTrue(1650 < from_big < 1950, from_big)
+
+class BoundedStatsAggregatorTestCase(unittest.TestCase):
+    def test_same_totals_as_the_exact_aggregator(self):
+        exact = aggregate(StatsAggregator())
+        bounded = aggregate(BoundedStatsAggregator(scatter_samples=10))
+        self.assertEqual(bounded.aggregates, exact.aggregates)
+        for heading, sample in bounded.scatters.items():
+            self.assertTrue(len(sample.items) <= 10)
+            self.assertEqual(sample.seen, len(exact.scatters[heading]))
+        report = bounded.get_report()
+        for heading, buckets in report['histograms'].items():
+            self.assertEqual(sum(count for low, high, count in buckets), sum(exact.histograms[heading].values()))
+        self.assertEqual(report['percentiles']['hash']['count'], exact.aggregates['type_count']['hash'])
+
+class TopKTestCase(unittest.TestCase):
+    def test_keeps_the_largest(self):
+        rnd = random.Random(2)
+        weights = [rnd.randint(0, 10 ** 6) for i in range(5000)]
+        top = TopK(20)
+        for index, weight in enumerate(weights):
+            top.add(weight, index)
+        self.assertEqual([w for w, i in top.items()], sorted(weights, reverse=True)[:20])
+        self.assertEqual(top.min_weight(), sorted(weights, reverse=True)[19])
+        self.assertEqual(TopK(3).min_weight(), None)
+
+    def test_ties_keep_the_first_items(self):
+        top = TopK(2)
+        for item in ('a', 'b', 'c'):
+            top.add(1, item)
+        self.assertEqual(sorted(item for weight, item in top.items()), ['a', 'b'])
+
+    def test_merge(self):
+        first, second, both = TopK(5), TopK(5), TopK(5)
+        for i in range(100):
+            (first if i % 3 else second).add(i * 7 % 101, i)
+            both.add(i * 7 % 101, i)
+        first.merge(second)
+        self.assertEqual(first.items(), both.items())
+
+def prefix_totals(paths):
+    totals = {}
+    for path, weight in paths:
+        for depth in range(1, len(path) + 1):
+            prefix = b''.join(path[:depth])
+            nbytes, keys = totals.get(prefix, (0, 0))
+            totals[prefix] = (nbytes + weight, keys + 1)
+    return totals
+
+def random_paths(seed, n):
+    rnd = random.Random(seed)
+    return [([b'ns%d:' % int(rnd.paretovariate(1)), b'*:', b'f%d' % rnd.randint(0, 50)], rnd.randint(1, 1000))
+            for i in range(n)]
+
+class PrefixTrieTestCase(unittest.TestCase):
+    def test_totals_of_every_prefix(self):
+        paths = random_paths(1, 2000)
+        trie = PrefixTrie()
+        for path, weight in paths:
+            trie.add(path, weight)
+        expected = prefix_totals(paths)
+        self.assertEqual(dict((prefix, (nbytes, keys)) for prefix, nbytes, keys in trie.prefixes()), expected)
+        self.assertEqual(trie.nodes, len(expected))
+        self.assertEqual(trie.pruned_below, 0)
+
+    def test_pruning_keeps_the_largest_prefixes(self):
+        paths = random_paths(2, 5000)
+        trie = PrefixTrie(max_nodes=50)
+        for path, weight in paths:
+            trie.add(path, weight)
+        expected = prefix_totals(paths)
+        kept = list(trie.prefixes())
+        self.assertTrue(0 < len(kept) <= 50, len(kept))
+        self.assertTrue(trie.pruned_below > 0)
+        # the first level is never pruned once it is big enough, so its totals stay exact
+        largest = max(expected, key=lambda prefix: expected[prefix][0])
+        self.assertEqual([(nbytes, keys) for prefix, nbytes, keys in kept if prefix == largest], [expected[largest]])
+        for prefix, nbytes, keys in kept:
+            self.assertTrue(nbytes <= expected[prefix][0], prefix)
+
+    def test_merge(self):
+        paths = random_paths(3, 1000)
+        first, second, both = PrefixTrie(), PrefixTrie(), PrefixTrie()
+        for index, (path, weight) in enumerate(paths):
+            (first if index % 2 else second).add(path, weight)
+            both.add(path, weight)
+        first.merge(second)
+        self.assertEqual(sorted(first.prefixes()), sorted(both.prefixes()))
+        self.assertEqual(first.nodes, both.nodes)
+
+class SpaceSavingTestCase(unittest.TestCase):
+    def check_guarantees(self, sketch, weights):
+        total = sum(weights.values())
+        tracked = dict((item, (weight, error)) for item, weight, error in sketch.items())
+        self.assertTrue(len(tracked) <= sketch.capacity)
+        for item, weight in weights.items():
+            if weight > total / float(sketch.capacity):
+                self.assertTrue(item in tracked, item)
+            if item in tracked:
+                reported, error = tracked[item]
+                self.assertTrue(reported - error <= weight <= reported, (item, weight, reported, error))
+            else:
+                self.assertTrue(weight <= sketch.min_weight(), item)
+
+    def zipf_stream(self, seed, n):
+        rnd = random.Random(seed)
+        return [(b'item%d' % int(rnd.paretovariate(1.2)), rnd.randint(1, 100)) for i in range(n)]
+
+    def test_heavy_items_are_tracked(self):
+        stream = self.zipf_stream(4, 20000)
+        sketch = SpaceSaving(20)
+        weights = {}
+        for item, weight in stream:
+            sketch.add(item, weight)
+            weights[item] = weights.get(item, 0) + weight
+        self.assertTrue(len(weights) > 20)
+        self.check_guarantees(sketch, weights)
+        self.assertEqual(sketch.items()[0][0], b'item1')
+
+    def test_merge_keeps_the_guarantees(self):
+        first, second = SpaceSaving(20), SpaceSaving(20)
+        weights = {}
+        for index, (item, weight) in enumerate(self.zipf_stream(5, 20000)):
+            (first if index < 12000 else second).add(item, weight)
+            weights[item] = weights.get(item, 0) + weight
+        first.merge(second)
+        self.check_guarantees(first, weights)
+
+def round_trip(sketch):
+    return type(sketch).from_state(json.loads(json.dumps(sketch.get_state())))
+
+class StateTestCase(unittest.TestCase):
+    def test_prefix_trie_keeps_byte_strings(self):
+        paths = [([b'user:', b'*:', b'name'], 10), ([b'\xff\xfe:', b'caf\xc3\xa9'], 5), ([b'\xe9:', b'x'], 7)]
+        trie = PrefixTrie()
+        for path, weight in paths:
+            trie.add(path, weight)
+        loaded = round_trip(trie)
+        self.assertEqual(sorted(loaded.prefixes()), sorted(trie.prefixes()))
+        loaded.merge(trie)
+        # the same prefixes, not one of bytes and one of text
+        self.assertEqual(sorted(loaded.prefixes()), sorted((prefix, 2 * nbytes, 2 * keys) for prefix, nbytes, keys in trie.prefixes()))
+
+    def test_space_saving_keeps_byte_strings(self):
+        sketch = SpaceSaving(4)
+        for item, weight in ((b'user:*:name', 10), (b'\xff', 4), (b'\xe9t\xe9', 3), (b'other', 1)):
+            sketch.add(item, weight)
+        loaded = round_trip(sketch)
+        self.assertEqual(loaded.items(), sketch.items())
+        sketch.merge(loaded)
+        self.assertEqual(sketch.items(), [(b'user:*:name', 20, 0), (b'\xff', 8, 0), (b'\xe9t\xe9', 6, 0), (b'other', 2, 0)])
@@ -0,0 +1,72 @@
+import io
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from rdbtools import RdbParser, MemoryCallback
+from rdbtools.sqlite import SqliteWriter
+from tests.fixtures import dump_path, string_dump
+from tests.memprofiler_tests import memory_records
+from tests.report_tests import ROOT
+
+class SqliteWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'keys.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, source = dump_path('keys_of_all_types.rdb'), **kwargs):
+        parser = RdbParser(MemoryCallback(SqliteWriter(self.path, **kwargs), 64))
+        if isinstance(source, bytes) and source.startswith(b'REDIS'):
+            parser.parse_fd(io.BytesIO(source))
+        else:
+            parser.parse(source)
+
+    def query(self, sql):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(sql).fetchall()
+        finally:
+            connection.close()
+
+    def test_views(self):
+        self.load(batch_size=5)
+        records = memory_records(dump_path('keys_of_all_types.rdb'))
+        self.assertEqual(self.query("select count(*) from keys"), [(len(records), )])
+        expected = {}
+        for r in records:
+            keys, nbytes = expected.get(r.database, (0, 0))
+            expected[r.database] = (keys + 1, nbytes + int(r.bytes))
+        self.assertEqual(dict((db, (keys, nbytes)) for db, keys, nbytes in self.query("select database, keys, bytes from memory_by_database")),
+                         expected)
+        self.assertEqual(self.query("select keys, keys_without_expiry from memory_by_prefix where prefix = 'str:'"), [(11, 10)])
+        self.assertEqual(self.query("select keys, bytes from memory_by_namespace where namespace = 'user:*:name'"),
+                         [(2, sum(int(r.bytes) for r in records if r.key.endswith(b':name')))])
+        self.assertEqual(self.query("select keys from memory_by_type where type = 'set' and encoding = 'intset'"), [(2, )])
+        self.assertTrue(self.query("select expiry from keys where key = 'str:exp'")[0][0] > 0)
+
+    def test_thresholds_and_reload(self):
+        self.load()
+        self.load(min_bytes=150, min_elements=3)
+        records = memory_records(dump_path('keys_of_all_types.rdb'))
+        expected = sorted(r.key.decode('ascii') for r in records if r.bytes >= 150 and r.size >= 3)
+        # the second load replaces the rows of the first one
+        self.assertEqual(sorted(key for key, in self.query("select key from keys")), expected)
+
+    def test_binary_keys_are_blobs(self):
+        self.load(string_dump([(0, [(b'\xff\xfe:1', b'a'), (b'caf\xc3\xa9:2', b'b')])]))
+        rows = self.query("select typeof(key), typeof(prefix), prefix from keys order by key")
+        self.assertEqual(rows[0], ('text', 'text', u'caf\xe9:'))
+        self.assertEqual(rows[1][:2], ('blob', 'blob'))
+        self.assertEqual(bytes(rows[1][2]), b'\xff\xfe:')
+
+    def test_rdb_command(self):
+        subprocess.check_call([sys.executable, '-m', 'rdbtools.cli.rdb', '-c', 'sqlite:' + self.path,
+                               dump_path('bulk_keys.rdb')], cwd=ROOT)
+        self.assertEqual(self.query("select sum(keys) from memory_by_database"), [(324, )])
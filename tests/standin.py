@@ -0,0 +1,184 @@
+'''
+A stand-in for a redis server, serving the keys of a dump file, for the tests of the tools
+that read from a live server.
+
+It answers the commands those tools send : INFO, PING, AUTH, SELECT, DBSIZE, RANDOMKEY, SCAN,
+DUMP and PTTL, plus REPLCONF, PSYNC and SYNC with the dump file as the rdb payload.
+DUMP payloads are the values of the dump file as stored there, see RdbParser.iter_keys.
+A server of a newer version can be played, whose payloads carry a newer rdb version.
+'''
+import binascii
+import fnmatch
+import os
+import random
+import struct
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from rdbtools import RdbParser
+
+# How the rdb payload of a full resynchronization is sent
+FRAMING_LENGTH = 'length'
+FRAMING_EOF = 'eof'
+# a server older than 2.8, which only knows SYNC
+FRAMING_SYNC = 'sync'
+
+# PTTL of the keys that expire. Only whether a key expires matters to the memory report
+TTL = 3600000
+
+def bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    return b'$' + str(len(value)).encode('ascii') + b'\r\n' + value + b'\r\n'
+
+def array(items):
+    return b'*' + str(len(items)).encode('ascii') + b'\r\n' + b''.join(items)
+
+def integer(value):
+    return b':' + str(value).encode('ascii') + b'\r\n'
+
+class StandinServer(object):
+    '''
+    Serves the dump file `path` on a free port of 127.0.0.1 from a thread, until `stop` is called.
+    `commands` lists every command received, as lists of byte strings.
+    `redis_version` is the version INFO reports, `dump_version` the rdb version of the DUMP
+    payloads, that of the dump file by default.
+    '''
+    def __init__(self, path, framing = FRAMING_LENGTH, password = None, redis_version = '2.8.19', dump_version = None):
+        with open(path, 'rb') as f:
+            self.rdb = f.read()
+        self.framing = framing
+        self.password = password
+        self.redis_version = redis_version
+        self.commands = []
+        version = struct.pack('<H', dump_version if dump_version is not None else int(self.rdb[5:9]))
+        # db : {key : (DUMP payload, PTTL)}
+        self.databases = {}
+        for entry in RdbParser.iter_keys(path):
+            dump = struct.pack('B', entry._data_type) + entry.raw_value() + version + b'\0' * 8
+            self.databases.setdefault(entry.db, {})[entry.key] = (dump, -1 if entry.expiry is None else TTL)
+        server = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.handle(self.rfile, self.wfile)
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler, bind_and_activate=False)
+        self._server.daemon_threads = True
+        self._server.allow_reuse_address = True
+        self._server.server_bind()
+        self._server.server_activate()
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def keys(self, db):
+        return sorted(self.databases.get(db, {}))
+
+    def handle(self, rfile, wfile):
+        db = 0
+        rnd = random.Random(1)
+        authenticated = self.password is None
+        while True:
+            args = read_command(rfile)
+            if args is None:
+                return
+            self.commands.append(args)
+            name = args[0].upper()
+            if name == b'AUTH':
+                authenticated = args[1].decode('utf-8') == self.password
+                reply = b'+OK\r\n' if authenticated else b'-ERR invalid password\r\n'
+            elif not authenticated:
+                reply = b'-NOAUTH Authentication required.\r\n'
+            elif name == b'INFO':
+                reply = bulk(b'# Server\r\nredis_version:' + self.redis_version.encode('ascii') + b'\r\n')
+            elif name == b'PING':
+                reply = b'+PONG\r\n'
+            elif name == b'SELECT':
+                db = int(args[1])
+                reply = b'+OK\r\n'
+            elif name == b'DBSIZE':
+                reply = integer(len(self.keys(db)))
+            elif name == b'RANDOMKEY':
+                keys = self.keys(db)
+                reply = bulk(rnd.choice(keys) if keys else None)
+            elif name == b'SCAN':
+                reply = self.scan(db, args[1:])
+            elif name in (b'DUMP', b'PTTL'):
+                value = self.databases.get(db, {}).get(args[1])
+                if name == b'DUMP':
+                    reply = bulk(value and value[0])
+                else:
+                    reply = integer(-2 if value is None else value[1])
+            elif name == b'REPLCONF' and self.framing != FRAMING_SYNC:
+                reply = b'+OK\r\n'
+            elif name == b'PSYNC' and self.framing != FRAMING_SYNC:
+                wfile.write(b'+FULLRESYNC 0123456789012345678901234567890123456789 1\r\n')
+                self.send_rdb(wfile)
+                return
+            elif name == b'SYNC':
+                self.send_rdb(wfile)
+                return
+            else:
+                reply = b'-ERR unknown command \'' + args[0] + b'\'\r\n'
+            wfile.write(reply)
+            wfile.flush()
+
+    def scan(self, db, args):
+        cursor = int(args[0])
+        match, count = None, 10
+        for index in range(1, len(args) - 1, 2):
+            if args[index].upper() == b'MATCH':
+                match = args[index + 1].decode('latin-1')
+            elif args[index].upper() == b'COUNT':
+                count = int(args[index + 1])
+        keys = self.keys(db)
+        batch = keys[cursor:cursor + count]
+        if match is not None:
+            batch = [key for key in batch if fnmatch.fnmatchcase(key.decode('latin-1'), match)]
+        cursor += count
+        if cursor >= len(keys):
+            cursor = 0
+        return array([bulk(str(cursor).encode('ascii')), array([bulk(key) for key in batch])])
+
+    def send_rdb(self, wfile):
+        # a server sends newlines while it produces the rdb file
+        wfile.write(b'\n\n')
+        if self.framing == FRAMING_EOF:
+            mark = binascii.hexlify(os.urandom(20))
+            wfile.write(b'$EOF:' + mark + b'\r\n')
+        else:
+            wfile.write(b'$' + str(len(self.rdb)).encode('ascii') + b'\r\n')
+        for start in range(0, len(self.rdb), 4096):
+            wfile.write(self.rdb[start:start + 4096])
+            wfile.flush()
+        if self.framing == FRAMING_EOF:
+            wfile.write(mark)
+        # the replication stream follows the payload
+        wfile.write(b'*1\r\n$4\r\nPING\r\n')
+        wfile.flush()
+
+def read_command(rfile):
+    '''Reads a command sent as a RESP array of bulk strings, None when the client went away'''
+    line = rfile.readline()
+    if not line:
+        return None
+    args = []
+    for index in range(int(line[1:-2])):
+        length = int(rfile.readline()[1:-2])
+        args.append(rfile.read(length + 2)[:-2])
+    return args